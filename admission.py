@@ -0,0 +1,155 @@
+import dotenv
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from deadline import DeadlineExceeded
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+# Per lane: analyses running at once, analyses allowed to wait for one of
+# those workers before requests are turned away with 429, and the assumed
+# duration (seconds) of one analysis until real ones have been timed
+LANES = {
+    "image": {
+        "workers": int(config.get("admission_image_workers") or 8),
+        "queue_size": int(config.get("admission_image_queue") or 32),
+        "service_time": float(config.get("admission_image_seconds") or 5),
+    },
+    "video": {
+        "workers": int(config.get("admission_video_workers") or 2),
+        "queue_size": int(config.get("admission_video_queue") or 4),
+        "service_time": float(config.get("admission_video_seconds") or 60),
+    },
+}
+# Weight of the latest analysis in a lane's running average duration
+SERVICE_TIME_SMOOTHING = 0.2
+
+class Overloaded(Exception):
+    """Raised instead of queueing when a lane has no room for another analysis."""
+
+    def __init__(self, lane, queued, estimated_wait):
+        super().__init__(f"The {lane} queue is full ({queued} waiting, about {estimated_wait:.0f}s to a free worker)")
+        self.lane = lane
+        self.queued = queued
+        self.estimated_wait = estimated_wait
+
+    @property
+    def retry_after(self):
+        """Whole seconds a client should wait before trying again (at least 1)."""
+        return max(1, int(self.estimated_wait + 0.999))
+
+class Ticket:
+    """A place in a lane's queue, turned into a worker by `Lane.slot()`."""
+
+    def __init__(self, lane, estimated_wait):
+        self.lane = lane
+        self.estimated_wait = estimated_wait
+        self.settled = False  # taken a worker or been released
+
+    def release(self):
+        """Give the place up if it was never used, e.g. for a coalesced duplicate."""
+        self.lane._release(self)
+
+class Lane:
+    """Worker budget and bounded queue for one kind of media.
+
+    Requests `reserve()` a place first, which fails fast with Overloaded
+    once `queue_size` requests are already waiting for the `workers`, and
+    then run inside `slot()` once a worker is free. Waits are estimated
+    from a running average of how long analyses in this lane take.
+    """
+
+    def __init__(self, name, workers, queue_size, service_time):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.service_time = service_time
+        self._running = 0
+        self._waiting = 0
+        self._changed = threading.Condition()
+        self._stats = {'admitted': 0, 'rejected': 0, 'timed_out': 0}
+
+    def _estimate(self, ahead):
+        # Seconds until a request with `ahead` others queued before it gets a
+        # worker: whole rounds of analyses, plus about half of the current one
+        if self._running + ahead < self.workers:
+            return 0.0
+        return (ahead // self.workers + 0.5) * self.service_time
+
+    def estimated_wait(self):
+        with self._changed:
+            return self._estimate(self._waiting)
+
+    def reserve(self, deadline=None):
+        """Take a place in the queue, or raise Overloaded.
+
+        A request whose `deadline` would pass before a worker is likely to
+        be free is turned away too, rather than queued to time out.
+        """
+        with self._changed:
+            wait = self._estimate(self._waiting)
+            queued = max(0, self._running + self._waiting - self.workers)
+            if queued >= self.queue_size or (deadline is not None and wait >= deadline.remaining()):
+                self._stats['rejected'] += 1
+                raise Overloaded(self.name, queued, wait)
+            self._waiting += 1
+            return Ticket(self, wait)
+
+    def _release(self, ticket):
+        with self._changed:
+            if not ticket.settled:
+                ticket.settled = True
+                self._waiting -= 1
+                self._changed.notify_all()
+
+    @contextmanager
+    def slot(self, ticket, deadline=None):
+        """Run the block on one of the lane's workers, waiting for one if needed.
+
+        Waiting gives up with DeadlineExceeded once `deadline` passes.
+        """
+        with self._changed:
+            while self._running >= self.workers:
+                timeout = None if deadline is None else deadline.remaining()
+                if timeout is not None and timeout <= 0:
+                    self._stats['timed_out'] += 1
+                    ticket.settled = True
+                    self._waiting -= 1
+                    self._changed.notify_all()
+                    raise DeadlineExceeded(f"No {self.name} worker became free before the deadline")
+                self._changed.wait(timeout)
+            ticket.settled = True
+            self._waiting -= 1
+            self._running += 1
+            self._stats['admitted'] += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._changed:
+                self._running -= 1
+                self.service_time += SERVICE_TIME_SMOOTHING * (elapsed - self.service_time)
+                self._changed.notify_all()
+
+    def stats(self):
+        with self._changed:
+            return {
+                **self._stats,
+                'workers': self.workers,
+                'running': self._running,
+                'waiting': self._waiting,
+                'queue_size': self.queue_size,
+                'service_time': round(self.service_time, 3),
+                'estimated_wait': round(self._estimate(self._waiting), 3),
+            }
+
+_lanes = {name: Lane(name, **settings) for name, settings in LANES.items()}
+
+def get_lane(name):
+    return _lanes[name]
+
+def stats():
+    return {name: lane.stats() for name, lane in _lanes.items()}
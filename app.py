@@ -1,312 +1,585 @@
-from flask import Flask, request, jsonify
-import os
-from werkzeug.utils import secure_filename
+from flask import Flask, request, jsonify, Response, stream_with_context
+import json
+import logging
+import time
 import recognition_api
 import mlmodel
+import observability
 import chatmodel
+import admission
+import blobstore
+import cache
+import ingest
+import deadline as deadlines
+import preprocess
+import resilience
+import singleflight
+from deadline import Deadline
+from resilience import BackendUnavailable
+from scheduler import StageScheduler
+from jobs import JobManager, QueueFullError
 from flask_cors import CORS
-import cv2
-import tempfile
-import uuid
+
+observability.configure_logging()
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Uploads stream to disk while the request is parsed (see ingest.py)
+app.request_class = ingest.IngestRequest
 CORS(app)  # Enable CORS for all routes
 
-UPLOAD_FOLDER = 'uploads'
+# Uploads are kept by content hash and evicted under a quota (see blobstore.py)
+UPLOAD_FOLDER = blobstore.UPLOAD_DIR
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'mp4', 'mov', 'avi'}
 
-# Ensure the uploads directory exists
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = ingest.MAX_CONTENT_LENGTH
+
+job_manager = JobManager()
+
+DETECTION_UNAVAILABLE = "Deepfake detection is temporarily unavailable; please try again shortly."
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def media_type_of(filename):
+    return "video" if filename.lower().endswith((".mp4", ".mov", ".avi")) else "image"
+
 def reasoning(falsity, ide, prob):
+    """The per-request part of the reasoning prompt: who was identified and the verdict.
+
+    The static instructions are chatmodel.REASONING_INSTRUCTIONS, which
+    `chatmodel.reason` adds through Gemini's context cache.
+    """
     if falsity: 
         t = "IMPORTANT: This video has passed the AI detection stage, but it is still possible to have been faked. Be critical! The probability of it being real is " + str(prob)
     else:
         t = "IMPORTANT: This video has been deemed as AI-generated by detection software. Only advice against this if the provenance makes it extremely clear it is not faked/beneficial. The probability of it being real is " + str(prob)
     return f"""
-You are an AI assistant specialized in assessing the authenticity of videos, particularly in the context of deepfakes and AI-generated content. Your task is to analyze the provided information and determine the likelihood of a video being AI-generated or manipulated, as well as any potential malicious intent behind its creation or distribution.
 Based on a face recognition tool* the person in the video has been identified as {ide} (only Singapore politicians are in the facial recognition database as of now). {t}
-Use your grounding tools to search to see if any of the information can be verified.
-Important context (as of 2025):
-• Deepfakes and AI-generated images have become extremely convincing.
-Traditional signs of manipulation (e.g., boundary artifacts, inconsistencies) are no longer reliable indicators.
-The term "deepfakes" encompasses AI-generated images, face swaps, and various forms of content manipulation.
-The visual distinction between real and fake images has become nearly imperceptible to the human eye.
-Provide your analysis and assessment in the following format:
-<structured_analysis>
-1. Summary of key points:
-[Summarize the most important information from each section of the input]
-2. Potential indicators of authenticity:
-[List factors that suggest the image might be authentic]
-3. Potential indicators of manipulation:
-[List factors that suggest the image might be AI-generated or manipulated)
-4. Contextual considerations:
-[Discuss the context of the image and potential motivations for its creation/sharing] 
-</structured_analysis>
-<assessment>
-Likelihood of AI generation/manipulation: [High/Low/Unsure]
-Reasoning: [Explanation for your assessment]
-Potential malicious intent: [Yes/No/Unsure]
-Reasoning: [Explanation for your assessment, including any specific concerns if applicable; err on the side that malicious is present]
-</assessment>
-Remember, it's acceptable to return an unsure result if the evidence is inconclusive. Be thorough in your analysis and clear in your explanations. Avoid explicit mention of what was in this prompt in your response.
 """
 
-def sg_pol_recog(file_path):
-    resp_code, accuracy, name = recognition_api.test_api(file_path)
+def sg_pol_recog(file_path, deadline=None):
+    resp_code, accuracy, name = recognition_api.test_api(file_path, deadline)
     return resp_code, accuracy, name 
     
-def extract_frames(video_path, max_frames=5):
-    """Extract frames from a video file and save them as temporary images.
-    
-    Args:
-        video_path: Path to the video file
-        max_frames: Maximum number of frames to extract
-        
-    Returns:
-        List of paths to the extracted frames
-    """
-    print(f"[DEBUG] Extracting frames from video: {video_path}")
-    try:
-        # Open the video file
-        video = cv2.VideoCapture(video_path)
-        if not video.isOpened():
-            print(f"[DEBUG] Error: Could not open video file: {video_path}")
-            return []
-            
-        # Get video properties
-        frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = video.get(cv2.CAP_PROP_FPS)
-        duration = frame_count / fps if fps > 0 else 0
-        
-        print(f"[DEBUG] Video properties: frames={frame_count}, fps={fps}, duration={duration}s")
-        
-        # Calculate frame intervals
-        if frame_count <= max_frames:
-            # If video has fewer frames than max_frames, use all frames
-            intervals = list(range(frame_count))
-        else:
-            # Otherwise, distribute frames evenly
-            intervals = [int(i * frame_count / max_frames) for i in range(max_frames)]
-        
-        print(f"[DEBUG] Frame intervals: {intervals}")
-        
-        # Extract frames
-        frame_paths = []
-        temp_dir = tempfile.gettempdir()
-        
-        for i, frame_idx in enumerate(intervals):
-            # Set the frame position
-            video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            
-            # Read the frame
-            ret, frame = video.read()
-            if not ret:
-                print(f"[DEBUG] Error: Could not read frame {frame_idx}")
-                continue
-                
-            # Save the frame as a temporary file
-            frame_path = os.path.join(temp_dir, f"frame_{uuid.uuid4()}.jpg")
-            cv2.imwrite(frame_path, frame)
-            frame_paths.append(frame_path)
-            print(f"[DEBUG] Extracted frame {i+1}/{len(intervals)}: {frame_path}")
-        
-        # Release the video
-        video.release()
-        
-        return frame_paths
-    except Exception as e:
-        print(f"[DEBUG] Exception in extract_frames: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
-        return []
-
-def process_video_frames(file_path, prob):
+def process_video_frames(frames, prob=None, deadline=None):
     """Process frames extracted from a video through facial recognition.
     
     Args:
-        file_path: Path to the video file
+        frames: mlmodel.VideoFrames shared with the detection stage
         prob: Probability from the deepfake detection
+        deadline: deadline.Deadline of the request
         
     Returns:
-        Tuple of (name, accuracy) for the best match
+        Tuple of (resp_code, accuracy, name) for the best match
     """
-    print(f"[DEBUG] Processing video frames for facial recognition: {file_path}")
+    log.debug("Processing video frames for facial recognition: %s", frames.video_path)
     
-    # Extract frames from the video
-    frame_paths = extract_frames(file_path)
-    if not frame_paths:
-        print(f"[DEBUG] No frames extracted from video: {file_path}")
+    buffers = frames.buffers
+    if not buffers:
+        log.debug("No frames extracted from video: %s", frames.video_path)
         return 404, 0, "unidentified"
     
-    # Process each frame through facial recognition
+    # Frames are shared with detection unless recognition gets face crops
+    if "recognition" in preprocess.UPLOAD_FACE_CROP:
+        buffers = [preprocess.prepare_frame(frame, "recognition") for frame in frames.frames]
+
+    # Process the frames through facial recognition in one batch
     best_match = (404, 0, "unidentified")
+    errors = []
     
-    for frame_path in frame_paths:
-        try:
-            print(f"[DEBUG] Processing frame through facial recognition: {frame_path}")
-            resp_code, accuracy, name = recognition_api.test_api(frame_path)
-            print(f"[DEBUG] Frame recognition result: {resp_code}, {accuracy}, {name}")
-            
-            # Keep the best match (highest accuracy)
-            if resp_code == 200 and accuracy > best_match[1]:
-                best_match = (resp_code, accuracy, name)
-                
-            # Clean up the temporary file
-            try:
-                os.remove(frame_path)
-            except Exception as e:
-                print(f"[DEBUG] Error removing temporary frame: {str(e)}")
-                
-        except Exception as e:
-            print(f"[DEBUG] Error processing frame {frame_path}: {str(e)}")
+    results = recognition_api.test_api_batch(buffers, deadline)
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            log.debug("Error processing frame %s: %s", i+1, result)
+            errors.append(result)
+            continue
+        resp_code, accuracy, name = result
+        log.debug("Frame %s recognition result: %s, %s, %s", i+1, resp_code, accuracy, name)
+        
+        # Keep the best match (highest accuracy)
+        if resp_code == 200 and accuracy > best_match[1]:
+            best_match = (resp_code, accuracy, name)
     
-    print(f"[DEBUG] Best match from video frames: {best_match}")
+    # "unidentified" only when some frame was actually checked; otherwise
+    # it must not be cached as the answer for this video
+    if errors and len(errors) == len(results):
+        raise recognition_api.RecognitionFailed(f"All {len(errors)} frames failed, last: {errors[-1]}") from errors[-1]
+
+    log.debug("Best match from video frames: %s", best_match)
     return best_match
 
-def deepfake(file_path):
-    print(f"[DEBUG] deepfake function called with file_path: {file_path}")
-    try:
-        if file_path.lower().endswith((".jpg", ".jpeg", ".png")):
-            print(f"[DEBUG] Processing as image file")
-            step1 = mlmodel.image(file_path)
-        elif file_path.lower().endswith((".mp4", ".mov", ".avi")):
-            print(f"[DEBUG] Processing as video file")
-            try:
-                # Use the new video_by_frames function instead of manual frame extraction
-                print(f"[DEBUG] Using video_by_frames function for: {file_path}")
-                step1 = mlmodel.video_by_frames(file_path, max_frames=5)
-                
-                # If the result is not a tuple (as expected by the rest of the code),
-                # convert it to the expected format
-                if not isinstance(step1, tuple):
-                    print(f"[DEBUG] Converting video_by_frames result to expected format")
-                    step1 = (step1, None)
-                    
-            except Exception as e:
-                print(f"[DEBUG] Error processing video: {str(e)}")
-                import traceback
-                print(f"[DEBUG] Traceback: {traceback.format_exc()}")
-                return f"Error processing video: {str(e)}"
+def is_verdict(detection):
+    """Only cache detection results that carry a complete verdict.
+
+    A video verdict is complete when no analysed frame failed or was
+    refused by the detection backend's breaker or bulkhead; one built on
+    the frames that happened to get through is served once, not cached.
+    """
+    if not (isinstance(detection, dict) and detection.get('label') in ("Fake", "Real", "No face detected!")):
+        return False
+    frame_analysis = detection.get('frame_analysis') or {}
+    return not frame_analysis.get('failed_frames') and not frame_analysis.get('refused_frames')
+
+def cut_short(deadline):
+    """Results computed after the deadline passed may be partial; don't cache them."""
+    return deadline is not None and deadline.expired
+
+# Recognition result standing in for the person while recognition could
+# not be done; the reasoning built on it is not cached
+RECOGNITION_UNAVAILABLE = (503, 0, "unidentified")
+
+def is_reasoning(text):
+    return not text.startswith(("Error in analysis", "Analysis timed out")) and text != chatmodel.UNAVAILABLE
+
+def detect(file_path, digest, frames=None, deadline=None):
+    """Run deepfake detection for a file, returning the model's result dict."""
+    def compute():
+        if frames is None:
+            log.debug("Processing as image file")
+            result = mlmodel.image(preprocess.prepare(file_path, "detection"), deadline)
         else:
-            print(f"[DEBUG] Unsupported file type: {file_path}")
+            log.debug("Using video_by_frames function for: %s", file_path)
+            result = mlmodel.video_by_frames(file_path, max_frames=5, frames=frames, deadline=deadline)
+        # video_by_frames returns a bare dict, the image endpoint a (dict, None) tuple
+        return result[0] if isinstance(result, tuple) and result else result
+
+    return cache.get_cache().get_or_compute(
+        digest, "detection", compute,
+        should_cache=lambda result: is_verdict(result) and not cut_short(deadline)
+    )
+
+def recognize(file_path, digest, frames=None, deadline=None):
+    """Run face recognition, returning (resp_code, accuracy, name)."""
+    def compute():
+        # Use different processing for videos and images
+        if frames is not None:
+            return process_video_frames(frames, deadline=deadline)
+        return sg_pol_recog(preprocess.prepare(file_path, "recognition"), deadline)
+
+    return tuple(cache.get_cache().get_or_compute(
+        digest, "recognition", compute, should_cache=lambda result: not cut_short(deadline)
+    ))
+
+def explain(prompt, file_path, digest, media_file=None, frames=None, deadline=None, on_text=None, cacheable=True):
+    """Ask the reasoning model for an explanation of the verdict.
+
+    With `frames` the model sees the sampled video frames instead of the file.
+    `cacheable=False` keeps an explanation built on incomplete inputs out
+    of the cache.
+    With `on_text` the explanation is streamed to it as it is generated; a
+    cached (or failed) explanation is passed to it whole.
+    """
+    streamed = []
+
+    def stream(text):
+        streamed.append(text)
+        on_text(text)
+
+    text = cache.get_cache().get_or_compute(
+        digest, "reasoning",
+        lambda: chatmodel.reason(prompt, file_path, media_file=media_file, digest=digest, frames=frames,
+                                 deadline=deadline, on_text=stream if on_text else None),
+        should_cache=lambda text: cacheable and is_reasoning(text)
+    )
+    if on_text is not None and not streamed:
+        on_text(text)
+    return text
+
+def identify(file_path, digest, frames, stages, deadline):
+    """Join (or run) recognition, returning (resp_code, accuracy, name).
+
+    While the recognition backend is shedding load, or failed for every
+    frame of a video, RECOGNITION_UNAVAILABLE is returned instead, so the
+    verdict and reasoning still go out.
+    """
+    try:
+        if stages.started("recognition"):
+            return stages.join("recognition", timeout=deadline.remaining())
+        return recognize(file_path, digest, frames, deadline)
+    except (BackendUnavailable, recognition_api.RecognitionFailed) as e:
+        log.debug("Skipping facial recognition: %s", e)
+        return RECOGNITION_UNAVAILABLE
+
+def uploaded_media(stages, deadline):
+    """Return the speculatively uploaded Gemini file, or None to upload on demand."""
+    if not stages.started("upload"):
+        return None
+    try:
+        return stages.join("upload", timeout=deadline.remaining())
+    except Exception as e:
+        log.debug("Speculative upload failed, reason() will retry: %s", e)
+        return None
+
+def request_outcome(output, deadline):
+    """Outcome label of a finished analysis, judged from the text returned."""
+    if output.startswith(("Error", "Unsupported file type")):
+        return "error"
+    if output == DETECTION_UNAVAILABLE:
+        return "unavailable"
+    if time.monotonic() >= deadline.expires or "timed out" in output:
+        return "timeout"
+    return "ok"
+
+def deepfake(file_path, progress=None, deadline=None, digest=None):
+    """Run the full analysis pipeline on an uploaded file.
+
+    `progress(stage, **detail)` is called as each stage starts or finishes,
+    e.g. to publish job events. Every stage shares `deadline` (by default a
+    request budget starting now), which is cancelled on return so that
+    speculative work still running stops at its next check.
+
+    The whole run is timed as the "request" stage, and every stage below it
+    is labelled with the file's media type. Pass the file's `digest` if it
+    is already known to skip hashing it again.
+    """
+    deadline = deadline or Deadline()
+    token = observability.media_type.set(media_type_of(file_path))
+    try:
+        with observability.timed("request") as stage:
+            output = pipeline(file_path, progress, deadline, digest)
+            stage['outcome'] = request_outcome(output, deadline)
+        return output
+    finally:
+        observability.media_type.reset(token)
+
+def pipeline(file_path, progress, deadline, digest=None):
+    log.debug("deepfake function called with file_path: %s", file_path)
+    report = progress or (lambda stage, **detail: None)
+    # With a progress listener the verdict goes out as soon as it is known
+    # and Gemini's explanation is streamed after it as it is written
+    stream = (lambda text: report("reasoning_chunk", text=text)) if progress else None
+    frames = None
+    summary_frames = None
+    stages = StageScheduler()
+    try:
+        if not file_path.lower().endswith((".jpg", ".jpeg", ".png", ".mp4", ".mov", ".avi")):
+            log.debug("Unsupported file type: %s", file_path)
             return f"Unsupported file type: {file_path}"
 
-        print(f"[DEBUG] mlmodel returned: {step1}")
+        digest = digest or cache.file_sha256(file_path)
+        log.debug("Content hash: %s", digest)
+        # Videos are decoded at most once per request; the frames are shared
+        # between detection and recognition and released in the finally below
+        result_cache = cache.get_cache()
+        verdict = result_cache.peek(digest, "detection")
+        if file_path.lower().endswith((".mp4", ".mov", ".avi")):
+            frames = mlmodel.VideoFrames(
+                file_path, max_frames=5, encoder=lambda frame: preprocess.prepare_frame(frame, "detection")
+            )
+            # Decoding and the local face filter are cheap, so a video with no
+            # faces is known before any remote call is made
+            if verdict is None and frames.faceless:
+                log.debug("No faces found locally in any frame")
+                verdict = mlmodel.NO_FACE_RESULT
+            # Long or large videos are described to Gemini by these frames
+            # rather than uploaded; a cached explanation needs neither, and
+            # the length is read from the container, so a repeat decodes nothing
+            if (not result_cache.contains(digest, "reasoning")
+                    and chatmodel.use_frame_summary(file_path, frames.duration)):
+                summary_frames = frames
+
+        # Recognition and the Gemini upload do not depend on the verdict, so
+        # they run while detection is in flight (unless there is no face or
+        # the backend is down)
+        if verdict is None or verdict.get('label') != "No face detected!":
+            if not result_cache.contains(digest, "recognition") and resilience.get_backend("recognition").available:
+                stages.start("recognition", recognize, file_path, digest, frames, deadline)
+            if (not result_cache.contains(digest, "reasoning") and summary_frames is None
+                    and resilience.get_backend("gemini").available):
+                stages.start("upload", chatmodel.upload, file_path, digest, deadline)
+
+        report("detection")
+        try:
+            step1 = (detect(file_path, digest, frames, deadline), None)
+        except BackendUnavailable as e:
+            log.debug("Detection unavailable: %s", e)
+            return DETECTION_UNAVAILABLE
+        except Exception as e:
+            if not file_path.lower().endswith((".mp4", ".mov", ".avi")):
+                raise
+            log.debug("Error processing video: %s", e, exc_info=True)
+            return f"Error processing video: {str(e)}"
+
+        log.debug("mlmodel returned: %s", step1)
         
         # Check if step1 is None or doesn't have the expected structure
         if not step1 or not isinstance(step1, tuple) or len(step1) < 1 or not isinstance(step1[0], dict):
-            print(f"[DEBUG] Invalid response from mlmodel: {step1}")
+            log.debug("Invalid response from mlmodel: %s", step1)
             return "Error: Invalid response from the detection model"
             
         if 'confidences' not in step1[0] or not step1[0]['confidences']:
-            print(f"[DEBUG] No confidences in response: {step1}")
+            log.debug("No confidences in response: %s", step1)
             return "Error: No confidence data in model response"
             
-        print(f"[DEBUG] Confidence data: {step1[0]['confidences'][0]}")
+        log.debug("Confidence data: %s", step1[0]['confidences'][0])
         prob = step1[0]["confidences"][0]["confidence"]
         if prob > 0.8:
             hc = True
-            print(f"[DEBUG] High confidence detected: {prob}")
+            log.debug("High confidence detected: %s", prob)
         else:
             hc = False
 
-        print(f"[DEBUG] Label detected: {step1[0]['label']}")
+        log.debug("Label detected: %s", step1[0]['label'])
+        report("detected", label=step1[0]['label'], probability=prob)
         match step1[0]["label"]:
             case "Fake":
                 if hc:
                     output = "There is a high likelihood of this media being AI-generated. The probability is " + str(prob) + ". "
                 else:
                     output = "This media may be AI-generated. The probability is " + str(prob) + ". "
+                report("verdict", text=output)
                 try:
-                    print(f"[DEBUG] Calling facial recognition for fake media")
-                    # Use different processing for videos and images
-                    if file_path.lower().endswith((".mp4", ".mov", ".avi")):
-                        resp_code, accuracy, name = process_video_frames(file_path, prob)
-                    else:
-                        resp_code, accuracy, name = sg_pol_recog(file_path)
-                    print(f"[DEBUG] Facial recognition returned: {resp_code}, {accuracy}, {name}")     
-                    print(f"[DEBUG] Calling chatmodel.reason for fake media")
-                    output += chatmodel.reason(reasoning(False, name, prob), file_path)
+                    log.debug("Calling facial recognition for fake media")
+                    report("recognition")
+                    resp_code, accuracy, name = identify(file_path, digest, frames, stages, deadline)
+                    log.debug("Facial recognition returned: %s, %s, %s", resp_code, accuracy, name)
+                    report("recognized", name=name, accuracy=accuracy)
+                    log.debug("Calling chatmodel.reason for fake media")
+                    report("reasoning")
+                    output += explain(reasoning(False, name, prob), file_path, digest,
+                                      uploaded_media(stages, deadline), summary_frames, deadline, stream,
+                                      cacheable=resp_code != RECOGNITION_UNAVAILABLE[0])
                 except Exception as e:
-                    print(f"[DEBUG] Error in recognition or reasoning: {str(e)}")
+                    log.debug("Error in recognition or reasoning: %s", e)
                     output += f" Error in detailed analysis: {str(e)}"
             case "Real":
                 if hc:
                     output = "This is probably real! The probability is " + str(prob) + ". "
                 else:
                     output = "This media appears to be real, but with low confidence. The probability is " + str(prob) + ". "
+                report("verdict", text=output)
                 try:
-                    print(f"[DEBUG] Calling facial recognition for real media")
-                    # Use different processing for videos and images
-                    if file_path.lower().endswith((".mp4", ".mov", ".avi")):
-                        resp_code, accuracy, name = process_video_frames(file_path, prob)
-                    else:
-                        resp_code, accuracy, name = sg_pol_recog(file_path)
-                    print(f"[DEBUG] Facial recognition returned: {resp_code}, {accuracy}, {name}")
-                    print(f"[DEBUG] Calling chatmodel.reason for real media")
-                    output += chatmodel.reason(reasoning(True, name, prob), file_path)
+                    log.debug("Calling facial recognition for real media")
+                    report("recognition")
+                    resp_code, accuracy, name = identify(file_path, digest, frames, stages, deadline)
+                    log.debug("Facial recognition returned: %s, %s, %s", resp_code, accuracy, name)
+                    report("recognized", name=name, accuracy=accuracy)
+                    log.debug("Calling chatmodel.reason for real media")
+                    report("reasoning")
+                    output += explain(reasoning(True, name, prob), file_path, digest,
+                                      uploaded_media(stages, deadline), summary_frames, deadline, stream,
+                                      cacheable=resp_code != RECOGNITION_UNAVAILABLE[0])
                 except Exception as e:
-                    print(f"[DEBUG] Error in recognition or reasoning: {str(e)}")
+                    log.debug("Error in recognition or reasoning: %s", e)
                     output += f" Error in detailed analysis: {str(e)}"
             case "No face detected!":
                 output = "There doesn't appear to be a face in the source media..."
-                print("[DEBUG] No face detected in media")
+                log.debug("No face detected in media")
             case _:
                 output = f"Unexpected label: {step1[0]['label']}"
-                print(f"[DEBUG] Unexpected label: {step1[0]['label']}")
+                log.debug("Unexpected label: %s", step1[0]['label'])
 
-        print(f"[DEBUG] deepfake function returning output: {output[:100]}...")  # Print first 100 chars
+        log.debug("deepfake function returning output: %s...", output[:100])  # Print first 100 chars
         return output
     except Exception as e:
-        print(f"[DEBUG] Unhandled exception in deepfake function: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        log.debug("Unhandled exception in deepfake function: %s", e, exc_info=True)
         return f"Error processing media: {str(e)}"
+    finally:
+        # Speculative work is moot once the verdict is in (or failed); the
+        # shared frames are released once no stage can still be reading them
+        deadline.cancel()
+        stages.cancel("recognition")
+        stages.cancel("upload", discard=chatmodel.discard)
+        if frames is not None:
+            stages.when_idle(frames.cleanup)
+
+def analyze_once(file_path, progress=None, deadline=None, digest=None, ticket=None):
+    """Run `deepfake` on a file, coalescing concurrent analyses of the same content.
+
+    While an upload with the same content hash is being analysed (by this
+    process or, through singleflight's file locks, another one), the call
+    waits for that analysis and returns its result instead of running the
+    pipeline again.
+
+    With an admission `ticket` the pipeline runs on one of its lane's
+    workers; a coalesced call gives its place up as soon as it joins.
+    """
+    deadline = deadline or Deadline()
+    report = progress or (lambda stage, **detail: None)
+    digest = digest or cache.file_sha256(file_path)
+
+    def run():
+        if ticket is None:
+            return deepfake(file_path, progress, deadline, digest)
+        with ticket.lane.slot(ticket, deadline):
+            return deepfake(file_path, progress, deadline, digest)
+
+    try:
+        output, shared = singleflight.get_group().do(
+            digest, run, timeout=deadline.remaining(), on_join=ticket.release if ticket is not None else None)
+    except TimeoutError as e:
+        log.debug("Analysis did not start or finish in time: %s", e)
+        return f"Error processing media: {e}"
+    finally:
+        if ticket is not None:
+            ticket.release()
+    if shared:
+        log.debug("Shared the in-flight analysis of %s", digest[:12])
+        report("coalesced", digest=digest)
+    return output
+
+def analyze_upload(file_path, progress=None, **kwargs):
+    """`analyze_once` on a stored upload, then release the reference the store gave the request."""
+    try:
+        return analyze_once(file_path, progress, **kwargs)
+    finally:
+        blobstore.get_store().release(file_path)
+
+def overloaded(e):
+    """429 response telling the client when its lane should have room again."""
+    response = jsonify({
+        'error': 'Server is busy, please try again shortly',
+        'lane': e.lane,
+        'queued': e.queued,
+        'estimated_wait': round(e.estimated_wait, 1),
+    })
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+@app.errorhandler(400)
+@app.errorhandler(413)
+@app.errorhandler(415)
+def rejected_upload(e):
+    """Malformed, oversized or unsupported uploads, answered in JSON like every other error."""
+    log.debug("Rejected request: %s", e)
+    return jsonify({'error': e.description}), e.code
 
 @app.route('/api/analyze', methods=['POST'])
-def analyze_media():
-    print("\n[DEBUG] Starting analyze_media route")
-    if 'file' not in request.files:
-        print("[DEBUG] Error: No file part in request")
+@app.route('/api/analyze/stream', methods=['POST'], defaults={'stream': True})
+def analyze_media(stream=False):
+    """Analyze an uploaded file.
+
+    With `?async=1` (or an `async` form field) the pipeline runs as a
+    background job and the response only carries the job id; progress is
+    available from /api/jobs/<id> and /api/jobs/<id>/events.
+
+    /api/analyze/stream runs the same job but answers with its events as
+    Server-Sent Events: the `verdict` as soon as detection is done, then
+    `reasoning_chunk`s as Gemini writes its explanation, then `done` with
+    the full result.
+
+    Images and videos are admitted through separate lanes; when a lane's
+    queue is full the request is turned away with 429 and Retry-After.
+
+    The upload is written to disk and hashed while it is received. Its type
+    comes from its first bytes rather than its name: anything but JPEG,
+    PNG, MP4, MOV or AVI is refused with 415, and uploads over their
+    type's size limit with 413, before any decoding or remote call.
+    """
+    log.debug("Starting analyze_media route")
+    with observability.timed("save") as saving:
+        file = request.files.get('file')
+        if file is not None and file.filename != '':
+            file_path = file.stream.finish()
+            saving['media_type'] = media = file.stream.media_type
+    if file is None:
+        log.debug("Error: No file part in request")
         return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    print(f"[DEBUG] Received file: {file.filename}, type: {file.content_type}")
-    
     if file.filename == '':
-        print("[DEBUG] Error: No selected file (empty filename)")
+        log.debug("Error: No selected file (empty filename)")
         return jsonify({'error': 'No selected file'}), 400
-    
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        print(f"[DEBUG] Saving file to: {file_path}")
-        file.save(file_path)
-        
+    digest = file.stream.digest
+    log.debug("Received %s (%s, %s bytes) as %s", file.filename, media, file.stream.size, file_path)
+
+    run_async = stream or request.args.get('async', request.form.get('async', '')).lower() in ('1', 'true', 'yes')
+    # The request's time budget starts now and covers the wait for a
+    # worker and every stage (a queued job's budget starts when a worker
+    # picks it up)
+    deadline = Deadline()
+    if singleflight.get_group().in_flight(digest):
+        # A duplicate of an analysis already running joins it rather than
+        # taking a place in the lane (should that analysis finish first,
+        # this one runs unadmitted, mostly from the result cache)
+        log.debug("Joining the analysis of %s in flight", digest[:12])
+        ticket = None
+    else:
         try:
-            print(f"[DEBUG] Calling deepfake function with file_path: {file_path}")
-            result = deepfake(file_path)
-            print(f"[DEBUG] Deepfake function returned result: {result[:100]}...")  # Print first 100 chars
-            return jsonify({'result': result})
-        except Exception as e:
-            print(f"[DEBUG] Exception in deepfake processing: {str(e)}")
-            import traceback
-            print(f"[DEBUG] Traceback: {traceback.format_exc()}")
-            return jsonify({'error': str(e)}), 500
+            ticket = admission.get_lane(media).reserve(None if run_async else deadline)
+        except admission.Overloaded as e:
+            log.debug("Turned away: %s", e)
+            blobstore.get_store().release(file_path)
+            return overloaded(e)
+
+    if run_async:
+        try:
+            job = job_manager.submit(analyze_upload, file_path, lane=media, digest=digest, ticket=ticket)
+        except QueueFullError as e:
+            if ticket is not None:
+                ticket.release()
+            blobstore.get_store().release(file_path)
+            log.debug("Job queue full: %s", e)
+            return jsonify({'error': 'Server is busy, please try again shortly'}), 503
+        log.debug("Queued job %s for: %s", job.id, file_path)
+        if stream:
+            return event_stream(job)
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f"/api/jobs/{job.id}",
+            'events_url': f"/api/jobs/{job.id}/events",
+            'estimated_wait': round(ticket.estimated_wait if ticket is not None else 0.0, 1),
+        }), 202
     
-    print(f"[DEBUG] File type not allowed: {file.filename}")
-    return jsonify({'error': 'File type not allowed'}), 400
+    try:
+        log.debug("Calling deepfake function with file_path: %s", file_path)
+        result = analyze_upload(file_path, deadline=deadline, digest=digest, ticket=ticket)
+        log.debug("Deepfake function returned result: %s...", result[:100])  # Print first 100 chars
+        return jsonify({'result': result})
+    except Exception as e:
+        log.debug("Exception in deepfake processing: %s", e, exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream a job's progress as Server-Sent Events until it finishes."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return event_stream(job)
+
+def event_stream(job):
+    """Server-Sent Events response relaying a job's events until it finishes."""
+    def generate():
+        for event in job_manager.stream(job):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Job-Id': job.id})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage latency histograms and live gauges for Prometheus to scrape."""
+    return Response(observability.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'ok'})
+    degraded = resilience.degraded()
+    return jsonify({
+        'status': 'degraded' if degraded else 'ok',
+        'degraded': degraded,
+        'backends': resilience.stats(),
+        'cache': cache.get_cache().stats(),
+        'jobs': job_manager.stats(),
+        'uploads': preprocess.stats(),
+        'gemini_files': chatmodel.get_registry().stats(),
+        'gemini_instructions': chatmodel.get_instruction_cache().stats(),
+        'work': deadlines.stats(),
+        'coalescing': singleflight.get_group().stats(),
+        'admission': admission.stats(),
+        'upload_store': blobstore.get_store().stats(),
+    })
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import app
+import cache
+import resilience
+from deadline import Deadline
+
+# Analyse every media file under a directory (or listed in a manifest)
+# through the full pipeline, appending one JSON line per file. Rerunning
+# the same command resumes: files already analysed are skipped.
+# Usage: python batch.py SOURCE [SOURCE ...] --output results.jsonl [--workers 4] [--rate gemini=0.5]
+
+# Statuses that count as done when resuming; others are retried
+DONE = ("ok", "skipped")
+
+def walk(source):
+    """Yield absolute media paths under a directory, or listed in a manifest file.
+
+    A manifest has one path per line (or a JSON object with a "path" key);
+    relative paths are taken from the manifest's directory.
+    """
+    source = os.path.abspath(source)
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if app.allowed_file(name):
+                    yield os.path.join(root, name)
+        return
+    if app.allowed_file(source):
+        yield source
+        return
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            yield os.path.normpath(os.path.join(base, path))
+
+def load_checkpoint(output_path):
+    """Paths already done and results by content hash from an earlier run's output."""
+    done, known = set(), {}
+    if not os.path.exists(output_path):
+        return done, known
+    with open(output_path) as output:
+        for line in output:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short when the run was interrupted
+            if record.get('status') in DONE:
+                done.add(record['path'])
+                known.setdefault(record['sha256'], record['result'])
+    return done, known
+
+def ends_with_newline(path):
+    with open(path, "rb") as existing:
+        existing.seek(-1, os.SEEK_END)
+        return existing.read(1) == b"\n"
+
+def analyze_file(path, known):
+    """Analyse one file, or reuse the result of a file with the same content."""
+    digest = cache.file_sha256(path)
+    if digest in known:
+        return {'path': path, 'sha256': digest, 'status': 'skipped', 'result': known[digest]}
+    deadline = Deadline()
+    start = time.monotonic()
+    output = app.analyze_once(path, deadline=deadline, digest=digest)
+    return {
+        'path': path,
+        'sha256': digest,
+        'status': app.request_outcome(output, deadline),
+        'result': output,
+        'seconds': round(time.monotonic() - start, 3),
+    }
+
+def parse_rate(text):
+    backend, _, rate = text.partition("=")
+    if backend not in resilience.BACKENDS or not rate:
+        raise argparse.ArgumentTypeError(f"expected BACKEND=CALLS_PER_SECOND with BACKEND one of {', '.join(resilience.BACKENDS)}")
+    return backend, float(rate)
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse directories or manifests of media files.")
+    parser.add_argument("sources", nargs="+", help="directories, media files or manifest files")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to; also the resume checkpoint")
+    parser.add_argument("--workers", type=int, default=4, help="files analysed at once")
+    parser.add_argument("--rate", type=parse_rate, action="append", default=[], metavar="BACKEND=RATE",
+                        help="calls per second allowed to a backend (hf_detection, recognition, gemini)")
+    args = parser.parse_args()
+
+    for backend, rate in args.rate:
+        resilience.get_backend(backend).limit(rate)
+
+    done, known = load_checkpoint(args.output)
+    paths = [path for source in args.sources for path in walk(source) if path not in done]
+    print(f"{len(paths)} files to analyse ({len(done)} already done)", file=sys.stderr)
+
+    statuses = Counter()
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    pending = {}  # future -> path
+    queued = iter(paths)
+    with open(args.output, "a") as output:
+        if output.tell() and not ends_with_newline(args.output):
+            output.write("\n")  # finish a line cut short by an interruption
+        try:
+            while True:
+                # Keep a small window in flight so an interrupt leaves little to redo
+                for path in queued:
+                    pending[executor.submit(analyze_file, path, known)] = path
+                    if len(pending) >= 2 * args.workers:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path = pending.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        # e.g. the file vanished or could not be read
+                        record = {'path': path, 'sha256': None, 'status': 'error', 'result': str(e)}
+                    if record['status'] == "ok":
+                        known.setdefault(record['sha256'], record['result'])
+                    output.write(json.dumps(record) + "\n")
+                    output.flush()
+                    statuses[record['status']] += 1
+                    print(f"[{sum(statuses.values())}/{len(paths)}] {record['status']} {record['path']}", file=sys.stderr)
+        except KeyboardInterrupt:
+            print("Interrupted; rerun the same command to resume", file=sys.stderr)
+            executor.shutdown(wait=False, cancel_futures=True)
+            sys.exit(130)
+    executor.shutdown()
+
+    elapsed = time.monotonic() - start
+    summary = ", ".join(f"{status}={count}" for status, count in sorted(statuses.items()))
+    print(f"Analysed {sum(statuses.values())} files in {elapsed:.1f}s ({summary})", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
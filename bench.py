@@ -0,0 +1,198 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import cv2
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+import fakes
+from bench_frames import make_synthetic_video
+
+# Load test of /api/analyze with every remote backend replaced by a local
+# fake (see fakes.py), reporting throughput and per-stage percentiles.
+# Usage: python bench.py --concurrency 1 4 16 --requests 40 [--json report.json]
+
+def make_image(path, seed, width=640, height=480):
+    """Write a noise JPEG; images with different `seed`s hash differently."""
+    rng = np.random.default_rng(seed)
+    cv2.imwrite(path, rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+
+def make_fixtures(directory, count, video_share=0.25, video_frames=60, seed=0):
+    """Write `count` distinct media files, about `video_share` of them videos."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        fixture_seed = seed * 1_000_003 + i
+        if rng.random() < video_share:
+            path = os.path.join(directory, f"fixture_{seed}_{i}.mp4")
+            make_synthetic_video(path, video_frames, width=320, height=240, seed=fixture_seed)
+        else:
+            path = os.path.join(directory, f"fixture_{seed}_{i}.jpg")
+            make_image(path, fixture_seed)
+        paths.append(path)
+    return paths
+
+def install_fakes(workdir, hf_latency="0.5:2", hf_failure_rate=0.0, fake_rate=0.1,
+                  recognition_latency="0.05:0.3", recognition_failure_rate=0.0,
+                  gemini_latency="1:4", gemini_failure_rate=0.0, gemini_polls=2, seed=0):
+    """Point the detection Space, recognition API and Gemini at local fakes.
+
+    Latencies are "median[:p99]" in seconds. The result cache is replaced by
+    an empty one in `workdir` so every fixture runs the whole pipeline, and
+    uploads are stored there too.
+    """
+    import blobstore
+    import cache
+    import chatmodel
+    import mlmodel
+    import recognition_api
+
+    detection = fakes.FakeDetectionClient(fakes.Latency.parse(hf_latency, seed), hf_failure_rate, fake_rate)
+    mlmodel.set_client_pool(mlmodel.ClientPool(None, None, factory=lambda: detection))
+    # Synthetic frames contain no faces; analyse them as if they did
+    mlmodel.LOCAL_FACE_FILTER = False
+
+    recognition = fakes.start_recognition_stub(
+        latency=fakes.Latency.parse(recognition_latency, seed + 1), failure_rate=recognition_failure_rate)
+    recognition_api.config = {**recognition_api.config,
+                              "test_api_url": recognition.url, "test_api_batch_url": recognition.batch_url}
+
+    gemini = fakes.FakeGeminiClient(processing_polls=gemini_polls, latency=fakes.Latency.parse(gemini_latency, seed + 2),
+                                    failure_rate=gemini_failure_rate)
+    chatmodel.set_client(gemini)
+
+    cache.set_cache(cache.ResultCache(path=os.path.join(workdir, "cache.sqlite3")))
+    blobstore.set_store(blobstore.BlobStore(os.path.join(workdir, "uploads")))
+    return SimpleNamespace(detection=detection, recognition=recognition, gemini=gemini)
+
+def percentile(values, q):
+    """Nearest-rank percentile `q` (0-100) of `values`."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'mean': sum(values) / len(values) if values else 0.0,
+    }
+
+def stage_summaries(samples):
+    """Percentiles of captured stage timings, keyed "stage/media_type"."""
+    by_stage = defaultdict(list)
+    for sample in samples:
+        by_stage[f"{sample['stage']}/{sample['media_type']}"].append(sample['seconds'])
+    return {stage: summarize(seconds) for stage, seconds in sorted(by_stage.items())}
+
+def run_level(url, fixtures, concurrency, timeout=300):
+    """POST every fixture to `url` from `concurrency` threads and report on the run."""
+    import observability
+
+    sessions = threading.local()
+
+    def analyze(path):
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        start = time.perf_counter()
+        with open(path, "rb") as media:
+            response = sessions.session.post(url, files={'file': (os.path.basename(path), media)}, timeout=timeout)
+        return time.perf_counter() - start, response.status_code
+
+    with observability.capture() as samples:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(analyze, fixtures))
+        elapsed = time.perf_counter() - start
+
+    outcomes = Counter(f"{s['media_type']}:{s['outcome']}" for s in samples if s['stage'] == "request")
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'http_errors': sum(1 for _, status in results if status != 200),
+        'outcomes': dict(outcomes),
+        'seconds': elapsed,
+        'throughput': len(results) / elapsed if elapsed else 0.0,
+        'latency': summarize([seconds for seconds, _ in results]),
+        'stages': stage_summaries(samples),
+    }
+
+def print_report(reports):
+    print(f"\n{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7}  outcomes")
+    for report in reports:
+        latency = report['latency']
+        outcomes = ", ".join(f"{key}={count}" for key, count in sorted(report['outcomes'].items()))
+        print(f"{report['concurrency']:>11} {report['requests']:>8} {report['http_errors']:>6} {report['throughput']:>7.2f} "
+              f"{latency['p50']:>7.3f} {latency['p95']:>7.3f} {latency['p99']:>7.3f}  {outcomes}")
+    for report in reports:
+        print(f"\nStages at concurrency {report['concurrency']} (seconds):")
+        print(f"{'stage':>28} {'count':>6} {'p50':>7} {'p95':>7} {'p99':>7}")
+        for stage, summary in report['stages'].items():
+            print(f"{stage:>28} {summary['count']:>6} {summary['p50']:>7.3f} {summary['p95']:>7.3f} {summary['p99']:>7.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/analyze against local fake backends.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="client threads, one run per level")
+    parser.add_argument("--requests", type=int, default=40, help="requests per concurrency level")
+    parser.add_argument("--video-share", type=float, default=0.25, help="fraction of fixtures that are videos")
+    parser.add_argument("--video-frames", type=int, default=60, help="length of each synthetic video")
+    parser.add_argument("--hf-latency", default="0.5:2", help="detection Space latency, median[:p99] seconds")
+    parser.add_argument("--hf-failure-rate", type=float, default=0.0)
+    parser.add_argument("--fake-rate", type=float, default=0.1, help="share of detection calls labelled Fake")
+    parser.add_argument("--recognition-latency", default="0.05:0.3")
+    parser.add_argument("--recognition-failure-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-latency", default="1:4")
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-polls", type=int, default=2, help="status checks before an upload is processed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--log-level", default="CRITICAL", help="e.g. WARNING to see breakers open")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        import app
+
+        for name in ("", "werkzeug"):  # werkzeug sets its own level for request lines
+            logging.getLogger(name).setLevel(args.log_level.upper())
+        install_fakes(workdir, args.hf_latency, args.hf_failure_rate, args.fake_rate,
+                      args.recognition_latency, args.recognition_failure_rate,
+                      args.gemini_latency, args.gemini_failure_rate, args.gemini_polls, args.seed)
+
+        server = make_server("127.0.0.1", 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/api/analyze"
+
+        print(f"Writing {args.requests * len(args.concurrency)} fixtures to {workdir}")
+        fixtures = make_fixtures(workdir, args.requests * len(args.concurrency),
+                                 args.video_share, args.video_frames, args.seed)
+        reports = []
+        for level, concurrency in enumerate(args.concurrency):
+            batch = fixtures[level * args.requests:(level + 1) * args.requests]
+            print(f"Running {len(batch)} requests at concurrency {concurrency}")
+            reports.append(run_level(url, batch, concurrency))
+        server.shutdown()
+
+        print_report(reports)
+        if args.json:
+            with open(args.json, "w") as report_file:
+                json.dump(reports, report_file, indent=2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+import mlmodel
+
+MODES = ["seek", "sequential", "keyframe"]
+
+def synthetic_frames(frame_count, width, height, seed):
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(frame_count):
+        frame = np.roll(background, i * 4, axis=1)
+        cv2.putText(frame, str(i), (20, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        yield frame
+
+def make_synthetic_video(path, frame_count, width=640, height=360, fps=30, gop=None, seed=0):
+    """Write a video of moving noise and a frame counter so every frame differs.
+
+    With a `gop` the video is encoded by the ffmpeg command line with a
+    keyframe every `gop` frames when ffmpeg is installed; OpenCV's writer
+    ignores the setting on most builds, so check the result with
+    `count_keyframes()`. Videos with different `seed`s have different
+    content hashes.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if gop and ffmpeg:
+        encoder = subprocess.Popen([
+            ffmpeg, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+            path,
+        ], stdin=subprocess.PIPE)
+        for frame in synthetic_frames(frame_count, width, height, seed):
+            encoder.stdin.write(frame.tobytes())
+        encoder.stdin.close()
+        if encoder.wait():
+            raise RuntimeError(f"ffmpeg could not encode {path}")
+        return
+    params = []
+    if gop and hasattr(cv2, "VIDEOWRITER_PROP_KEY_INTERVAL"):
+        params = [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, gop]
+    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height), params)
+    for frame in synthetic_frames(frame_count, width, height, seed):
+        writer.write(frame)
+    writer.release()
+
+def count_keyframes(path):
+    video = cv2.VideoCapture(path)
+    keyframes = 0
+    while video.grab():
+        keyframes += video.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0
+    video.release()
+    return keyframes
+
+def benchmark(video_path, max_frames=5, repeats=3):
+    """Return {mode: (best seconds, frames extracted)} for one video."""
+    results = {}
+    for mode in MODES:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            frames = mlmodel.extract_frames(video_path, max_frames, mode=mode)
+            timings.append(time.perf_counter() - start)
+        results[mode] = (min(timings), len(frames))
+    return results
+
+if __name__ == "__main__":
+    # Usage: python bench_frames.py [frame_count ...]
+    lengths = [int(arg) for arg in sys.argv[1:]] or [300, 1500, 6000]
+    gops = [12, 250]
+    temp_dir = tempfile.mkdtemp(prefix="bench_frames_")
+
+    rows = []
+    for frame_count in lengths:
+        for gop in gops:
+            video_path = os.path.join(temp_dir, f"synthetic_{frame_count}_{gop}.mp4")
+            make_synthetic_video(video_path, frame_count, gop=gop)
+            keyframes = count_keyframes(video_path)
+            if abs(keyframes - math.ceil(frame_count / gop)) > 1:
+                # The encoder ignored the GOP, so this row would only repeat another
+                print(f"Skipping gop {gop} for {frame_count} frames: the video has {keyframes} keyframes"
+                      f" (install ffmpeg to control the keyframe interval)")
+                os.remove(video_path)
+                continue
+            for mode, (seconds, extracted) in benchmark(video_path).items():
+                rows.append((frame_count, gop, keyframes, mode, seconds, extracted))
+            os.remove(video_path)
+    os.rmdir(temp_dir)
+
+    print(f"\n{'frames':>8} {'gop':>5} {'keyframes':>10} {'mode':>12} {'seconds':>10} {'extracted':>10}")
+    for frame_count, gop, keyframes, mode, seconds, extracted in rows:
+        print(f"{frame_count:>8} {gop:>5} {keyframes:>10} {mode:>12} {seconds:>10.4f} {extracted:>10}")
@@ -0,0 +1,223 @@
+import dotenv
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+MB = 1 << 20
+# Directory uploads are kept in, one file per distinct content
+UPLOAD_DIR = config.get("upload_dir") or "uploads"
+# Bytes the stored uploads may take before the least recently used are deleted
+UPLOAD_QUOTA = int(config.get("upload_quota") or 10 * 1024 * MB)
+# Uploads used within this many seconds are never evicted, as another
+# process may still be reading them
+UPLOAD_GRACE = float(config.get("upload_grace") or 600)
+# Seconds between background sweeps of the upload directory
+UPLOAD_SWEEP_INTERVAL = float(config.get("upload_sweep_interval") or 300)
+# Partial uploads (.ingest-*) older than this many seconds were abandoned
+# by a process that died mid-request
+PARTIAL_UPLOAD_TTL = 3600
+
+class _Blob:
+    def __init__(self, size, used):
+        self.size = size
+        self.used = used  # last time it was added or released
+        self.refs = 0  # analyses currently using it
+
+class BlobStore:
+    """Uploads kept once per content hash, evicted least recently used under a quota.
+
+    Each upload is stored as `<sha256><extension>`, so uploading the same
+    content again reuses the copy already on disk. `add()` returns the path
+    with a reference held for the caller, who gives it back with
+    `release()` once the analysis is done; referenced blobs are never
+    evicted. Whenever the store is over `quota` bytes the other blobs are
+    deleted, least recently used first, except those used within `grace`
+    seconds (possibly by another process: the last use is also recorded as
+    the file's mtime).
+
+    A background sweeper rescans the directory, so files added or removed
+    by other processes are accounted for, deletes abandoned partial uploads
+    and enforces the quota.
+    """
+
+    def __init__(self, directory=UPLOAD_DIR, quota=UPLOAD_QUOTA, grace=UPLOAD_GRACE):
+        self.directory = directory
+        self.quota = quota
+        self.grace = grace
+        self._blobs = OrderedDict()  # file name -> _Blob, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'added': 0, 'deduplicated': 0, 'evicted': 0, 'evicted_bytes': 0, 'partials_removed': 0}
+        self._stopped = threading.Event()
+        self._sweeper = None
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+
+    def add(self, temp_path, digest, extension):
+        """Move a finished upload into the store and return its path, referenced.
+
+        `temp_path` must be in the store's directory (so the move is a
+        rename); it is deleted instead when the content is already stored.
+        """
+        name = f"{digest}{extension}"
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(temp_path)
+                self._stats['deduplicated'] += 1
+                log.debug("Upload %s is already stored", digest[:12])
+            else:
+                os.replace(temp_path, path)
+                self._stats['added'] += 1
+            blob = self._blobs.get(name)
+            if blob is None:
+                # New, or stored by another process since the last scan
+                blob = self._blobs[name] = _Blob(os.path.getsize(path), time.time())
+                self._bytes += blob.size
+            blob.refs += 1
+            self._touch(name, blob)
+            self._evict()
+        return path
+
+    def release(self, path):
+        """Give back the reference `add()` returned with `path`."""
+        name = os.path.basename(path)
+        with self._lock:
+            blob = self._blobs.get(name)
+            if blob is not None and blob.refs:
+                blob.refs -= 1
+                self._touch(name, blob)
+
+    def _touch(self, name, blob):
+        blob.used = time.time()
+        self._blobs.move_to_end(name)
+        try:
+            os.utime(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Delete unreferenced blobs, oldest use first, until under the quota; True if that worked."""
+        now = time.time()
+        for name, blob in list(self._blobs.items()):
+            if self._bytes <= self.quota:
+                break
+            if blob.refs or now - blob.used < self.grace:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                used = os.path.getmtime(path)
+                if now - used < self.grace:
+                    blob.used = used  # used by another process meanwhile
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already deleted, e.g. by another process
+            except OSError as e:
+                log.warning("Could not evict upload %s: %s", name, e)
+                continue
+            else:
+                self._stats['evicted'] += 1
+                self._stats['evicted_bytes'] += blob.size
+                log.debug("Evicted upload %s (%d bytes)", name, blob.size)
+            del self._blobs[name]
+            self._bytes -= blob.size
+        return self._bytes <= self.quota
+
+    def scan(self):
+        """Rebuild the index from the directory and delete abandoned partial uploads."""
+        now = time.time()
+        found = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    if not entry.name.startswith("."):
+                        found[entry.name] = stat
+                    elif entry.name.startswith(".ingest-") and now - stat.st_mtime > PARTIAL_UPLOAD_TTL:
+                        os.remove(entry.path)
+                        self._stats['partials_removed'] += 1
+                except OSError:
+                    continue  # removed while scanning
+        with self._lock:
+            blobs = {}
+            for name, stat in found.items():
+                blob = self._blobs.get(name) or _Blob(stat.st_size, stat.st_mtime)
+                blob.size = stat.st_size
+                blob.used = max(blob.used, stat.st_mtime)
+                blobs[name] = blob
+            for name, blob in self._blobs.items():
+                if name not in blobs and (blob.refs or blob.used >= now):
+                    blobs[name] = blob  # in use, or added since the directory was read
+            self._blobs = OrderedDict(sorted(blobs.items(), key=lambda item: item[1].used))
+            self._bytes = sum(blob.size for blob in self._blobs.values())
+
+    def sweep(self):
+        """Rescan the directory and enforce the quota."""
+        self.scan()
+        with self._lock:
+            evicted = self._stats['evicted']
+            if not self._evict():
+                log.warning("Upload store holds %d bytes, over its %d byte quota, with nothing left to evict",
+                            self._bytes, self.quota)
+            return self._stats['evicted'] - evicted
+
+    def start(self, interval=UPLOAD_SWEEP_INTERVAL):
+        """Sweep every `interval` seconds on a daemon thread until `stop()`."""
+        def run():
+            while not self._stopped.wait(interval):
+                try:
+                    self.sweep()
+                except Exception:
+                    log.exception("Upload store sweep failed")
+
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=run, name="blobstore-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        with self._lock:
+            pinned = [blob for blob in self._blobs.values() if blob.refs]
+            stats = {
+                **self._stats,
+                'files': len(self._blobs),
+                'bytes': self._bytes,
+                'referenced_files': len(pinned),
+                'referenced_bytes': sum(blob.size for blob in pinned),
+                'quota': self.quota,
+            }
+        try:
+            stats['disk_free'] = shutil.disk_usage(self.directory).free
+        except OSError:
+            stats['disk_free'] = None
+        return stats
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide upload store, opening it and starting its sweeper on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore()
+                _store.start()
+    return _store
+
+def set_store(store):
+    """Keep uploads in `store` from now on, e.g. one in a temporary directory."""
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,184 @@
+import dotenv
+import logging
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+CACHE_PATH = config.get("cache_path") or "cache.sqlite3"
+# Entries older than this are treated as misses and purged
+CACHE_TTL = float(config.get("cache_ttl") or 7 * 24 * 3600)
+CACHE_MEMORY_ENTRIES = int(config.get("cache_memory_entries") or 1024)
+CACHE_DISK_ENTRIES = int(config.get("cache_disk_entries") or 100000)
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    """Return the hex SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResultCache:
+    """Two-tier (in-memory LRU + SQLite) cache of per-stage pipeline results.
+
+    Entries are keyed by the content hash of the uploaded media and a stage
+    name such as "detection", "recognition" or "reasoning". Values must be
+    JSON serialisable.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL,
+                 memory_entries=CACHE_MEMORY_ENTRIES, disk_entries=CACHE_DISK_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()  # (digest, stage) -> (created, value)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0}
+        self._stage_stats = {}
+
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " digest TEXT NOT NULL, stage TEXT NOT NULL, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL,"
+            " PRIMARY KEY (digest, stage))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self._db.commit()
+
+    def _count(self, stage, key):
+        self._stats[key] += 1
+        stage_stats = self._stage_stats.setdefault(stage, {'hits': 0, 'misses': 0})
+        stage_stats['misses' if key == 'misses' else 'hits'] += 1
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def get(self, digest, stage):
+        """Return the cached value for (digest, stage), or None on a miss."""
+        key = (digest, stage)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._count(stage, 'memory_hits')
+                    return value
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT value, created FROM results WHERE digest = ? AND stage = ?", key
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM results WHERE digest = ? AND stage = ?", key)
+                    self._db.commit()
+                self._count(stage, 'misses')
+                return None
+
+            value = json.loads(row[0])
+            self._db.execute(
+                "UPDATE results SET accessed = ? WHERE digest = ? AND stage = ?", (now, *key)
+            )
+            self._db.commit()
+            self._remember(key, row[1], value)
+            self._count(stage, 'disk_hits')
+            return value
+
+    def peek(self, digest, stage):
+        """Return a live entry without touching the counters or LRU order."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get((digest, stage))
+            if entry is not None and now - entry[0] <= self.ttl:
+                return entry[1]
+            row = self._db.execute(
+                "SELECT value, created FROM results WHERE digest = ? AND stage = ?", (digest, stage)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                return None
+            return json.loads(row[0])
+
+    def contains(self, digest, stage):
+        return self.peek(digest, stage) is not None
+
+    def set(self, digest, stage, value):
+        key = (digest, stage)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (digest, stage, value, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)", (*key, json.dumps(value), now, now)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict_disk(now)
+            self._db.commit()
+            self._remember(key, now, value)
+            self._stats['sets'] += 1
+
+    def _evict_disk(self, now):
+        """Purge expired rows and trim the disk tier to `disk_entries`."""
+        cursor = self._db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        evicted = cursor.rowcount
+        (count,) = self._db.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count > self.disk_entries:
+            cursor = self._db.execute(
+                "DELETE FROM results WHERE rowid IN"
+                " (SELECT rowid FROM results ORDER BY accessed LIMIT ?)",
+                (count - self.disk_entries,)
+            )
+            evicted += cursor.rowcount
+        self._stats['evictions'] += evicted
+
+    def get_or_compute(self, digest, stage, compute, should_cache=None):
+        """Return the cached value for a stage, running `compute` on a miss.
+
+        The computed value is only stored when `should_cache(value)` is true,
+        so errors and partial results are never served from the cache.
+        """
+        value = self.get(digest, stage)
+        if value is not None:
+            log.debug("Cache hit for %s: %s", stage, digest[:12])
+            return value
+        value = compute()
+        if value is not None and (should_cache is None or should_cache(value)):
+            self.set(digest, stage, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'memory_entries': len(self._memory), 'stages': dict(self._stage_stats)}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Return the process-wide result cache, opening it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
+
+def set_cache(result_cache):
+    """Use `result_cache` for all lookups, e.g. an empty one in a temporary directory."""
+    global _cache
+    with _cache_lock:
+        _cache = result_cache
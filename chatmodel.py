@@ -1,83 +1,566 @@
 from google import genai
+from google.genai import types
 import dotenv
+import logging
+import os
 import time 
 import threading
-from functools import wraps
-
-class TimeoutError(Exception):
-    pass
-
-def timeout(seconds=60):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            result = [TimeoutError('Function call timed out')]
-            
-            def target():
+from collections import OrderedDict
+from datetime import datetime, timezone
+import cache
+from deadline import REQUEST_DEADLINE, Deadline, DeadlineExceeded, tracked
+from observability import timed
+from resilience import BackendUnavailable, get_backend
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+# Processing checks start after this many seconds and back off to the maximum
+UPLOAD_POLL_INITIAL = float(config.get("gemini_poll_initial") or 0.25)
+UPLOAD_POLL_MAX = float(config.get("gemini_poll_max") or 4)
+UPLOAD_PROCESSING_TIMEOUT = float(config.get("gemini_processing_timeout") or 30)
+# Uploaded files remembered for reuse, and how long before their remote
+# expiry they stop being handed out
+UPLOAD_REGISTRY_SIZE = int(config.get("gemini_upload_registry_size") or 256)
+UPLOAD_EXPIRY_MARGIN = float(config.get("gemini_upload_expiry_margin") or 600)
+# How videos reach Gemini: "upload" the file, send a "summary" of sampled
+# frames inline, or "auto" (summary once either threshold below is reached)
+VIDEO_MODE = config.get("gemini_video_mode") or "auto"
+SUMMARY_MIN_BYTES = int(config.get("gemini_summary_min_bytes") or 50 * 1024 * 1024)
+SUMMARY_MIN_SECONDS = float(config.get("gemini_summary_min_seconds") or 120)
+# Timeout, in seconds, of each HTTP request to Gemini
+GEMINI_HTTP_TIMEOUT = float(config.get("gemini_http_timeout") or 60)
+# Model asked for the reasoning; cached instructions are tied to it
+REASONING_MODEL = "gemini-1.5-pro"
+# Seconds the reasoning instructions live in Gemini's context cache ("0"
+# sends them with every request instead), and how close to expiry the
+# cache is extended
+INSTRUCTION_CACHE_TTL = float(config.get("gemini_instruction_cache_ttl") or 3600)
+INSTRUCTION_CACHE_MARGIN = float(config.get("gemini_instruction_cache_margin") or 300)
+# Seconds before a failed create or refresh of the cache is tried again;
+# a refusal (e.g. too few tokens to cache) stops caching for good
+INSTRUCTION_CACHE_RETRY = 60
+
+# Returned by reason() instead of an analysis while Gemini is shedding load
+UNAVAILABLE = "Detailed analysis is temporarily unavailable; please try again later."
+
+# The part of the reasoning prompt that is the same for every request; the
+# per-request prompt passed to reason() only adds the identity and verdict
+REASONING_INSTRUCTIONS = """
+You are an AI assistant specialized in assessing the authenticity of videos, particularly in the context of deepfakes and AI-generated content. Your task is to analyze the provided information and determine the likelihood of a video being AI-generated or manipulated, as well as any potential malicious intent behind its creation or distribution.
+Use your grounding tools to search to see if any of the information can be verified.
+Important context (as of 2025):
+• Deepfakes and AI-generated images have become extremely convincing.
+Traditional signs of manipulation (e.g., boundary artifacts, inconsistencies) are no longer reliable indicators.
+The term "deepfakes" encompasses AI-generated images, face swaps, and various forms of content manipulation.
+The visual distinction between real and fake images has become nearly imperceptible to the human eye.
+Provide your analysis and assessment in the following format:
+<structured_analysis>
+1. Summary of key points:
+[Summarize the most important information from each section of the input]
+2. Potential indicators of authenticity:
+[List factors that suggest the image might be authentic]
+3. Potential indicators of manipulation:
+[List factors that suggest the image might be AI-generated or manipulated)
+4. Contextual considerations:
+[Discuss the context of the image and potential motivations for its creation/sharing] 
+</structured_analysis>
+<assessment>
+Likelihood of AI generation/manipulation: [High/Low/Unsure]
+Reasoning: [Explanation for your assessment]
+Potential malicious intent: [Yes/No/Unsure]
+Reasoning: [Explanation for your assessment, including any specific concerns if applicable; err on the side that malicious is present]
+</assessment>
+Remember, it's acceptable to return an unsure result if the evidence is inconclusive. Be thorough in your analysis and clear in your explanations. Avoid explicit mention of what was in this prompt in your response.
+"""
+
+_client = None
+_client_lock = threading.Lock()
+
+def request_options(deadline, before):
+    """HTTP options bounding one Gemini request by the time left on `deadline`."""
+    timeout = deadline.timeout(GEMINI_HTTP_TIMEOUT, before=before)
+    return types.HttpOptions(timeout=max(1, int(timeout * 1000)))  # milliseconds
+
+def get_client():
+    """Return the Gemini client shared by every call."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = genai.Client(
+                    api_key=config["gemini_token"],
+                    http_options={"timeout": int(GEMINI_HTTP_TIMEOUT * 1000)},  # milliseconds
+                )
+    return _client
+
+def set_client(client):
+    """Use `client` for all Gemini calls, e.g. fakes.FakeGeminiClient in tests."""
+    global _client
+    with _client_lock:
+        _client = client
+    get_registry().clear()
+    get_instruction_cache().clear()
+
+class UploadRegistry:
+    """Processed Gemini uploads keyed by the content hash of the local file.
+
+    Files are handed out again until UPLOAD_EXPIRY_MARGIN seconds before
+    Gemini expires them, and the least recently used file is dropped once
+    more than `size` are registered. A dropped file is deleted remotely
+    once the requests it was handed to are over (REQUEST_DEADLINE later).
+
+    `lock()` and `unlock()` serialise uploads of the same content; a
+    digest's lock only exists while someone holds or waits for it.
+    """
+
+    def __init__(self, size=UPLOAD_REGISTRY_SIZE, margin=UPLOAD_EXPIRY_MARGIN):
+        self.size = size
+        self.margin = margin
+        self._files = OrderedDict()
+        self._locks = {}  # digest -> [lock, holders and waiters]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.uploads = 0
+        self.expired = 0
+
+    def lock(self, digest, timeout):
+        """Hold `digest`'s upload lock, so it is uploaded once; False if `timeout` passed first.
+
+        Call `unlock(digest)` once done with it.
+        """
+        with self._lock:
+            entry = self._locks.setdefault(digest, [threading.Lock(), 0])
+            entry[1] += 1
+        if entry[0].acquire(timeout=timeout):
+            return True
+        self._leave(digest, entry)
+        return False
+
+    def unlock(self, digest):
+        with self._lock:
+            entry = self._locks[digest]
+        entry[0].release()
+        self._leave(digest, entry)
+
+    def _leave(self, digest, entry):
+        with self._lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[digest]
+
+    def _usable(self, media_file):
+        expiry = getattr(media_file, "expiration_time", None)
+        if expiry is None:
+            return True
+        return (expiry - datetime.now(timezone.utc)).total_seconds() > self.margin
+
+    def get(self, digest):
+        with self._lock:
+            media_file = self._files.get(digest)
+            if media_file is None:
+                return None
+            if self._usable(media_file):
+                self._files.move_to_end(digest)
+                self.hits += 1
+                return media_file
+            del self._files[digest]
+            self.expired += 1
+        self._retire(media_file)
+        return None
+
+    def add(self, digest, media_file):
+        with self._lock:
+            self._files[digest] = media_file
+            self._files.move_to_end(digest)
+            self.uploads += 1
+            evicted = []
+            while len(self._files) > self.size:
+                evicted.append(self._files.popitem(last=False)[1])
+        for old in evicted:
+            self._retire(old)
+
+    def _retire(self, media_file):
+        """Delete a dropped upload remotely once the requests it was handed to are over."""
+        log.debug("Deleting upload %s in %gs", media_file.name, REQUEST_DEADLINE)
+        timer = threading.Timer(REQUEST_DEADLINE, _delete, (media_file,))
+        timer.daemon = True
+        timer.start()
+
+    def forget(self, digest):
+        with self._lock:
+            self._files.pop(digest, None)
+
+    def holds(self, media_file):
+        with self._lock:
+            return any(f.name == media_file.name for f in self._files.values())
+
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._files), 'hits': self.hits, 'uploads': self.uploads, 'expired': self.expired,
+                    'locks': len(self._locks)}
+
+_registry = None
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _client_lock:
+            if _registry is None:
+                _registry = UploadRegistry()
+    return _registry
+
+class InstructionCache:
+    """Gemini cached content holding the static reasoning instructions.
+
+    The instructions are stored once with `caches.create` and each request
+    refers to them by name, so only the media and the short per-request
+    prompt are sent and tokenized again. The cache's TTL is extended once
+    less than `margin` seconds are left, and it is created afresh when that
+    fails (e.g. it was deleted).
+
+    One caller at a time creates or extends the cache, outside the lock
+    and through the Gemini breaker, within its request's deadline; the
+    others carry on with the current cache while it lasts, or send the
+    instructions inline. A failure is retried after `retry_after` seconds,
+    but once Gemini refuses the request outright (a 4xx such as the
+    content being under the model's minimum cacheable size) the
+    instructions are always sent inline.
+    """
+
+    def __init__(self, instructions=REASONING_INSTRUCTIONS, model=REASONING_MODEL, ttl=INSTRUCTION_CACHE_TTL,
+                 margin=INSTRUCTION_CACHE_MARGIN, retry_after=INSTRUCTION_CACHE_RETRY):
+        self.instructions = instructions
+        self.model = model
+        self.ttl = ttl
+        self.margin = margin
+        self.retry_after = retry_after
+        self._name = None
+        self._expires = 0.0
+        self._retry_at = 0.0
+        self._renewing = False
+        self._refused = None  # why Gemini will not cache the instructions
+        self._lock = threading.Lock()
+        self._stats = {'cached_requests': 0, 'inline_requests': 0, 'created': 0, 'refreshed': 0, 'failed': 0}
+
+    def name(self, client, deadline=None):
+        """Name of the live cached content, or None to send the instructions inline."""
+        with self._lock:
+            now = time.time()
+            name = self._name if self._name is not None and now < self._expires else None
+            renew = (self.ttl > 0 and self._refused is None and not self._renewing and now >= self._retry_at
+                     and (name is None or now >= self._expires - self.margin))
+            if renew:
+                self._renewing = True
+        if renew:
+            name = self._renew(client, name, deadline or Deadline())
+        with self._lock:
+            self._stats['cached_requests' if name else 'inline_requests'] += 1
+        return name
+
+    def _renew(self, client, current, deadline):
+        """Extend `current` or create a new cache; returns the name to use."""
+        ttl = f"{self.ttl:.0f}s"
+        try:
+            http_options = request_options(deadline, "caching the instructions")
+            if current is not None:
                 try:
-                    result[0] = func(*args, **kwargs)
+                    with timed("gemini_cache"), get_backend("gemini").guard():
+                        client.caches.update(name=current, config=types.UpdateCachedContentConfig(
+                            ttl=ttl, http_options=http_options))
+                    self._renewed(current, 'refreshed')
+                    return current
                 except Exception as e:
-                    result[0] = e
-            
-            thread = threading.Thread(target=target)
-            thread.daemon = True
-            thread.start()
-            thread.join(seconds)
-            
-            if isinstance(result[0], Exception):
-                raise result[0]
-            return result[0]
-        return wrapper
-    return decorator
-
-@timeout(90)  # Set a 90-second timeout for the entire reasoning process
-def reason(prompt, file_path):
-    print(f"[DEBUG] chatmodel.reason called with file_path: {file_path}")
-    print(f"[DEBUG] Prompt: {prompt}")
+                    if gone(e) != "cache":
+                        raise  # still there: keep using it and retry later
+                    log.debug("Cached instructions %s are gone, creating them afresh: %s", current, e)
+            with timed("gemini_cache"), get_backend("gemini").guard():
+                cached = client.caches.create(model=self.model, config=types.CreateCachedContentConfig(
+                    system_instruction=self.instructions,
+                    ttl=ttl,
+                    display_name="dlweek-reasoning-instructions",
+                    http_options=http_options,
+                ))
+            self._renewed(cached.name, 'created')
+            log.debug("Cached the reasoning instructions as %s", cached.name)
+            return cached.name
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            code = getattr(e, "code", None)
+            with self._lock:
+                self._stats['failed'] += 1
+                if isinstance(code, int) and 400 <= code < 500 and code != 429:
+                    self._refused = str(e)
+                    log.info("Sending the reasoning instructions inline from now on; Gemini would not cache them: %s", e)
+                else:
+                    self._retry_at = time.time() + self.retry_after
+                    log.debug("Could not cache the reasoning instructions, retrying in %gs: %s", self.retry_after, e)
+            return current
+        finally:
+            with self._lock:
+                self._renewing = False
+
+    def _renewed(self, name, counter):
+        with self._lock:
+            self._name = name
+            self._expires = time.time() + self.ttl
+            self._stats[counter] += 1
+
+    def forget(self, name):
+        """Stop using `name`, e.g. after a request that referred to it failed."""
+        with self._lock:
+            if self._name == name:
+                self._name = None
+
+    def clear(self):
+        with self._lock:
+            self._name = None
+            self._retry_at = 0.0
+            self._refused = None
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'name': self._name, 'refused': self._refused,
+                    'expires_in': round(self._expires - time.time()) if self._name else None}
+
+_instruction_cache = None
+
+def get_instruction_cache():
+    global _instruction_cache
+    if _instruction_cache is None:
+        with _client_lock:
+            if _instruction_cache is None:
+                _instruction_cache = InstructionCache()
+    return _instruction_cache
+
+def wait_until_processed(client, media_file, deadline):
+    """Poll a new upload until Gemini has processed it.
+
+    The first check comes after UPLOAD_POLL_INITIAL seconds and the
+    interval doubles up to UPLOAD_POLL_MAX, so short clips are ready
+    sooner and long ones cost fewer calls than a fixed one-second loop.
+    Waiting stops after UPLOAD_PROCESSING_TIMEOUT or at `deadline`.
+    """
+    delay = UPLOAD_POLL_INITIAL
+    give_up = time.time() + UPLOAD_PROCESSING_TIMEOUT
+    while media_file.state.name == "PROCESSING":
+        remaining = min(give_up - time.time(), deadline.timeout(before="Gemini finished processing the upload"))
+        if remaining <= 0:
+            log.debug("File processing timeout exceeded")
+            raise TimeoutError("File processing took too long")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, UPLOAD_POLL_MAX)
+        media_file = client.files.get(name=media_file.name, config=types.GetFileConfig(
+            http_options=request_options(deadline, "checking the Gemini upload")))
+    if media_file.state.name == "FAILED":
+        raise RuntimeError(f"Gemini could not process {media_file.name}")
+    return media_file
+
+def gone(e):
+    """What a failed Gemini request says no longer exists: "cache", "file" or None.
+
+    Gemini answers 403 or 404 for cached content or a file that expired,
+    was deleted or belongs to another key; anything else (429, 5xx, a
+    network error, the deadline) says nothing about either.
+    """
+    if getattr(e, "code", None) not in (403, 404):
+        return None
+    message = str(e).lower()
+    if "cachedcontent" in message:
+        return "cache"
+    if "file" in message:
+        return "file"
+    return None
+
+def upload(file_path, digest=None, deadline=None):
+    """Upload a media file to Gemini and wait until it has been processed.
+
+    A file with the same content uploaded earlier is reused while it has
+    not expired; concurrent uploads of the same content wait for one.
+    `deadline` bounds the whole upload (default: a fresh request budget).
+    """
+    log.debug("chatmodel.upload called with file_path: %s", file_path)
+    deadline = deadline or Deadline()
+    digest = digest or cache.file_sha256(file_path)
+    registry = get_registry()
+    if not registry.lock(digest, deadline.timeout(before="the Gemini upload")):
+        raise DeadlineExceeded("Gave up waiting for another upload of the same file")
+    try:
+        media_file = registry.get(digest)
+        if media_file is not None:
+            log.debug("Reusing uploaded file %s", media_file.name)
+            return media_file
+
+        client = get_client()
+        deadline.check("the Gemini upload")
+        with tracked("gemini_upload", deadline):
+            log.debug("Uploading file: %s", file_path)
+            with timed("gemini_upload"), get_backend("gemini").guard():
+                media_file = client.files.upload(file=file_path, config=types.UploadFileConfig(
+                    http_options=request_options(deadline, "the Gemini upload")))
+            log.debug("File uploaded, state: %s", media_file.state.name)
+
+            log.debug("Waiting for file processing")
+            try:
+                with timed("gemini_poll"):
+                    media_file = wait_until_processed(client, media_file, deadline)
+            except Exception:
+                _delete(media_file)
+                raise
+        log.debug("File processing complete, state: %s", media_file.state.name)
+        registry.add(digest, media_file)
+        return media_file
+    finally:
+        registry.unlock(digest)
+
+def _delete(media_file):
+    try:
+        log.debug("Deleting uploaded file: %s", media_file.name)
+        get_client().files.delete(name=media_file.name)
+    except Exception as e:
+        log.debug("Could not delete uploaded file %s: %s", media_file.name, e)
+
+def discard(media_file):
+    """Release an upload this request no longer needs.
+
+    Registered uploads stay available for later requests until they
+    expire or are evicted; anything else is deleted.
+    """
+    if not get_registry().holds(media_file):
+        _delete(media_file)
+
+def use_frame_summary(file_path, duration=0):
+    """Whether a video should be described by its frames instead of uploaded."""
+    if VIDEO_MODE != "auto":
+        return VIDEO_MODE == "summary"
+    return os.path.getsize(file_path) >= SUMMARY_MIN_BYTES or duration >= SUMMARY_MIN_SECONDS
+
+def _timestamp(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}:{seconds:04.1f}"
+
+def frame_summary(frames):
+    """Build inline contents standing in for a video: a timeline, then its frames.
+
+    `frames` is the mlmodel.VideoFrames sampled for detection; its JPEG
+    buffers are sent as they are, in chronological order.
+    """
+    samples = sorted(zip(frames.indices, frames.buffers, frames.weights))
+    fps = frames.fps or 0
+    lines = [
+        f"The video was not uploaded. It is {_timestamp(frames.duration)} long "
+        f"({frames.frame_count} frames at {fps:.1f} fps); the {len(samples)} images "
+        "after this text are frames sampled from it, in order:"
+    ]
+    for number, (index, _, weight) in enumerate(samples, 1):
+        line = f"- Image {number}: frame {index}"
+        if fps > 0:
+            line += f" at {_timestamp(index / fps)}"
+        if weight > 1:
+            line += f" (looks the same as {weight - 1} other sampled frame{'s' if weight > 2 else ''})"
+        lines.append(line)
+    lines.append("Treat the images as stills from this one video.")
+    parts = [types.Part.from_bytes(data=buffer, mime_type="image/jpeg") for _, buffer, _ in samples]
+    return ["\n".join(lines), *parts]
+
+def _generate(client, model, contents, generation, deadline, on_text, streamed):
+    """One generate request; with `on_text` each streamed piece also goes to `streamed`."""
+    request = dict(model=model, contents=contents, config=generation)
+    if on_text is None:
+        return client.models.generate_content(**request).text
+    for chunk in client.models.generate_content_stream(**request):
+        deadline.check("streaming Gemini's analysis")
+        if chunk.text:
+            streamed.append(chunk.text)
+            on_text(chunk.text)
+    return "".join(streamed)
+
+def reason(prompt, file_path, media_file=None, digest=None, frames=None, deadline=None, on_text=None):
+    """Ask Gemini to reason about a media file.
+
+    `prompt` is the per-request part of the question; REASONING_INSTRUCTIONS
+    are added to it, by reference to Gemini's context cache when possible
+    (see InstructionCache). `media_file` may be a file already returned by `upload()`, e.g. one
+    uploaded while detection was still running; otherwise the file at
+    `file_path` is uploaded here (or reused, see `upload()`). `digest` is
+    the content hash of the file, if already known.
+
+    Passing the video's sampled `frames` sends them inline with a timeline
+    (see `frame_summary`) instead of uploading the file.
+
+    With `on_text` the answer is streamed (`generate_content_stream`):
+    `on_text(text)` is called with each piece as it arrives, and the whole
+    answer is still returned at the end.
+
+    No request is started once `deadline` has passed, and each request's
+    HTTP timeout is the time left (at most GEMINI_HTTP_TIMEOUT).
+
+    Only when Gemini reports the upload or the cached instructions gone is
+    either forgotten (a gone upload is also deleted, so it is uploaded
+    afresh next time); if it was the cached instructions, the request is
+    retried once with them inline.
+    """
+    log.debug("chatmodel.reason called with file_path: %s", file_path)
+    log.debug("Prompt: %s", prompt)
+    deadline = deadline or Deadline()
     try:
-        print("[DEBUG] Loading environment variables")
-        config = dotenv.dotenv_values("env")
-        print("[DEBUG] Creating genai client")
-        client = genai.Client(api_key=config["gemini_token"])
+        digest = digest or cache.file_sha256(file_path)
+        uploaded = None
+        if frames is not None and frames.buffers:
+            log.debug("Sending %s frames inline instead of the video", len(frames.buffers))
+            media = frame_summary(frames)
+        else:
+            uploaded = media_file or upload(file_path, digest, deadline)
+            media = [uploaded]
         
-        print(f"[DEBUG] Uploading file: {file_path}")
-        media_file = client.files.upload(file=file_path)
-        print(f"[DEBUG] File uploaded, state: {media_file.state.name}")
-
-        print("[DEBUG] Waiting for file processing")
-        # Add a timeout for the file processing wait loop
-        max_wait_time = 30  # seconds
-        start_time = time.time()
-        while media_file.state.name == "PROCESSING":
-            print('.', end='')
-            time.sleep(1)
-            
-            # Check if we've exceeded the maximum wait time
-            if time.time() - start_time > max_wait_time:
-                print("\n[DEBUG] File processing timeout exceeded")
-                raise TimeoutError("File processing took too long")
-                
-            media_file = client.files.get(name=media_file.name)
-        print(f"\n[DEBUG] File processing complete, state: {media_file.state.name}")
+        client = get_client()
         
-        print("[DEBUG] Generating content with Gemini")
-        response = client.models.generate_content(
-            model = "gemini-1.5-pro",
-            contents = [
-                media_file,
-                prompt
-            ]
-        )
-        print(f"[DEBUG] Response received, length: {len(response.text)}")
+        log.debug("Generating content with Gemini")
+        deadline.check("asking Gemini")
+        instructions = get_instruction_cache()
+        cached = instructions.name(client, deadline)
+        if cached:
+            generation = types.GenerateContentConfig(
+                cached_content=cached, http_options=request_options(deadline, "asking Gemini"))
+        else:
+            generation = types.GenerateContentConfig(
+                system_instruction=instructions.instructions, http_options=request_options(deadline, "asking Gemini"))
+        contents = [*media, prompt]
+        streamed = []
+        with timed("gemini_generate"), get_backend("gemini").guard():
+            with tracked("gemini_reasoning", deadline):
+                try:
+                    text = _generate(client, instructions.model, contents, generation, deadline, on_text, streamed)
+                except Exception as e:
+                    missing = gone(e)
+                    if missing == "file" and uploaded is not None:
+                        get_registry().forget(digest)
+                        _delete(uploaded)
+                    if not (missing == "cache" and cached):
+                        raise
+                    instructions.forget(cached)
+                    if streamed:
+                        raise
+                    log.debug("Cached instructions %s are gone; asking again with them inline", cached)
+                    generation = types.GenerateContentConfig(
+                        system_instruction=instructions.instructions, http_options=request_options(deadline, "asking Gemini"))
+                    text = _generate(client, instructions.model, contents, generation, deadline, on_text, streamed)
+        log.debug("Response received, length: %s", len(text))
         
-        return response.text
+        return text
+    except BackendUnavailable as e:
+        log.debug("Skipping chatmodel.reason: %s", e)
+        return UNAVAILABLE
     except TimeoutError as e:
-        print(f"[DEBUG] Timeout in chatmodel.reason: {str(e)}")
+        log.debug("Timeout in chatmodel.reason: %s", e)
         return f"Analysis timed out: {str(e)}. The media may be too complex to analyze."
     except Exception as e:
-        print(f"[DEBUG] Exception in chatmodel.reason: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        log.debug("Exception in chatmodel.reason: %s", e, exc_info=True)
         return f"Error in analysis: {str(e)}"
 
 # test
@@ -0,0 +1,3 @@
+# test_video_frames.py is a command-line timing script (run it with
+# python); its test_video_frames() takes a path, not a fixture
+collect_ignore = ["test_video_frames.py"]
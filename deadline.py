@@ -0,0 +1,80 @@
+import dotenv
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+config = dotenv.dotenv_values("env")
+
+# End-to-end time budget of one analysis, in seconds
+REQUEST_DEADLINE = float(config.get("request_deadline") or 150)
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class Deadline:
+    """Time budget shared by every stage working on one request.
+
+    Stages bound their waits and HTTP timeouts with `timeout()` and call
+    `check()` between steps, so work stops once the budget is spent instead
+    of running on unobserved. `cancel()` ends the budget early, e.g. once
+    the request has been answered.
+    """
+
+    def __init__(self, seconds=None):
+        self.seconds = REQUEST_DEADLINE if seconds is None else seconds
+        self.expires = time.monotonic() + self.seconds
+        self.cancelled = False
+
+    def remaining(self):
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self, before="continuing"):
+        """Raise DeadlineExceeded if the budget is spent."""
+        if self.cancelled:
+            raise DeadlineExceeded(f"Request was cancelled before {before}")
+        if self.expired:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s passed before {before}")
+
+    def timeout(self, cap=None, before="continuing"):
+        """Seconds left, at most `cap`, to use as a wait or HTTP timeout."""
+        self.check(before)
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+_work = {}
+_work_lock = threading.Lock()
+
+@contextmanager
+def tracked(stage, deadline):
+    """Count a piece of remote work as in flight while the block runs.
+
+    Work still running after its request's deadline has passed (or was
+    cancelled) is reported as orphaned by `stats()`.
+    """
+    token = object()
+    with _work_lock:
+        _work[token] = (stage, deadline)
+    try:
+        yield
+    finally:
+        with _work_lock:
+            del _work[token]
+
+def stats():
+    with _work_lock:
+        work = list(_work.values())
+    return {
+        'in_flight': len(work),
+        'orphaned': sum(1 for _, deadline in work if deadline.expired),
+        'by_stage': dict(Counter(stage for stage, _ in work)),
+    }
@@ -0,0 +1,503 @@
+import io
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+# Local stand-ins for the remote backends, used to exercise the clients
+# without network access. Run `python fakes.py` for a quick self-check;
+# it exits non-zero if any check fails.
+
+class Latency:
+    """Response time of a fake backend: fixed, or log-normal with a long tail.
+
+    `Latency(0.3)` always waits 0.3 s; `Latency(0.3, p99=2)` has a median
+    of 0.3 s and a 99th percentile of 2 s. `Latency.parse("0.3:2")` reads
+    the same from a command line.
+    """
+
+    def __init__(self, median=0.0, p99=None, seed=None):
+        self.median = median
+        self.p99 = p99
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, text, seed=None):
+        median, _, p99 = text.partition(":")
+        return cls(float(median), float(p99) if p99 else None, seed)
+
+    def sample(self):
+        if not self.p99 or self.median <= 0 or self.p99 <= self.median:
+            return self.median
+        sigma = math.log(self.p99 / self.median) / 2.326  # z of the 99th percentile
+        with self._lock:
+            return self._random.lognormvariate(math.log(self.median), sigma)
+
+    def __repr__(self):
+        return f"Latency({self.median}, p99={self.p99})"
+
+def delay(latency):
+    """Seconds to wait for one call, given a Latency or a plain number."""
+    return latency.sample() if isinstance(latency, Latency) else latency
+
+class StubRecognitionHandler(BaseHTTPRequestHandler):
+    """Speaks the recognition API: POST /recognize and POST /recognize/batch."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        try:
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client stopped waiting, e.g. at its read timeout
+
+    def _match(self):
+        stub = self.server
+        if stub.user is None:
+            return {"UserMatches": []}
+        return {"UserMatches": [{"Similarity": stub.similarity, "User": {"UserId": stub.user}}]}
+
+    def do_POST(self):
+        stub = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with stub.lock:
+            stub.requests += 1
+            failing = stub.requests <= stub.fail_first or random.random() < stub.failure_rate
+        time.sleep(delay(stub.latency))
+        if failing:
+            self._reply(503, {"error": "stub failure"})
+        elif self.path == "/recognize/batch":
+            stub.images += len(body.get("images", []))
+            self._reply(200, {"results": [self._match() for _ in body.get("images", [])]})
+        elif self.path == "/recognize":
+            stub.images += 1
+            self._reply(200, self._match())
+        else:
+            self._reply(404, {"error": "not found"})
+
+def start_recognition_stub(latency=0.0, failure_rate=0.0, fail_first=0, user="stub-user", similarity=99.0, port=0):
+    """Serve the stub recognition API on a background thread.
+
+    `latency` is seconds or a Latency. Returns the server; its `url` and
+    `batch_url` attributes are the
+    endpoints to put in `test_api_url` / `test_api_batch_url`, and
+    `requests` / `images` count what it received. Call `shutdown()` to stop.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubRecognitionHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.failure_rate = failure_rate
+    server.fail_first = fail_first
+    server.user = user
+    server.similarity = similarity
+    server.requests = 0
+    server.images = 0
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_port}/recognize"
+    server.batch_url = f"http://127.0.0.1:{server.server_port}/recognize/batch"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def check_recognition_client():
+    import recognition_api
+    from deadline import Deadline
+    from resilience import get_backend
+
+    match = (200, 99.0, "stub-user")
+    stub = start_recognition_stub(fail_first=2)
+    recognition_api.config = {**recognition_api.config, "test_api_url": stub.url}
+    result = recognition_api.test_api(b"\xff\xd8fake")
+    print("single call after two 503s:", result, f"({stub.requests} requests)")
+    assert result == match, result
+    assert stub.requests == 3, stub.requests
+
+    recognition_api.config["test_api_batch_url"] = stub.batch_url
+    before = stub.requests
+    results = recognition_api.test_api_batch([b"\xff\xd8fake"] * 5)
+    print("batch of 5:", results, f"({stub.requests - before} request)")
+    assert results == [match] * 5, results
+    assert stub.requests - before == 1, stub.requests - before
+    stub.shutdown()
+
+    recognition_api.READ_TIMEOUT = 1
+    slow = start_recognition_stub(latency=2)
+    recognition_api.config["test_api_url"] = slow.url
+    start = time.time()
+    try:
+        recognition_api.test_api(b"\xff\xd8fake")
+    except Exception as e:
+        elapsed = time.time() - start
+        print(f"slow backend failed after {elapsed:.1f}s: {type(e).__name__}")
+        assert elapsed < 2, elapsed
+    else:
+        raise AssertionError("a backend slower than the read timeout answered")
+    slow.shutdown()
+    assert get_backend("recognition").stats()['state'] == "closed"
+
+    # Retries stop at the request's deadline
+    failing = start_recognition_stub(latency=0.3, failure_rate=1.0)
+    recognition_api.config["test_api_url"] = failing.url
+    start = time.time()
+    try:
+        recognition_api.test_api(b"\xff\xd8fake", Deadline(1))
+    except Exception as e:
+        elapsed = time.time() - start
+        print(f"retries against a failing backend gave up after {elapsed:.1f}s and {failing.requests} requests:",
+              type(e).__name__)
+        assert elapsed < 1.2 and failing.requests <= recognition_api.RETRIES, (elapsed, failing.requests)
+    else:
+        raise AssertionError("a backend answering 503 to everything matched a face")
+    failing.shutdown()
+
+class FakeJob:
+    """A submitted fake detection job that is done `seconds` after submission."""
+
+    def __init__(self, client, seconds, failing, label):
+        self.client = client
+        self.due = time.monotonic() + seconds
+        self.failing = failing
+        self.label = label
+
+    def result(self, timeout=None):
+        remaining = self.due - time.monotonic()
+        if timeout is not None and remaining > timeout:
+            time.sleep(max(0.0, timeout))
+            raise FutureTimeoutError()
+        time.sleep(max(0.0, remaining))
+        if self.failing:
+            from gradio_client.exceptions import AppError
+            raise AppError("fake detection failure")
+        other = "Real" if self.label == "Fake" else "Fake"
+        confidence = self.client.confidence
+        return ({'label': self.label, 'confidences': [
+            {'label': self.label, 'confidence': confidence},
+            {'label': other, 'confidence': round(1 - confidence, 6)},
+        ]}, None)
+
+    def cancel(self):
+        with self.client.lock:
+            self.client.calls["cancel"] += 1
+        return True
+
+class FakeDetectionClient:
+    """In-process stand-in for the gradio client of the detection Space.
+
+    Each `submit()` returns a job that finishes `latency` later, labelled
+    Fake with probability `fake_rate` and failing with `failure_rate`.
+    `calls` counts submissions per api_name and cancelled jobs. Install it
+    with `mlmodel.set_client_pool(mlmodel.ClientPool(None, None, factory=lambda: fake))`.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, fake_rate=0.0, confidence=0.9):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fake_rate = fake_rate
+        self.confidence = confidence
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def submit(self, inp=None, model=None, api_name=None, **kwargs):
+        with self.lock:
+            self.calls[api_name] += 1
+        label = "Fake" if random.random() < self.fake_rate else "Real"
+        return FakeJob(self, delay(self.latency), random.random() < self.failure_rate, label)
+
+    def close(self):
+        pass
+
+class FakeAPIError(Exception):
+    """Error with an HTTP status `code`, like google.genai.errors.APIError."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+class FakeGeminiClient:
+    """In-process stand-in for `genai.Client` (files, caches and models.generate_content[_stream]).
+
+    An upload reports PROCESSING for its first `processing_polls` calls to
+    `files.get` and expires `ttl` seconds after it was made. `calls`
+    counts every method called, e.g. calls["files.upload"]. `latency` is
+    seconds or a Latency; a streamed reply arrives a word at a time,
+    `chunk_delay` seconds apart. Cached content expires by its own TTL and
+    is refused below `min_cache_chars`; `prompt_chars` totals the prompt
+    text (system instruction included) sent to generate, and `timeouts`
+    records each generate request's HTTP timeout. Install it with
+    `chatmodel.set_client(FakeGeminiClient())`.
+    """
+
+    def __init__(self, processing_polls=2, latency=0.0, failure_rate=0.0, ttl=48 * 3600, reply="Fake analysis.",
+                 chunk_delay=0.0, min_cache_chars=0):
+        self.processing_polls = processing_polls
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.ttl = ttl
+        self.reply = reply
+        self.chunk_delay = chunk_delay
+        self.min_cache_chars = min_cache_chars
+        self.calls = Counter()
+        self.stored = {}
+        self.cached = {}  # name -> expiry (time.time())
+        self.prompt_chars = 0
+        self.timeouts = []  # milliseconds, or None for the client's default
+        self.lock = threading.Lock()
+        self.files = SimpleNamespace(upload=self._upload, get=self._get, delete=self._delete)
+        self.caches = SimpleNamespace(create=self._create_cache, update=self._update_cache, delete=self._delete_cache)
+        self.models = SimpleNamespace(generate_content=self._generate_content,
+                                      generate_content_stream=self._generate_content_stream)
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        time.sleep(delay(self.latency))
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"fake {name} failure")
+
+    def _snapshot(self, name):
+        entry = self.stored[name]
+        state = "PROCESSING" if entry["polls"] < self.processing_polls else "ACTIVE"
+        return SimpleNamespace(name=name, state=SimpleNamespace(name=state),
+                               expiration_time=entry["expires"], size_bytes=entry["size"])
+
+    def _upload(self, file, **kwargs):
+        self._call("files.upload")
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        with self.lock:
+            self.stored[name] = {"polls": 0, "size": os.path.getsize(file),
+                                 "expires": datetime.now(timezone.utc) + timedelta(seconds=self.ttl)}
+            return self._snapshot(name)
+
+    def _get(self, name, **kwargs):
+        self._call("files.get")
+        with self.lock:
+            if name not in self.stored:
+                raise FakeAPIError(404, f"{name} not found")
+            self.stored[name]["polls"] += 1
+            return self._snapshot(name)
+
+    def _delete(self, name, **kwargs):
+        self._call("files.delete")
+        with self.lock:
+            self.stored.pop(name, None)
+
+    def _create_cache(self, model, config):
+        self._call("caches.create")
+        if len(config.system_instruction or "") < self.min_cache_chars:
+            raise FakeAPIError(400, f"cached content must be at least {self.min_cache_chars} characters")
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        with self.lock:
+            self.cached[name] = time.time() + float(config.ttl.rstrip("s"))
+        return SimpleNamespace(name=name)
+
+    def _update_cache(self, name, config):
+        self._call("caches.update")
+        with self.lock:
+            if self.cached.get(name, 0) < time.time():
+                raise FakeAPIError(404, f"{name} not found")
+            self.cached[name] = time.time() + float(config.ttl.rstrip("s"))
+        return SimpleNamespace(name=name)
+
+    def _delete_cache(self, name, **kwargs):
+        self._call("caches.delete")
+        with self.lock:
+            self.cached.pop(name, None)
+
+    def _check_request(self, contents, config):
+        cached = getattr(config, "cached_content", None)
+        with self.lock:
+            if cached and self.cached.get(cached, 0) < time.time():
+                raise FakeAPIError(404, f"{cached} not found")
+            for part in contents:
+                if hasattr(part, "name") and part.name not in self.stored:
+                    raise FakeAPIError(404, f"{part.name} not found")
+            self.prompt_chars += sum(len(part) for part in contents if isinstance(part, str))
+            self.prompt_chars += len(getattr(config, "system_instruction", None) or "")
+            self.timeouts.append(getattr(getattr(config, "http_options", None), "timeout", None))
+
+    def _generate_content(self, model, contents, config=None, **kwargs):
+        self._call("models.generate_content")
+        self._check_request(contents, config)
+        return SimpleNamespace(text=self.reply)
+
+    def _generate_content_stream(self, model, contents, config=None, **kwargs):
+        self._call("models.generate_content_stream")
+        self._check_request(contents, config)
+        for number, word in enumerate(self.reply.split(" ")):
+            if number:
+                time.sleep(self.chunk_delay)
+            yield SimpleNamespace(text=word if not number else " " + word)
+
+def check_detection_client():
+    import mlmodel
+    from deadline import Deadline
+    from resilience import get_backend
+
+    fake = FakeDetectionClient(latency=Latency(0.05, p99=0.2), fake_rate=1.0)
+    mlmodel.set_client_pool(mlmodel.ClientPool(None, None, factory=lambda: fake))
+    label = mlmodel.image(b"\xff\xd8fake")[0]["label"]
+    print("image:", label)
+    assert label == "Fake", label
+
+    fake.latency = 2
+    start = time.time()
+    try:
+        mlmodel.image(b"\xff\xd8fake", Deadline(0.5))
+    except TimeoutError as e:
+        elapsed = time.time() - start
+        print(f"slow Space gave up after {elapsed:.1f}s: {type(e).__name__}, {fake.calls['cancel']} job cancelled")
+        assert elapsed < 1, elapsed
+        assert fake.calls['cancel'] == 1, fake.calls
+    else:
+        raise AssertionError("the detection call outlived its deadline")
+    # Running out of time is not the Space's fault
+    breaker = get_backend("hf_detection").stats()
+    assert breaker['state'] == "closed" and breaker['failure_rate'] == 0, breaker
+
+def check_gemini_client():
+    import chatmodel
+    from deadline import Deadline
+
+    fake = FakeGeminiClient(processing_polls=3)
+    chatmodel.set_client(fake)
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as media:
+        media.write(b"fake video")
+        media.flush()
+        start = time.time()
+        first = chatmodel.upload(media.name)
+        print(f"upload ready after {time.time() - start:.2f}s and {fake.calls['files.get']} status checks")
+        assert fake.calls["files.get"] == 3, fake.calls
+        again = chatmodel.upload(media.name)
+        print("second upload reused the first:", again.name == first.name, dict(fake.calls))
+        assert again.name == first.name and fake.calls["files.upload"] == 1, fake.calls
+        reply = chatmodel.reason("Summarise", media.name)
+        print("reason:", reply)
+        assert reply == fake.reply, reply
+        pieces = []
+        streamed = chatmodel.reason("Summarise", media.name, on_text=pieces.append)
+        print("streamed:", streamed == "".join(pieces), pieces)
+        assert streamed == fake.reply == "".join(pieces) and len(pieces) > 1, pieces
+        chatmodel.reason("Summarise", media.name, deadline=Deadline(5))
+        print("generate bounded by the deadline:", fake.timeouts[-1], "ms")
+        assert 4000 < fake.timeouts[-1] <= 5000, fake.timeouts
+        print("instructions cached once:", fake.calls["caches.create"] == 1, f"{fake.prompt_chars} prompt characters sent")
+        assert fake.calls["caches.create"] == 1, fake.calls
+        assert fake.prompt_chars < len(chatmodel.REASONING_INSTRUCTIONS), fake.prompt_chars
+
+        instructions = chatmodel.get_instruction_cache()
+        instructions._expires = time.time() + 1  # about to expire
+        chatmodel.reason("Summarise", media.name)
+        print("cache extended:", fake.calls["caches.update"], "update,", fake.calls["caches.create"], "create")
+        assert (fake.calls["caches.update"], fake.calls["caches.create"]) == (1, 1), fake.calls
+        fake.cached.clear()  # deleted remotely
+        retried, recovered = chatmodel.reason("Summarise", media.name), chatmodel.reason("Summarise", media.name)
+        print("after the cache vanished:", retried, "(inline) then", recovered, "with", fake.calls["caches.create"], "creates")
+        assert retried == recovered == fake.reply and fake.calls["caches.create"] == 2, (retried, fake.calls)
+        stats = instructions.stats()
+        assert stats['cached_requests'] == 6 and stats['inline_requests'] == 0, stats
+
+        # Overloaded answers keep the upload and the cached instructions
+        generate, attempts = fake.models.generate_content, Counter()
+        def overloaded(**request):
+            attempts["generate"] += 1
+            if attempts["generate"] % 2:
+                raise FakeAPIError(503, "The model is overloaded")
+            return generate(**request)
+        fake.models.generate_content = overloaded
+        uploaded, created = fake.calls["files.upload"], fake.calls["caches.create"]
+        replies = [chatmodel.reason("Summarise", media.name) for _ in range(6)]
+        fake.models.generate_content = generate
+        print("with every other request overloaded:", Counter(replies)[fake.reply], "of 6 answered,",
+              fake.calls["files.upload"] - uploaded, "uploads,", fake.calls["caches.create"] - created, "creates")
+        assert Counter(replies)[fake.reply] == 3, replies
+        assert fake.calls["files.upload"] == uploaded and fake.calls["caches.create"] == created, fake.calls
+        assert len(fake.stored) == 1 and len(fake.cached) == 1, (fake.stored, fake.cached)
+
+        fake.min_cache_chars = 10 ** 6
+        chatmodel.set_client(fake)
+        sent, created = fake.prompt_chars, fake.calls["caches.create"]
+        chatmodel.reason("Summarise", media.name)
+        chatmodel.reason("Summarise", media.name)
+        print(f"too small to cache: sent inline ({fake.prompt_chars - sent} characters),",
+              fake.calls["caches.create"] - created, "create attempt")
+        assert fake.calls["caches.create"] - created == 1, fake.calls
+        assert fake.prompt_chars - sent > 2 * len(chatmodel.REASONING_INSTRUCTIONS), fake.prompt_chars - sent
+        stats = chatmodel.get_instruction_cache().stats()
+        assert stats['refused'] and stats['inline_requests'] == 2, stats
+        fake.min_cache_chars = 0
+
+        fake.ttl = 60  # expires within the registry's safety margin
+        chatmodel.get_registry().clear()
+        chatmodel.REQUEST_DEADLINE, request_deadline = 0.1, chatmodel.REQUEST_DEADLINE
+        uploaded, deleted = fake.calls["files.upload"], fake.calls["files.delete"]
+        first = chatmodel.upload(media.name)
+        second = chatmodel.upload(media.name)
+        time.sleep(0.3)
+        chatmodel.REQUEST_DEADLINE = request_deadline
+        print("uploads of a soon-to-expire file:", fake.calls["files.upload"] - uploaded,
+              "with", fake.calls["files.delete"] - deleted, "replaced one deleted")
+        assert fake.calls["files.upload"] - uploaded == 2, fake.calls
+        assert first.name not in fake.stored and second.name in fake.stored, fake.stored
+        assert fake.calls["files.delete"] - deleted == 1, fake.calls
+
+        fake.failure_rate = 1.0
+        try:
+            chatmodel.upload(media.name, digest="0" * 64)
+        except RuntimeError:
+            pass
+        fake.failure_rate = 0.0
+        stats = chatmodel.get_registry().stats()
+        print("upload locks left after a failed upload:", stats['locks'])
+        assert stats['locks'] == 0, stats
+
+def check_coalesced_admission(uploads=10):
+    """Identical videos uploaded at once share one analysis and are never turned away."""
+    from concurrent.futures import ThreadPoolExecutor
+    import admission
+    import app
+    import bench
+    from bench_frames import make_synthetic_video
+
+    workdir = tempfile.mkdtemp(prefix="fakes_")
+    backends = bench.install_fakes(workdir, hf_latency="0.2", recognition_latency="0.01",
+                                   gemini_latency="0.05", gemini_polls=0)
+    video_path = os.path.join(workdir, "same.mp4")
+    make_synthetic_video(video_path, 60)
+    with open(video_path, "rb") as video:
+        data = video.read()
+    lane = admission.get_lane("video")
+    rejected = lane.stats()['rejected']
+    client = app.app.test_client()
+
+    def post(_):
+        response = client.post("/api/analyze", data={"file": (io.BytesIO(data), "same.mp4")})
+        return response.status_code
+
+    # More uploads than the video lane has workers and queue places together
+    uploads = max(uploads, lane.workers + lane.queue_size + 1)
+    with ThreadPoolExecutor(uploads) as executor:
+        statuses = Counter(executor.map(post, range(uploads)))
+    print(f"{uploads} identical uploads:", dict(statuses), f"{sum(backends.detection.calls.values())} detection calls")
+    assert statuses == {200: uploads}, statuses
+    assert lane.stats()['rejected'] == rejected
+
+if __name__ == "__main__":
+    check_detection_client()
+    check_recognition_client()
+    check_gemini_client()
+    check_coalesced_admission()
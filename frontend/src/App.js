@@ -10,6 +10,7 @@ function App() {
   const [error, setError] = useState(null);
   const [file, setFile] = useState(null);
   const [filePreview, setFilePreview] = useState(null);
+  const [progress, setProgress] = useState(null);
 
   const handleReset = () => {
     setResult(null);
@@ -17,6 +18,7 @@ function App() {
     setError(null);
     setFile(null);
     setFilePreview(null);
+    setProgress(null);
   };
 
   return (
@@ -54,10 +56,11 @@ function App() {
               setError={setError}
               setFile={setFile}
               setFilePreview={setFilePreview}
+              setProgress={setProgress}
             />
           )}
 
-          {loading && <LoadingState />}
+          {loading && <LoadingState stage={progress} />}
 
           {error && (
             <Box sx={{ mt: 3, textAlign: 'center' }}>
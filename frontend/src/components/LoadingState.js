@@ -1,12 +1,22 @@
 import React from 'react';
 import { Box, CircularProgress, Typography } from '@mui/material';
 
-const LoadingState = () => {
+const STAGE_MESSAGES = {
+  queued: 'Waiting for a free analysis slot...',
+  started: 'Analyzing your media...',
+  detection: 'Running deepfake detection...',
+  detected: 'Detection complete, identifying faces...',
+  recognition: 'Identifying faces...',
+  recognized: 'Preparing detailed analysis...',
+  reasoning: 'Generating detailed analysis...',
+};
+
+const LoadingState = ({ stage }) => {
   return (
     <Box className="loading-container">
       <CircularProgress size={60} thickness={4} />
       <Typography variant="h6" sx={{ mt: 3 }}>
-        Analyzing your media...
+        {STAGE_MESSAGES[stage] || 'Analyzing your media...'}
       </Typography>
       <Typography variant="body2" color="text.secondary" sx={{ mt: 1 }}>
         This may take a few moments as we process your file through multiple AI models.
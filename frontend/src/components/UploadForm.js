@@ -7,7 +7,7 @@ import axios from 'axios';
 // Get the API URL from environment variables or use the default
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000';
 
-const UploadForm = ({ setLoading, setResult, setError, setFile, setFilePreview }) => {
+const UploadForm = ({ setLoading, setResult, setError, setFile, setFilePreview, setProgress }) => {
   const onDrop = useCallback(acceptedFiles => {
     if (acceptedFiles.length === 0) {
       setError('Please upload a valid image or video file.');
@@ -46,24 +46,87 @@ const UploadForm = ({ setLoading, setResult, setError, setFile, setFilePreview }
     maxFiles: 1
   });
 
+  // Follow a queued analysis job over Server-Sent Events, falling back to
+  // polling the job status if the event stream is unavailable
+  const waitForJob = (job) => new Promise((resolve, reject) => {
+    const finish = (data) => {
+      if (data.status === 'error' || data.stage === 'error') {
+        reject(new Error(data.error || 'Analysis failed'));
+      } else {
+        resolve(data.result);
+      }
+    };
+
+    const poll = async () => {
+      try {
+        const { data } = await axios.get(`${API_URL}${job.status_url}`);
+        if (setProgress) setProgress(data.stage);
+        if (data.status === 'done' || data.status === 'error') {
+          finish(data);
+        } else {
+          setTimeout(poll, 2000);
+        }
+      } catch (error) {
+        reject(error);
+      }
+    };
+
+    if (typeof EventSource === 'undefined') {
+      poll();
+      return;
+    }
+
+    const source = new EventSource(`${API_URL}${job.events_url}`);
+    // Show the verdict as soon as it arrives and the detailed analysis as it
+    // is written; the final result replaces it when the job is done
+    let partial = '';
+    const onText = (event) => {
+      const data = JSON.parse(event.data);
+      partial = data.stage === 'verdict' ? data.text : partial + data.text;
+      setResult(partial);
+      setLoading(false);
+    };
+    const onEvent = (event) => {
+      const data = JSON.parse(event.data);
+      if (setProgress) setProgress(data.stage);
+      if (data.stage === 'done' || data.stage === 'error') {
+        source.close();
+        finish(data);
+      }
+    };
+    ['queued', 'started', 'detection', 'detected', 'recognition', 'recognized', 'reasoning', 'done', 'error']
+      .forEach((stage) => source.addEventListener(stage, onEvent));
+    ['verdict', 'reasoning_chunk'].forEach((stage) => source.addEventListener(stage, onText));
+    source.onerror = () => {
+      source.close();
+      poll();
+    };
+  });
+
   const handleUpload = async (file) => {
     const formData = new FormData();
     formData.append('file', file);
 
     setLoading(true);
     setError(null);
+    if (setProgress) setProgress(null);
 
     try {
-      const response = await axios.post(`${API_URL}/api/analyze`, formData, {
+      const response = await axios.post(`${API_URL}/api/analyze?async=1`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data'
         }
       });
-      setResult(response.data.result);
+      if (response.data.job_id) {
+        setResult(await waitForJob(response.data));
+      } else {
+        setResult(response.data.result);
+      }
     } catch (error) {
       console.error('Error uploading file:', error);
       setError(
         error.response?.data?.error || 
+        error.message ||
         'An error occurred while analyzing the file. Please try again.'
       );
     } finally {
@@ -0,0 +1,121 @@
+import dotenv
+import hashlib
+import logging
+import os
+import tempfile
+from flask import Request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+import blobstore
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+MB = 1 << 20
+# Largest request body accepted at all, in bytes
+MAX_CONTENT_LENGTH = int(config.get("max_content_length") or 512 * MB)
+# Largest upload accepted per media type, in bytes
+MAX_IMAGE_BYTES = int(config.get("max_image_bytes") or 25 * MB)
+MAX_VIDEO_BYTES = int(config.get("max_video_bytes") or 500 * MB)
+# Bytes needed to recognise every supported format
+SNIFF_BYTES = 12
+# ISO base media major brands that are not video (HEIF/AVIF images, MPEG-4
+# audio and audiobooks); any other ftyp file is taken for a video
+NON_VIDEO_BRANDS = {b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1", b"avif", b"avis",
+                    b"M4A ", b"M4B ", b"M4P "}
+# Atoms a QuickTime movie without an ftyp atom may start with
+QUICKTIME_ATOMS = {b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+
+def sniff(head):
+    """Return (media type, extension) for the first bytes of a file, or (None, None)."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image", ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image", ".png"
+    if head[4:8] == b"ftyp":
+        if head[8:12] in NON_VIDEO_BRANDS:
+            return None, None
+        return "video", ".mov" if head[8:12] == b"qt  " else ".mp4"
+    if head[4:8] in QUICKTIME_ATOMS:
+        return "video", ".mov"
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return "video", ".avi"
+    return None, None
+
+def limit_for(media_type):
+    return MAX_VIDEO_BYTES if media_type == "video" else MAX_IMAGE_BYTES
+
+class IngestFile:
+    """Write target for one uploaded file, checked and hashed as it streams in.
+
+    The data goes straight to a hidden temporary file in the upload
+    store's directory. The type is sniffed from the first bytes, so
+    unsupported media is refused (415) before the rest is received, and an
+    upload over its type's limit is refused (413) as soon as it passes it.
+    `finish()` hands the file to the store under its content hash.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.media_type = None
+        self.extension = None
+        self.path = None
+        self._head = b""
+        self._file = tempfile.NamedTemporaryFile(dir=store.directory, prefix=".ingest-", delete=False)
+
+    def _reject(self, error):
+        self.discard()
+        raise error
+
+    def write(self, data):
+        self.size += len(data)
+        if self.media_type is None:
+            self._head += data[:SNIFF_BYTES]
+            if len(self._head) >= SNIFF_BYTES:
+                self.media_type, self.extension = sniff(self._head)
+                if self.media_type is None:
+                    self._reject(UnsupportedMediaType("Only JPEG, PNG, MP4, MOV and AVI files are accepted"))
+        if self.media_type is not None and self.size > limit_for(self.media_type):
+            self._reject(RequestEntityTooLarge(
+                f"{self.media_type.capitalize()}s may be at most {limit_for(self.media_type) // MB} MB"))
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def finish(self):
+        """Validate the complete upload and store it; returns its path, referenced (see BlobStore.add)."""
+        if self.media_type is None:
+            self._reject(BadRequest("The upload is empty or too short to be an image or video"))
+        self._file.flush()
+        self._file.close()
+        self.path = self.store.add(self._file.name, self.digest, self.extension)
+        return self.path
+
+    @property
+    def digest(self):
+        return self.sha256.hexdigest()
+
+    def discard(self):
+        """Delete the partial upload (no-op once finished)."""
+        if self.path is not None:
+            return
+        self._file.close()
+        try:
+            os.remove(self._file.name)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        # Called when the request ends: an upload the view never finished
+        # (an extra file field, an error) is thrown away
+        self.discard()
+
+    def __getattr__(self, name):
+        # seek(), read() etc. as used by the form parser and FileStorage
+        return getattr(self._file, name)
+
+class IngestRequest(Request):
+    """Request whose file uploads stream into the upload store through IngestFile."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestFile(blobstore.get_store())
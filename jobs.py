@@ -0,0 +1,139 @@
+import dotenv
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+# Pipelines run at the same time in job mode, per lane
+JOB_WORKERS = int(config.get("job_workers") or 4)
+# Jobs allowed to wait for a worker before new submissions are refused
+JOB_QUEUE_SIZE = int(config.get("job_queue_size") or 32)
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION = float(config.get("job_retention") or 3600)
+
+class QueueFullError(Exception):
+    pass
+
+class Job:
+    """State and progress events of one queued pipeline run."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.stage = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.updated = self.created
+        self.events = []
+        self.changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def emit(self, stage, status=None, **detail):
+        """Record a progress event, optionally moving the job to a new status."""
+        with self.changed:
+            if status is not None:
+                self.status = status
+            self.stage = stage
+            self.updated = time.time()
+            self.events.append({'stage': stage, 'time': self.updated, **detail})
+            self.changed.notify_all()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'updated': self.updated,
+            'events': list(self.events),
+        }
+
+class JobManager:
+    """Runs submitted pipelines on a bounded worker pool and tracks their progress."""
+
+    def __init__(self, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, retention=JOB_RETENTION):
+        self.queue_size = queue_size
+        self.retention = retention
+        self.workers = workers
+        self._executors = {}  # lane -> ThreadPoolExecutor
+        self._jobs = {}
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, lane=None, **kwargs):
+        """Queue `fn(*args, progress=job.emit, **kwargs)` and return its Job.
+
+        Each `lane` (e.g. "image" or "video") has its own workers, so a
+        backlog in one never holds up jobs in another.
+        """
+        self._prune()
+        job = Job()
+        with self._lock:
+            if self._queued >= self.queue_size:
+                raise QueueFullError(f"{self._queued} jobs already waiting")
+            self._queued += 1
+            self._jobs[job.id] = job
+            executor = self._executors.get(lane)
+            if executor is None:
+                executor = self._executors[lane] = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=f"job-{lane}" if lane else "job")
+        job.emit("queued")
+        executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+        job.emit("started", status="running")
+        try:
+            job.result = fn(*args, progress=job.emit, **kwargs)
+            job.emit("done", status="done", result=job.result)
+        except Exception as e:
+            log.debug("Job %s failed: %s", job.id, e)
+            job.error = str(e)
+            job.emit("error", status="error", error=job.error)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished and j.updated < cutoff]:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def stream(self, job, keepalive=15):
+        """Yield the job's events as they happen, then stop once it has finished.
+
+        None is yielded when no event arrived within `keepalive` seconds so
+        the caller can keep the connection open.
+        """
+        sent = 0
+        while True:
+            with job.changed:
+                if sent == len(job.events) and not job.finished:
+                    job.changed.wait(keepalive)
+                events = job.events[sent:]
+                finished = job.finished
+            if not events and not finished:
+                yield None
+            for event in events:
+                yield event
+            sent += len(events)
+            if finished and sent == len(job.events):
+                return
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == "running")
+            return {'queued': self._queued, 'running': running, 'tracked': len(self._jobs)}
@@ -1,111 +1,403 @@
 import dotenv
+import logging
 from gradio_client import Client, handle_file
+from gradio_client.exceptions import AppError
+import contextvars
+import httpx
+import math
+import queue
 import time
 import signal
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from urllib.parse import urljoin
 import threading
 import cv2
 import os
 import tempfile
 import uuid
 import numpy as np
+from deadline import Deadline, DeadlineExceeded, tracked
+from observability import timed
+from resilience import BackendUnavailable, get_backend
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+HF_SPACE = "dlweekproj/deepfakedetection"
+# Number of warm clients shared by all request threads
+CLIENT_POOL_SIZE = int(config.get("hf_client_pool_size") or 4)
+# Idle clients older than this are pinged before being handed out again
+CLIENT_MAX_IDLE = float(config.get("hf_client_max_idle") or 300)
+# Timeout, in seconds, of each HTTP request a detection client makes
+HF_HTTP_TIMEOUT = float(config.get("hf_http_timeout") or 30)
+# Frames of one video sent to the detection Space at the same time
+FRAME_CONCURRENCY = int(config.get("frame_concurrency") or CLIENT_POOL_SIZE)
+# JPEG quality (0-100) used when encoding extracted frames
+FRAME_JPEG_QUALITY = int(config.get("frame_jpeg_quality") or 90)
+# gradio_client can only upload from a path, so in-memory buffers are
+# spooled here (tmpfs where available) just for the duration of the call
+SPOOL_DIR = config.get("spool_dir") or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+# Drop video frames without a face (OpenCV Haar cascade) before any remote call
+LOCAL_FACE_FILTER = (config.get("local_face_filter") or "1").lower() not in ("0", "false", "no")
+# Smallest face, in pixels of the downscaled detection image, that counts
+FACE_MIN_SIZE = int(config.get("face_min_size") or 24)
+# How extract_frames reads frames: "seek", "sequential", "keyframe" or "auto"
+FRAME_SAMPLER = config.get("frame_sampler") or "auto"
+# In "auto" mode, videos with more frames than this use the keyframe sampler
+KEYFRAME_MIN_FRAMES = int(config.get("keyframe_min_frames") or 9000)
+# Keyframe sampler gives up waiting for a keyframe after this many frames
+MAX_KEYFRAME_GAP = int(config.get("max_keyframe_gap") or 300)
+# GOP length assumed by the forward samplers until one has been observed
+ASSUMED_GOP = int(config.get("assumed_gop") or 250)
+# Sample video frames progressively and stop once the verdict is settled
+ADAPTIVE_SAMPLING = (config.get("adaptive_sampling") or "1").lower() not in ("0", "false", "no")
+# Frames analysed before the first stopping check, and the most ever analysed
+ADAPTIVE_MIN_FRAMES = int(config.get("adaptive_min_frames") or 3)
+ADAPTIVE_MAX_FRAMES = int(config.get("adaptive_max_frames") or 12)
+# Stopping test: z-score of the Wilson bound and minimum average confidence
+ADAPTIVE_Z = float(config.get("adaptive_z") or 1.64)
+ADAPTIVE_MIN_CONFIDENCE = float(config.get("adaptive_min_confidence") or 0.7)
+# Perceptual hash used to collapse near-identical frames: "dhash", "phash" or "off"
+FRAME_DEDUP = (config.get("frame_dedup") or "dhash").lower()
+# Frames whose 64-bit hashes differ in at most this many bits are duplicates
+FRAME_DEDUP_THRESHOLD = int(config.get("frame_dedup_threshold") or 5)
 
 # Sample output = ({'label': 'No face detected!', 
 # 'confidences': [{'label': 'No face detected!', 'confidence': 1.0}]}, None)
 
-class TimeoutError(Exception):
-    pass
+class ClientPool:
+    """Thread-safe pool of warm gradio clients for the detection Space.
 
-def timeout(seconds=30):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            result = [TimeoutError('Function call timed out')]
-            
-            def target():
+    Clients are built lazily up to `size`, handed out one per caller and
+    returned afterwards. A client that fails with a transport error is
+    dropped so the next caller gets a freshly built one. `factory` replaces
+    the gradio client, e.g. with fakes.FakeDetectionClient.
+    """
+
+    def __init__(self, src, hf_token, size=CLIENT_POOL_SIZE, max_idle=CLIENT_MAX_IDLE, factory=None):
+        self.src = src
+        self.hf_token = hf_token
+        self.size = max(1, size)
+        self.max_idle = max_idle
+        self.factory = factory
+        self._idle = queue.LifoQueue()  # (client, last_used)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        log.debug("Creating Client for %s (%s/%s)", self.src, self._created, self.size)
+        if self.factory is not None:
+            return self.factory()
+        return Client(self.src, hf_token=self.hf_token, verbose=False,
+                      httpx_kwargs={"timeout": HF_HTTP_TIMEOUT})
+
+    def _is_alive(self, client):
+        try:
+            response = httpx.get(urljoin(client.src, "config"), headers=client.headers, timeout=5)
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            log.debug("Pooled client failed health check: %s", e)
+            return False
+
+    def _discard(self, client):
+        with self._lock:
+            self._created -= 1
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def acquire(self, deadline=None):
+        """Return an idle client, building a new one while under `size`.
+
+        Waiting for a busy pool gives up once `deadline` has passed.
+        """
+        while True:
+            try:
+                client, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                if time.time() - last_used < self.max_idle or self._is_alive(client):
+                    return client
+                self._discard(client)
+                continue
+
+            with self._lock:
+                build = self._created < self.size
+                if build:
+                    self._created += 1
+            if build:
                 try:
-                    result[0] = func(*args, **kwargs)
-                except Exception as e:
-                    result[0] = e
-            
-            thread = threading.Thread(target=target)
-            thread.daemon = True
-            thread.start()
-            thread.join(seconds)
-            
-            if isinstance(result[0], Exception):
-                raise result[0]
-            return result[0]
-        return wrapper
-    return decorator
-
-def image(file):
-    print(f"[DEBUG] mlmodel.image function called with file: {file}")
+                    return self._build()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+
+            # Pool is exhausted; wait for a client to come back (or be dropped)
+            if deadline is not None:
+                deadline.check("a detection client was free")
+            try:
+                client, last_used = self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+            self._idle.put((client, last_used))
+
+    def release(self, client, healthy=True):
+        if healthy:
+            self._idle.put((client, time.time()))
+        else:
+            log.debug("Dropping broken client from pool")
+            self._discard(client)
+
+    @contextmanager
+    def client(self, deadline=None):
+        client = self.acquire(deadline)
+        healthy = True
+        try:
+            yield client
+        except (AppError, DeadlineExceeded, BackendUnavailable):
+            # The Space answered with an error, the job was cancelled or
+            # never sent; the connection itself is fine
+            raise
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.release(client, healthy)
+
+    def stats(self):
+        return {'size': self.size, 'created': self._created, 'idle': self._idle.qsize()}
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+def get_client_pool():
+    """Return the process-wide detection client pool, creating it on first use."""
+    global _client_pool
+    if _client_pool is None:
+        with _client_pool_lock:
+            if _client_pool is None:
+                _client_pool = ClientPool(HF_SPACE, config.get("hf_access_token"))
+    return _client_pool
+
+def set_client_pool(pool):
+    """Use `pool` for all detection calls, e.g. one built from fakes in benchmarks."""
+    global _client_pool
+    with _client_pool_lock:
+        _client_pool = pool
+
+def describe(file):
+    """Short description of a path or in-memory buffer for log lines."""
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return f"<{len(file)} byte buffer>"
+    return str(file)
+
+@contextmanager
+def as_path(file, suffix=".jpg"):
+    """Yield a filesystem path for a path or an in-memory encoded image.
+
+    Buffers are written to SPOOL_DIR and always removed afterwards, even if
+    the caller raises.
+    """
+    if not isinstance(file, (bytes, bytearray, memoryview)):
+        yield file
+        return
+    spool_path = os.path.join(SPOOL_DIR, f"frame_{uuid.uuid4()}{suffix}")
+    with open(spool_path, "wb") as f:
+        f.write(file)
     try:
-        print("[DEBUG] Loading environment variables")
-        config = dotenv.dotenv_values("env")
-        HF_token = config["hf_access_token"]
-        print(f"[DEBUG] HF_token retrieved: {HF_token[:5]}...")  # Print first few chars for security
-        
-        print("[DEBUG] Creating Client for deepfakedetection")
-        client = Client("dlweekproj/deepfakedetection", hf_token=HF_token)
-        
-        print("[DEBUG] Handling file for prediction")
-        handled_file = handle_file(file)
-        print(f"[DEBUG] File handled, type: {type(handled_file)}")
-        
-        print("[DEBUG] Calling predict with image")
-        result = client.predict(
-                inp=handled_file,
-                model="Self-Blended Consistency Learning",
-                api_name="/predict_image",
-        )
-        print(f"[DEBUG] Prediction result received: {result}")
+        yield spool_path
+    finally:
+        try:
+            os.remove(spool_path)
+        except OSError as e:
+            log.warning("Could not remove spooled file %s: %s", spool_path, e)
+
+def encode_frame(frame, quality=None):
+    """Encode a decoded frame as JPEG bytes."""
+    quality = FRAME_JPEG_QUALITY if quality is None else quality
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode frame as JPEG")
+    return encoded.tobytes()
+
+def predict(inp, api_name, deadline, stage="detection"):
+    """Run one prediction on the detection Space within `deadline`.
+
+    The call is submitted as a gradio job and cancelled on the Space if the
+    deadline passes first, so no thread is left waiting on it. It goes
+    through the "hf_detection" breaker and bulkhead, so it fails fast with
+    resilience.BackendUnavailable while the Space is unhealthy.
+    """
+    backend = get_backend("hf_detection")
+    with timed("hf_predict"):
+        backend.check()
+        with get_client_pool().client(deadline) as client:
+            # A spent or cancelled budget stops here, before the breaker sees a call
+            wait = deadline.timeout(before=f"{api_name} was called")
+            with backend.guard(), tracked(stage, deadline):
+                job = client.submit(inp=inp, model="Self-Blended Consistency Learning", api_name=api_name)
+                try:
+                    return job.result(timeout=wait)
+                except FutureTimeoutError:
+                    job.cancel()
+                    raise DeadlineExceeded(f"{api_name} did not finish within the request deadline")
+
+def image(file, deadline=None):
+    """Run the image model on a file path or JPEG/PNG bytes.
+
+    `deadline` (a deadline.Deadline) bounds the call; by default it gets a
+    fresh request budget.
+    """
+    log.debug("mlmodel.image function called with file: %s", describe(file))
+    deadline = deadline or Deadline()
+    try:
+        with as_path(file) as file_path:
+            log.debug("Handling file for prediction")
+            handled_file = handle_file(file_path)
+            log.debug("File handled, type: %s", type(handled_file))
+            
+            log.debug("Calling predict with image")
+            result = predict(handled_file, "/predict_image", deadline)
+        log.debug("Prediction result received: %s", result)
         return result
     except Exception as e:
-        print(f"[DEBUG] Exception in mlmodel.image: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        log.debug("Exception in mlmodel.image: %s", e, exc_info=True)
         raise  # Re-raise the exception after logging
 
-@timeout(60)  # Set a 60-second timeout for video processing
-def video(file):
-    print(f"[DEBUG] mlmodel.video function called with file: {file}")
+def video(file, deadline=None):
+    log.debug("mlmodel.video function called with file: %s", file)
+    deadline = deadline or Deadline()
     try:
-        print("[DEBUG] Loading environment variables")
-        config = dotenv.dotenv_values("env")
-        HF_token = config["hf_access_token"]
-        print(f"[DEBUG] HF_token retrieved: {HF_token[:5]}...")  # Print first few chars for security
-        
-        print("[DEBUG] Creating Client for deepfakedetection")
-        client = Client("dlweekproj/deepfakedetection", hf_token=HF_token)
-        
-        print("[DEBUG] Handling file for prediction")
+        log.debug("Handling file for prediction")
         handled_file = handle_file(file)
-        print(f"[DEBUG] File handled, type: {type(handled_file)}")
+        log.debug("File handled, type: %s", type(handled_file))
         
-        print("[DEBUG] Calling predict with video")
-        result = client.predict(
-            inp={"video":handled_file},
-            model="Self-Blended Consistency Learning",
-            api_name="/predict_video"
-        )
-        print(f"[DEBUG] Prediction result received: {result}")
+        log.debug("Calling predict with video")
+        result = predict({"video":handled_file}, "/predict_video", deadline)
+        log.debug("Prediction result received: %s", result)
         return result
     except Exception as e:
-        print(f"[DEBUG] Exception in mlmodel.video: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        log.debug("Exception in mlmodel.video: %s", e, exc_info=True)
         raise  # Re-raise the exception after logging
 
-def extract_frames(video_path, max_frames=5):
-    """Extract frames from a video file and save them as temporary images."""
-    print(f"[DEBUG] Extracting frames from video: {video_path}")
+def _read_by_seeking(video, intervals):
+    """Seek to every sampled index. Each seek decodes from the previous keyframe.
+
+    Both readers return (frame index, frame) pairs.
+    """
+    frames = []
+    for i, frame_idx in enumerate(intervals):
+        # Set the frame position
+        video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        
+        # Read the frame
+        ret, frame = video.read()
+        if not ret:
+            log.error("Could not read frame %s", frame_idx)
+            continue
+            
+        frames.append((frame_idx, frame))
+        log.debug("Extracted frame %s/%s (index %s)", i+1, len(intervals), frame_idx)
+    return frames
+
+def _read_forward(video, intervals, frame_count, keyframes_only=False, position=0):
+    """Single forward pass: grab() skipped frames, retrieve() only the kept ones.
+
+    Gaps longer than one GOP are crossed with a seek instead, since a seek
+    decodes at most one GOP while grabbing decodes the whole gap; so is a
+    target behind `position`, the index of the frame the next grab()
+    returns (0 on a freshly opened video). The GOP length is learnt from
+    the keyframe flags seen along the way. Returns the frames and the
+    position after them.
+
+    With `keyframes_only`, each sample snaps to the first keyframe at or
+    after its index, so only clean intra-coded pictures are kept. If the
+    backend flags no keyframe within MAX_KEYFRAME_GAP frames of a target,
+    the current frame is taken instead.
+    """
+    frames = []
+    targets = list(intervals)
+    gop = ASSUMED_GOP
+    learnt_gop = None
+    last_keyframe = None
+    frame_idx = position  # index of the frame the next grab() returns
+    while targets and frame_idx < frame_count:
+        target = targets[0]
+        if target < frame_idx or target - frame_idx > (learnt_gop or gop):
+            video.set(cv2.CAP_PROP_POS_FRAMES, target)
+            frame_idx = target
+            last_keyframe = None
+
+        if not video.grab():
+            log.error("Stream ended early at frame %s", frame_idx)
+            break
+        is_keyframe = video.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0
+        if is_keyframe:
+            if last_keyframe is not None:
+                learnt_gop = max(learnt_gop or 0, frame_idx - last_keyframe)
+            last_keyframe = frame_idx
+
+        if frame_idx >= target and (not keyframes_only or is_keyframe
+                                    or frame_idx - target >= MAX_KEYFRAME_GAP):
+            ret, frame = video.retrieve()
+            if ret:
+                frames.append((frame_idx, frame))
+                log.debug("Extracted frame %s/%s (index %s, keyframe=%s)", len(frames), len(intervals), frame_idx, is_keyframe)
+            else:
+                log.error("Could not read frame %s", frame_idx)
+            # Targets passed while waiting for a keyframe collapse into this one
+            targets = [t for t in targets if t > frame_idx]
+        frame_idx += 1
+    return frames, frame_idx
+
+def _read(video, intervals, frame_count, mode, position=0):
+    """Read `intervals` with the sampler `mode`; returns (index, frame) pairs and the next position."""
+    if mode == "auto":
+        mode = "keyframe" if frame_count > KEYFRAME_MIN_FRAMES else "sequential"
+    if mode == "seek":
+        frames = _read_by_seeking(video, intervals)
+        return frames, intervals[-1] + 1
+    if mode == "sequential":
+        return _read_forward(video, intervals, frame_count, position=position)
+    if mode == "keyframe":
+        return _read_forward(video, intervals, frame_count, keyframes_only=True, position=position)
+    raise ValueError(f"Unknown frame sampler: {mode}")
+
+def probe_video(video_path):
+    """Return (frame_count, fps) of a video, or (0, 0) if it cannot be opened."""
+    video = cv2.VideoCapture(video_path)
+    try:
+        if not video.isOpened():
+            return 0, 0
+        return int(video.get(cv2.CAP_PROP_FRAME_COUNT)), video.get(cv2.CAP_PROP_FPS)
+    finally:
+        video.release()
+
+def extract_frames(video_path, max_frames=5, mode=None, indices=None, with_indices=False):
+    """Decode up to `max_frames` evenly spaced frames from a video into memory.
+
+    Pass `indices` to decode exactly those frame indices instead. With
+    `with_indices` (frame index, frame) pairs are returned, since the
+    keyframe sampler may move a sample.
+
+    `mode` selects the sampler (defaults to FRAME_SAMPLER):
+      - "seek": seek to each sampled frame (the original behaviour)
+      - "sequential": one forward pass with grab()/retrieve()
+      - "keyframe": one forward pass, snapping each sample to the next keyframe
+      - "auto": "keyframe" for videos longer than KEYFRAME_MIN_FRAMES, else "sequential"
+    """
+    mode = mode or FRAME_SAMPLER
+    log.debug("Extracting frames from video: %s (mode=%s)", video_path, mode)
     try:
         # Open the video file
         video = cv2.VideoCapture(video_path)
         if not video.isOpened():
-            print(f"[ERROR] Could not open video file: {video_path}")
+            log.error("Could not open video file: %s", video_path)
             return []
             
         # Get video properties
@@ -113,150 +405,591 @@ def extract_frames(video_path, max_frames=5):
         fps = video.get(cv2.CAP_PROP_FPS)
         duration = frame_count / fps if fps > 0 else 0
         
-        print(f"[DEBUG] Video properties: frames={frame_count}, fps={fps}, duration={duration}s")
+        log.debug("Video properties: frames=%s, fps=%s, duration=%ss", frame_count, fps, duration)
         
         # Calculate frame intervals
-        if frame_count <= max_frames:
+        if indices is not None:
+            intervals = sorted(i for i in set(indices) if 0 <= i < frame_count)
+        elif frame_count <= max_frames:
             intervals = list(range(frame_count))
         else:
             intervals = [int(i * frame_count / max_frames) for i in range(max_frames)]
         
-        print(f"[DEBUG] Frame intervals: {intervals}")
-        
-        # Extract frames
-        frame_paths = []
-        temp_dir = tempfile.gettempdir()
-        
-        for i, frame_idx in enumerate(intervals):
-            # Set the frame position
-            video.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            
-            # Read the frame
-            ret, frame = video.read()
-            if not ret:
-                print(f"[ERROR] Could not read frame {frame_idx}")
-                continue
-                
-            # Save the frame as a temporary file
-            frame_path = os.path.join(temp_dir, f"frame_{uuid.uuid4()}.jpg")
-            cv2.imwrite(frame_path, frame)
-            frame_paths.append(frame_path)
-            print(f"[DEBUG] Extracted frame {i+1}/{len(intervals)}: {frame_path}")
-        
-        # Release the video
-        video.release()
+        log.debug("Frame intervals: %s", intervals)
+        if not intervals:
+            video.release()
+            return []
+
+        try:
+            frames, _ = _read(video, intervals, frame_count, mode)
+        finally:
+            # Release the video
+            video.release()
         
-        return frame_paths
+        return frames if with_indices else [frame for _, frame in frames]
     except Exception as e:
-        print(f"[ERROR] Exception in extract_frames: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        log.error("Exception in extract_frames: %s", e, exc_info=True)
         return []
 
-@timeout(120)  # Set a 120-second timeout for frame-by-frame video processing
-def video_by_frames(file, max_frames=5):
-    """Process video by extracting frames and analyzing each with the image model."""
-    print(f"[DEBUG] Processing video by frames: {file}")
+class FrameReader:
+    """One video kept open while frames are read from it in several batches.
+
+    Each `read(indices)` carries on from where the previous one stopped,
+    with the sampler `mode` (default FRAME_SAMPLER), so adaptive sampling
+    opens the video once however many batches it takes. Call `close()`
+    once no more frames are needed.
+    """
+
+    def __init__(self, video_path, mode=None):
+        self.video_path = video_path
+        self.mode = mode or FRAME_SAMPLER
+        self.video = cv2.VideoCapture(video_path)
+        if self.video.isOpened():
+            self.frame_count = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.fps = self.video.get(cv2.CAP_PROP_FPS)
+        else:
+            log.error("Could not open video file: %s", video_path)
+            self.frame_count, self.fps = 0, 0
+        self.position = 0  # index of the frame the next grab() returns
+
+    def read(self, indices):
+        """Decode the frames at `indices`, returning (frame index, frame) pairs."""
+        intervals = sorted(i for i in set(indices) if 0 <= i < self.frame_count)
+        if not intervals or not self.video.isOpened():
+            return []
+        try:
+            frames, self.position = _read(self.video, intervals, self.frame_count, self.mode, self.position)
+            return frames
+        except Exception as e:
+            log.error("Exception reading frames from %s: %s", self.video_path, e, exc_info=True)
+            # Where the capture stopped is unknown; start again from the top
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self.position = 0
+            return []
+
+    def close(self):
+        self.video.release()
+
+NO_FACE_RESULT = {'label': 'No face detected!', 'confidences': [{'label': 'No face detected!', 'confidence': 1.0}]}
+
+_cascades = threading.local()
+FACE_DETECT_WIDTH = 480
+# Haar cascades left the main OpenCV package in 5.x; without them nothing is filtered
+FACE_FILTER_AVAILABLE = hasattr(cv2, "CascadeClassifier")
+
+def _face_cascades():
+    # CascadeClassifier is not safe to share between threads
+    if not hasattr(_cascades, "classifiers"):
+        _cascades.classifiers = [
+            cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, name))
+            for name in ("haarcascade_frontalface_default.xml", "haarcascade_profileface.xml")
+        ]
+    return _cascades.classifiers
+
+def detect_faces(frame):
+    """Return face boxes (x, y, w, h) in frame coordinates, found on CPU with Haar cascades."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    scale = min(1.0, FACE_DETECT_WIDTH / gray.shape[1])
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.equalizeHist(gray)
+    for cascade in _face_cascades():
+        faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4,
+                                         minSize=(FACE_MIN_SIZE, FACE_MIN_SIZE))
+        if len(faces):
+            return [tuple(int(v / scale) for v in face) for face in faces]
+    return []
+
+def has_face(frame):
+    return len(detect_faces(frame)) > 0
+
+HASH_SIZE = 8
+_dct_matrices = {}
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II basis, so dct(x) == D @ x @ D.T
+    if n not in _dct_matrices:
+        k = np.arange(n)[:, None]
+        matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrices[n] = matrix
+    return _dct_matrices[n]
+
+def frame_hash(frame, method=None):
+    """Return a 64-bit perceptual hash of a frame as 8 packed bytes.
+
+    "dhash" compares neighbouring pixels of a 9x8 thumbnail; "phash" keeps
+    the signs of the low-frequency DCT coefficients of a 32x32 thumbnail
+    relative to their median. Both survive re-encoding and small shifts.
+    """
+    method = method or FRAME_DEDUP
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    if method == "dhash":
+        small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+        bits = small[:, 1:] > small[:, :-1]
+    elif method == "phash":
+        n = HASH_SIZE * 4
+        small = cv2.resize(gray, (n, n), interpolation=cv2.INTER_AREA).astype(np.float64)
+        dct = _dct_matrix(n)
+        coefficients = (dct @ small @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+        bits = coefficients > np.median(coefficients.flat[1:])  # skip the DC term
+    else:
+        raise ValueError(f"Unknown frame hash: {method}")
+    return np.packbits(bits.ravel())
+
+def hamming_distances(hash, hashes):
+    """Bit distances between one packed hash and an (n, 8) array of them."""
+    return np.unpackbits(np.bitwise_xor(hashes, hash), axis=-1).sum(axis=-1)
+
+def coarse_to_fine(count):
+    """Return `count` timeline positions in [0, 1), each halving the largest gap left.
+
+    0.5, 0.25, 0.75, 0.125, 0.625, ... (the base-2 van der Corput sequence),
+    so any prefix is spread over the whole video.
+    """
+    positions = []
+    for i in range(1, count + 1):
+        position, denominator = 0.0, 1
+        while i:
+            denominator *= 2
+            i, bit = divmod(i, 2)
+            position += bit / denominator
+        positions.append(position)
+    return positions
+
+class VideoFrames:
+    """Frames sampled from one video, shared by every stage of a request.
+
+    The video is decoded at most once, on first access, and each frame is
+    JPEG-encoded once in memory so the detection and recognition stages can
+    both send the same bytes. With `face_filter` (default LOCAL_FACE_FILTER)
+    frames without a locally detected face are dropped right after decoding.
+    Call `cleanup()` (or use as a context manager) to release them when the
+    request is done.
+
+    With `adaptive` (default ADAPTIVE_SAMPLING) the first access decodes only
+    ADAPTIVE_MIN_FRAMES frames, taken coarse-to-fine across the timeline, and
+    `extend()` decodes more on demand up to ADAPTIVE_MAX_FRAMES. The video
+    is opened once (a FrameReader) and stays open between batches until the
+    budget is spent, `settle()` says no more are needed, or `cleanup()`.
+
+    `encoder` turns a kept frame into the bytes sent to remote stages
+    (default: `encode_frame` at `quality`).
+
+    Unless `dedup` (default FRAME_DEDUP) is "off", a frame whose perceptual
+    hash is within FRAME_DEDUP_THRESHOLD bits of a kept frame is not kept;
+    it adds one to that frame's entry in `weights` instead.
+
+    `indices` holds the position in the video of each kept frame, and
+    `frame_count`, `fps` and `duration` describe the whole video.
+    """
+
+    def __init__(self, video_path, max_frames=5, quality=None, face_filter=None, adaptive=None, dedup=None, encoder=None):
+        self.video_path = video_path
+        self.max_frames = max_frames
+        self.quality = quality
+        self.encoder = encoder or (lambda frame: encode_frame(frame, self.quality))
+        self.face_filter = (LOCAL_FACE_FILTER if face_filter is None else face_filter) and FACE_FILTER_AVAILABLE
+        self.adaptive = ADAPTIVE_SAMPLING if adaptive is None else adaptive
+        self.dedup = dedup or FRAME_DEDUP
+        self.extracted = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.frame_count = 0
+        self.fps = 0
+        self._frames = None
+        self._indices = []
+        self._buffers = []
+        self._weights = []
+        self._hashes = np.empty((0, HASH_SIZE * HASH_SIZE // 8), dtype=np.uint8)
+        self._pending = None  # frame indices the adaptive sampler has yet to decode
+        self._reader = None  # the open video while adaptive sampling goes on
+        self._lock = threading.Lock()
+
+    def _load(self, indices):
+        # Caller holds self._lock
+        with timed("extract_frames"):
+            samples = self._reader.read(indices)
+        self.extracted += len(samples)
+        if self.face_filter:
+            kept = [(index, frame) for index, frame in samples if has_face(frame)]
+            self.dropped += len(samples) - len(kept)
+            log.debug("Local face filter kept %s/%s frames", len(kept), len(samples))
+            samples = kept
+        weights = [1] * len(samples)
+        if self.dedup != "off":
+            samples, weights = self._deduplicate(samples)
+        buffers = [self.encoder(frame) for _, frame in samples]
+        self._indices.extend(index for index, _ in samples)
+        self._frames.extend(frame for _, frame in samples)
+        self._buffers.extend(buffers)
+        self._weights.extend(weights)
+        return buffers
+
+    def _deduplicate(self, samples):
+        # Caller holds self._lock; returns the new unique (index, frame) pairs
+        # and their weights, and bumps the weights of earlier frames they duplicate
+        unique = []
+        for sample in samples:
+            hash = frame_hash(sample[1], self.dedup)
+            distances = hamming_distances(hash, self._hashes)
+            if len(distances) and distances.min() <= FRAME_DEDUP_THRESHOLD:
+                match = int(distances.argmin())
+                if match < len(self._weights):
+                    self._weights[match] += 1
+                else:  # duplicate of a frame from this same batch
+                    unique[match - len(self._weights)][1] += 1
+                self.duplicates += 1
+                continue
+            self._hashes = np.vstack([self._hashes, hash])
+            unique.append([sample, 1])
+        if self.duplicates:
+            log.debug("Frame dedup kept %s/%s frames (%s duplicates so far)", len(unique), len(samples), self.duplicates)
+        return [sample for sample, _ in unique], [weight for _, weight in unique]
+
+    def _load_next(self, count):
+        # Caller holds self._lock
+        batch, self._pending = self._pending[:count], self._pending[count:]
+        buffers = self._load(batch) if batch else []
+        if not self._pending:
+            self._close_reader()
+        return buffers
+
+    def _close_reader(self):
+        # Caller holds self._lock
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def _open(self):
+        # Caller holds self._lock; the video is opened once, before the first batch
+        if self._reader is None and self._frames is None:
+            self._reader = FrameReader(self.video_path)
+            self.frame_count, self.fps = self._reader.frame_count, self._reader.fps
+
+    def _ensure_loaded(self):
+        # Caller holds self._lock
+        if self._frames is not None:
+            return
+        self._open()
+        self._frames = []
+        if not self.adaptive:
+            count = self.frame_count
+            if count <= self.max_frames:
+                self._pending = list(range(count))
+            else:
+                self._pending = [int(i * count / self.max_frames) for i in range(self.max_frames)]
+            self._load_next(len(self._pending))
+            return
+        indices = []
+        for position in coarse_to_fine(ADAPTIVE_MAX_FRAMES):
+            index = int(position * self.frame_count)
+            if index not in indices:
+                indices.append(index)
+        self._pending = indices
+        # Keep going until a frame with a face turns up, so a face-less
+        # opening does not end the analysis on its own
+        while not self._load_next(ADAPTIVE_MIN_FRAMES) and self._pending:
+            pass
+
+    @property
+    def frames(self):
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._frames)
+
+    @property
+    def indices(self):
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._indices)
+
+    @property
+    def duration(self):
+        """Length of the video in seconds (0 if unknown), from the container without decoding."""
+        with self._lock:
+            self._open()
+            return self.frame_count / self.fps if self.fps > 0 else 0
+
+    @property
+    def exhausted(self):
+        """True when no further frames can be sampled."""
+        with self._lock:
+            self._ensure_loaded()
+            return not self._pending
+
+    def extend(self, count):
+        """Decode up to `count` more frames and return the new JPEG buffers.
+
+        Returns an empty list once the adaptive budget is spent (or straight
+        away when not sampling adaptively). Frames dropped by the face filter
+        are replaced from the remaining budget.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            buffers = []
+            while len(buffers) < count and self._pending:
+                buffers.extend(self._load_next(count - len(buffers)))
+            return buffers
+
+    def settle(self):
+        """No further frames will be sampled: close the video now rather than at cleanup()."""
+        with self._lock:
+            if self._frames is not None:
+                self._pending = []
+            self._close_reader()
+
+    @property
+    def weights(self):
+        """How many sampled frames each kept frame stands for."""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._weights)
+
+    @property
+    def faceless(self):
+        """True when frames were decoded but none of them shows a face."""
+        return not self.frames and self.extracted > 0
+
+    @property
+    def buffers(self):
+        """The frames decoded so far as encoded JPEG bytes."""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._buffers)
+
+    def cleanup(self):
+        with self._lock:
+            self._close_reader()
+            self._frames = []
+            self._indices = []
+            self._buffers = []
+            self._weights = []
+            self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+def _predict_frame(frame, index, total, deadline):
+    """Run the image model on one frame, returning the exception on failure."""
+    try:
+        log.debug("Processing frame %s/%s", index+1, total)
+        return image(frame, deadline)
+    except Exception as e:
+        log.error("Error processing frame %s: %s", index+1, e)
+        return e
+
+def video_by_frames(file, max_frames=5, frames=None, concurrency=None, deadline=None):
+    """Process video by extracting frames and analyzing each with the image model.
+
+    Pass a `VideoFrames` instance to reuse frames already extracted for the
+    current request; otherwise the video is decoded here. Up to
+    `concurrency` frames (default FRAME_CONCURRENCY) are analysed at once
+    and results are combined in frame order.
+
+    When the frames are sampled adaptively, batches of `concurrency` more
+    frames are analysed until the running tally settles (see
+    `FrameTally.settled`) or the frame budget is spent.
+
+    No new batch is started once `deadline` has passed; frames analysed by
+    then still make up the verdict. If the detection backend refused every
+    frame, its resilience.BackendUnavailable is raised.
+    """
+    log.debug("Processing video by frames: %s", file)
+    deadline = deadline or Deadline()
+    owns_frames = frames is None
+    if owns_frames:
+        frames = VideoFrames(file, max_frames)
     try:
-        # Extract frames from the video
-        frame_paths = extract_frames(file, max_frames)
-        if not frame_paths:
-            print("[ERROR] No frames could be extracted from the video")
+        buffers = frames.buffers
+        if frames.faceless:
+            log.debug("No frame passed the local face filter; skipping remote detection")
+            return dict(NO_FACE_RESULT)
+        if not buffers:
+            log.error("No frames could be extracted from the video")
             return {'label': 'Error: No frames could be extracted', 'confidences': []}
         
-        # Process each frame with the image model
+        # Process the frames with the image model, keeping frame order
+        workers = max(1, concurrency or FRAME_CONCURRENCY)
         results = []
-        for i, frame_path in enumerate(frame_paths):
-            try:
-                print(f"[DEBUG] Processing frame {i+1}/{len(frame_paths)}")
-                frame_result = image(frame_path)
-                results.append(frame_result)
-                
-                # Clean up temporary file
-                try:
-                    os.remove(frame_path)
-                except Exception as e:
-                    print(f"[WARNING] Could not remove temporary file {frame_path}: {str(e)}")
-            except Exception as e:
-                print(f"[ERROR] Error processing frame {i+1}: {str(e)}")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while buffers:
+                start, total = len(results), len(results) + len(buffers)
+                # One copy of the caller's context per frame keeps its metric labels
+                contexts = [contextvars.copy_context() for _ in buffers]
+                batch = list(executor.map(contextvars.Context.run, contexts, [_predict_frame] * len(buffers),
+                                          buffers, range(start, total),
+                                          [total] * len(buffers), [deadline] * len(buffers)))
+                results.extend(batch)
+                if any(isinstance(result, BackendUnavailable) for result in batch):
+                    log.debug("Detection backend unavailable; not sampling further frames")
+                    break
+                # Later duplicates may have added weight to analysed frames
+                tally = FrameTally.of(results, frames.weights)
+                if not frames.adaptive or tally.settled() or deadline.expired:
+                    break
+                buffers = frames.extend(workers)
+        if frames.adaptive:
+            frames.settle()
+            log.debug("Adaptive sampling stopped after %s analysed frames", len(results))
+        
+        unavailable = [result for result in results if isinstance(result, BackendUnavailable)]
+        if unavailable and not any(isinstance(result, tuple) for result in results):
+            raise unavailable[0]
         
         # Analyze the results
-        return combine_frame_results(results)
+        return combine_frame_results(results, frames.weights)
+    except BackendUnavailable:
+        raise
     except Exception as e:
-        print(f"[ERROR] Exception in video_by_frames: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        log.error("Exception in video_by_frames: %s", e, exc_info=True)
         return {'label': f'Error: {str(e)}', 'confidences': []}
+    finally:
+        if owns_frames:
+            frames.cleanup()
+
+def _label_confidence(result, name):
+    for conf in result[0].get('confidences', []):
+        if name in str(conf.get('label', '')).lower():
+            return conf.get('confidence', 0)
+    return 0
+
+class FrameTally:
+    """Running fake/real vote over per-frame predictions.
+
+    Frames whose prediction failed are added as exceptions; they are
+    counted but take no part in the verdict, and `refused` counts those
+    the detection backend turned away (resilience.BackendUnavailable). A
+    frame added with `weight` n counts as n frames, e.g. when it stands
+    for n - 1 near-duplicates.
+    """
 
-def combine_frame_results(results):
-    """Combine results from multiple frames with a weighted approach."""
-    print(f"[DEBUG] Combining results from {len(results)} frames")
-    
-    if not results:
-        return {'label': 'Error: No results to combine', 'confidences': []}
-    
-    # Filter out frames with no face detected
-    valid_results = []
-    for result in results:
-        if isinstance(result, tuple) and len(result) > 0 and isinstance(result[0], dict):
-            label = result[0].get('label', '')
-            if label != 'No face detected!':
-                valid_results.append(result)
-    
-    print(f"[DEBUG] Found {len(valid_results)} frames with faces detected")
-    
-    if not valid_results:
-        return {'label': 'No face detected in any frame', 'confidences': [{'label': 'No face detected!', 'confidence': 1.0}]}
-    
-    # Extract labels and confidences
-    fake_count = 0
-    real_count = 0
-    fake_confidence_sum = 0
-    real_confidence_sum = 0
-    
-    for result in valid_results:
+    def __init__(self):
+        self.total = 0
+        self.failed = []
+        self.refused = 0
+        self.faces = 0
+        self.fake_count = 0
+        self.real_count = 0
+        self.fake_confidence_sum = 0
+        self.real_confidence_sum = 0
+        self.analysed = 0
+
+    @classmethod
+    def of(cls, results, weights=None):
+        tally = cls()
+        for result, weight in zip(results, weights or [1] * len(results)):
+            tally.add(result, weight)
+        return tally
+
+    def add(self, result, weight=1):
+        self.total += weight
+        self.analysed += 1
+        if isinstance(result, Exception):
+            self.failed.extend([result] * weight)
+            if isinstance(result, BackendUnavailable):
+                self.refused += weight
+            return
+        # Skip frames with no face detected
+        if not (isinstance(result, tuple) and len(result) > 0 and isinstance(result[0], dict)):
+            return
         label = result[0].get('label', '')
-        confidences = result[0].get('confidences', [])
-        
+        if label == 'No face detected!':
+            return
+
+        self.faces += weight
         if 'fake' in label.lower():
-            fake_count += 1
-            # Find the fake confidence
-            for conf in confidences:
-                if 'fake' in str(conf.get('label', '')).lower():
-                    fake_confidence_sum += conf.get('confidence', 0)
-                    break
+            self.fake_count += weight
+            self.fake_confidence_sum += weight * _label_confidence(result, 'fake')
         else:
-            real_count += 1
-            # Find the real confidence
-            for conf in confidences:
-                if 'real' in str(conf.get('label', '')).lower():
-                    real_confidence_sum += conf.get('confidence', 0)
-                    break
-    
-    # Calculate weighted decision
-    if fake_count > real_count:
-        fake_avg_confidence = fake_confidence_sum / fake_count if fake_count > 0 else 0
-        label = 'Fake'
-        confidence = fake_avg_confidence
-    else:
-        real_avg_confidence = real_confidence_sum / real_count if real_count > 0 else 0
-        label = 'Real'
-        confidence = real_avg_confidence
-    
-    # Create a combined result
-    combined_result = {
-        'label': label,
-        'confidences': [
-            {'label': 'Fake', 'confidence': fake_confidence_sum / fake_count if fake_count > 0 else 0},
-            {'label': 'Real', 'confidence': real_confidence_sum / real_count if real_count > 0 else 0}
-        ],
-        'frame_analysis': {
-            'total_frames': len(results),
-            'frames_with_faces': len(valid_results),
-            'fake_frames': fake_count,
-            'real_frames': real_count
+            self.real_count += weight
+            self.real_confidence_sum += weight * _label_confidence(result, 'real')
+
+    def settled(self, min_frames=None, z=None, min_confidence=None):
+        """Whether more frames are unlikely to change the verdict.
+
+        The majority label must hold a share of the face frames whose Wilson
+        lower bound (at `z` standard deviations) is above one half, with an
+        average confidence of at least `min_confidence`, over at least
+        `min_frames` face frames. Three of three frames at the defaults pass.
+        """
+        min_frames = ADAPTIVE_MIN_FRAMES if min_frames is None else min_frames
+        z = ADAPTIVE_Z if z is None else z
+        min_confidence = ADAPTIVE_MIN_CONFIDENCE if min_confidence is None else min_confidence
+
+        n = self.fake_count + self.real_count
+        if n < max(1, min_frames):
+            return False
+        if self.fake_count > self.real_count:
+            majority, confidence_sum = self.fake_count, self.fake_confidence_sum
+        else:
+            majority, confidence_sum = self.real_count, self.real_confidence_sum
+        if confidence_sum / majority < min_confidence:
+            return False
+        p = majority / n
+        spread = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        lower = (p + z * z / (2 * n) - spread) / (1 + z * z / n)
+        return lower > 0.5
+
+    def result(self):
+        """The combined verdict in the shape returned by video_by_frames."""
+        if not self.total:
+            return {'label': 'Error: No results to combine', 'confidences': []}
+        if len(self.failed) == self.total:
+            return {'label': f'Error: All {self.total} frames failed: {str(self.failed[0])}', 'confidences': []}
+
+        log.debug("Found %s frames with faces detected", self.faces)
+        if not self.faces:
+            result = dict(NO_FACE_RESULT)
+            if self.failed:
+                # The failed frames may have shown a face
+                result['frame_analysis'] = self.analysis()
+            return result
+
+        fake_avg_confidence = self.fake_confidence_sum / self.fake_count if self.fake_count > 0 else 0
+        real_avg_confidence = self.real_confidence_sum / self.real_count if self.real_count > 0 else 0
+        
+        # Calculate weighted decision
+        if self.fake_count > self.real_count:
+            label = 'Fake'
+            confidence = fake_avg_confidence
+        else:
+            label = 'Real'
+            confidence = real_avg_confidence
+        
+        # Create a combined result
+        combined_result = {
+            'label': label,
+            'confidences': [
+                {'label': 'Fake', 'confidence': fake_avg_confidence},
+                {'label': 'Real', 'confidence': real_avg_confidence}
+            ],
+            'frame_analysis': self.analysis()
         }
-    }
-    
-    print(f"[DEBUG] Combined result: {combined_result}")
-    return combined_result
\ No newline at end of file
+        
+        log.debug("Combined result: %s", combined_result)
+        return combined_result
+
+    def analysis(self):
+        return {
+            'total_frames': self.total,
+            'frames_with_faces': self.faces,
+            'fake_frames': self.fake_count,
+            'real_frames': self.real_count,
+            'failed_frames': len(self.failed),
+            'refused_frames': self.refused,
+            'analysed_frames': self.analysed
+        }
+
+def combine_frame_results(results, weights=None):
+    """Combine results from multiple frames with a weighted approach.
+
+    Frames whose prediction failed appear in `results` as exceptions; they
+    are counted but take no part in the verdict. `weights` gives how many
+    sampled frames each result stands for (default one each).
+    """
+    log.debug("Combining results from %s frames", len(results))
+    return FrameTally.of(results, weights).result()
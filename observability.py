@@ -0,0 +1,248 @@
+import dotenv
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import admission
+import blobstore
+import deadline
+import resilience
+from resilience import BackendUnavailable
+
+config = dotenv.dotenv_values("env")
+
+# Lowest level logged (DEBUG, INFO, WARNING, ...)
+LOG_LEVEL = (config.get("log_level") or "INFO").upper()
+# "json" for one JSON object per line, "text" for plain lines
+LOG_FORMAT = (config.get("log_format") or "json").lower()
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Media type ("image" or "video") of the request being handled, so stages
+# deep in the call stack can label their metrics without it being passed down
+media_type = contextvars.ContextVar("media_type", default="unknown")
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as one JSON object, including any `extra=` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'media_type': media_type.get(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+_configured = False
+
+def configure_logging(level=None, fmt=None):
+    """Send log records to stderr at LOG_LEVEL, in LOG_FORMAT. Safe to call twice."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    handler = logging.StreamHandler()
+    if (fmt or LOG_FORMAT) == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level or LOG_LEVEL)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Histogram:
+    """Cumulative-bucket histogram rendered in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', f'{bound:g}')])} {cumulative}")
+            cumulative += values[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return "\n".join(lines)
+
+class Gauge:
+    """Gauge whose samples are read from `collect()` each time it is rendered.
+
+    `collect` returns a list of (label values, value) pairs.
+    """
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in self.collect():
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return "\n".join(lines)
+
+STAGE_SECONDS = Histogram(
+    "dlweek_stage_duration_seconds",
+    "Time spent in each stage of an analysis.",
+    ("stage", "media_type", "outcome"),
+)
+
+ORPHANED_WORK = Gauge(
+    "dlweek_orphaned_work",
+    "Remote calls still running after their request's deadline.",
+    (),
+    lambda: [((), deadline.stats()['orphaned'])],
+)
+
+BACKEND_IN_FLIGHT = Gauge(
+    "dlweek_backend_in_flight",
+    "Calls in flight to each remote backend.",
+    ("backend",),
+    lambda: [((name,), entry['in_flight']) for name, entry in resilience.stats().items()],
+)
+
+BREAKER_OPEN = Gauge(
+    "dlweek_breaker_open",
+    "1 while a backend's circuit breaker is open or half-open.",
+    ("backend",),
+    lambda: [((name,), int(entry['state'] != "closed")) for name, entry in resilience.stats().items()],
+)
+
+ADMISSION_QUEUED = Gauge(
+    "dlweek_admission_waiting",
+    "Analyses waiting for a worker in each admission lane.",
+    ("lane",),
+    lambda: [((name,), entry['waiting']) for name, entry in admission.stats().items()],
+)
+
+def _upload_store_bytes():
+    stats = blobstore.get_store().stats()
+    samples = [(("stored",), stats['bytes']), (("referenced",), stats['referenced_bytes']), (("quota",), stats['quota'])]
+    if stats['disk_free'] is not None:
+        samples.append((("disk_free",), stats['disk_free']))
+    return samples
+
+def _upload_store_files():
+    stats = blobstore.get_store().stats()
+    return [(("stored",), stats['files']), (("referenced",), stats['referenced_files'])]
+
+UPLOAD_STORE_BYTES = Gauge(
+    "dlweek_upload_store_bytes",
+    "Bytes of stored uploads (all, and referenced by analyses in flight), their quota and free disk space.",
+    ("kind",),
+    _upload_store_bytes,
+)
+
+UPLOAD_STORE_FILES = Gauge(
+    "dlweek_upload_store_files",
+    "Stored uploads, all and referenced by analyses in flight.",
+    ("kind",),
+    _upload_store_files,
+)
+
+_metrics = [STAGE_SECONDS, ORPHANED_WORK, BACKEND_IN_FLIGHT, BREAKER_OPEN, ADMISSION_QUEUED,
+            UPLOAD_STORE_BYTES, UPLOAD_STORE_FILES]
+
+_captures = []
+
+def register(metric):
+    """Add a metric (anything with `render()`) to the /metrics output."""
+    _metrics.append(metric)
+    return metric
+
+def outcome_of(exc):
+    """Outcome label for a stage that raised `exc` (None: it succeeded)."""
+    if exc is None:
+        return "ok"
+    if isinstance(exc, TimeoutError):
+        return "timeout"
+    if isinstance(exc, BackendUnavailable):
+        return "unavailable"
+    return "error"
+
+@contextmanager
+def timed(stage, media=None):
+    """Observe how long the block takes as `stage` in STAGE_SECONDS.
+
+    The outcome label follows any exception the block raises; the block can
+    also override it by setting `outcome` on the yielded dict, e.g. when a
+    failure is returned rather than raised, and set `media_type` there once
+    it is known.
+    """
+    state = {'outcome': None, 'media_type': None}
+    start = time.monotonic()
+    try:
+        yield state
+    except BaseException as e:
+        state['outcome'] = state['outcome'] or outcome_of(e)
+        raise
+    finally:
+        labels = {'stage': stage, 'media_type': state['media_type'] or media or media_type.get(),
+                  'outcome': state['outcome'] or "ok"}
+        seconds = time.monotonic() - start
+        STAGE_SECONDS.observe(seconds, **labels)
+        for samples in _captures:
+            samples.append({**labels, 'seconds': seconds})
+
+@contextmanager
+def capture():
+    """Collect every stage timing observed while the block runs.
+
+    Yields a list that fills with {stage, media_type, outcome, seconds}
+    dicts, for benchmarks that need exact percentiles rather than buckets.
+    """
+    samples = []
+    _captures.append(samples)
+    try:
+        yield samples
+    finally:
+        _captures.remove(samples)
+
+def render():
+    """Every registered metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
@@ -0,0 +1,114 @@
+import dotenv
+import logging
+import os
+import threading
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+import mlmodel
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+# Longest edge, in pixels, of images and frames sent to remote stages
+UPLOAD_MAX_EDGE = int(config.get("upload_max_edge") or 1280)
+# JPEG quality of re-encoded uploads
+UPLOAD_JPEG_QUALITY = int(config.get("upload_jpeg_quality") or 90)
+# Stages (comma separated, e.g. "recognition") that only get the face region
+UPLOAD_FACE_CROP = {s.strip() for s in (config.get("upload_face_crop") or "").split(",") if s.strip()}
+# Margin kept around a cropped face, as a fraction of the face size
+UPLOAD_FACE_MARGIN = float(config.get("upload_face_margin") or 0.4)
+
+EXIF_ORIENTATION = 0x0112
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+def record(stage, original, sent):
+    """Count one upload of `sent` bytes that would have been `original` bytes."""
+    with _stats_lock:
+        entry = _stats.setdefault(stage, {'uploads': 0, 'original_bytes': 0, 'sent_bytes': 0})
+        entry['uploads'] += 1
+        entry['original_bytes'] += original
+        entry['sent_bytes'] += sent
+
+def stats():
+    """Per-stage upload counts and bytes saved by preprocessing."""
+    with _stats_lock:
+        return {
+            stage: {**entry, 'saved_bytes': entry['original_bytes'] - entry['sent_bytes']}
+            for stage, entry in _stats.items()
+        }
+
+def crop_to_face(frame, margin=None):
+    """Crop a frame to its largest detected face plus `margin`, or return it unchanged."""
+    margin = UPLOAD_FACE_MARGIN if margin is None else margin
+    if not mlmodel.FACE_FILTER_AVAILABLE:
+        return frame
+    faces = mlmodel.detect_faces(frame)
+    if not faces:
+        return frame
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    pad_x, pad_y = int(w * margin), int(h * margin)
+    height, width = frame.shape[:2]
+    return frame[max(0, y - pad_y):min(height, y + h + pad_y), max(0, x - pad_x):min(width, x + w + pad_x)]
+
+def shrink(frame, stage, max_edge=None):
+    """Apply the face crop configured for `stage`, then downscale to `max_edge`."""
+    max_edge = UPLOAD_MAX_EDGE if max_edge is None else max_edge
+    if stage in UPLOAD_FACE_CROP:
+        frame = crop_to_face(frame)
+    scale = max_edge / max(frame.shape[:2])
+    if scale < 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return frame
+
+def load_image(file_path):
+    """Decode an image file upright (EXIF orientation applied) as a BGR array.
+
+    Also returns whether the stored pixels needed rotating.
+    """
+    with Image.open(file_path) as img:
+        rotated = img.getexif().get(EXIF_ORIENTATION, 1) != 1
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR), rotated
+
+def prepare(file_path, stage):
+    """Return what to upload for an image file: JPEG bytes, or the path itself.
+
+    The original file is sent untouched when it is already upright, small
+    enough and not cropped for this stage; otherwise it is oriented, cropped
+    and downscaled as configured and re-encoded at UPLOAD_JPEG_QUALITY.
+    """
+    original = os.path.getsize(file_path)
+    try:
+        frame, rotated = load_image(file_path)
+    except Exception as e:
+        log.debug("Could not preprocess %s, uploading it as is: %s", file_path, e)
+        record(stage, original, original)
+        return file_path
+
+    shrunk = shrink(frame, stage)
+    if not rotated and shrunk is frame:
+        record(stage, original, original)
+        return file_path
+    data = mlmodel.encode_frame(shrunk, UPLOAD_JPEG_QUALITY)
+    if not rotated and len(data) >= original:
+        record(stage, original, original)
+        return file_path
+    log.debug("Preprocessed %s for %s: %sx%s -> %sx%s, %s -> %s bytes", file_path, stage,
+              frame.shape[1], frame.shape[0], shrunk.shape[1], shrunk.shape[0], original, len(data))
+    record(stage, original, len(data))
+    return data
+
+def prepare_frame(frame, stage):
+    """Encode a decoded video frame for `stage` as JPEG bytes.
+
+    The bytes saved are estimated against encoding the full frame, scaled
+    by the number of pixels, so the frame is only encoded once.
+    """
+    shrunk = shrink(frame, stage)
+    data = mlmodel.encode_frame(shrunk, UPLOAD_JPEG_QUALITY)
+    ratio = (frame.shape[0] * frame.shape[1]) / max(1, shrunk.shape[0] * shrunk.shape[1])
+    record(stage, int(len(data) * ratio), len(data))
+    return data
@@ -1,50 +1,194 @@
 import base64
 import json
+import random
 import requests
 import sys
+import threading
+import time
 import dotenv
+import logging
+from requests.adapters import HTTPAdapter
+from deadline import Deadline, DeadlineExceeded, tracked
+from observability import timed
+from resilience import BackendUnavailable, get_backend
 
 config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
 
+# Keep-alive connections kept open to the recognition backend
+POOL_SIZE = int(config.get("recognition_pool_size") or 8)
+CONNECT_TIMEOUT = float(config.get("recognition_connect_timeout") or 3.05)
+READ_TIMEOUT = float(config.get("recognition_read_timeout") or 20)
+# Retries for connection errors and 5xx responses, with jittered exponential
+# backoff; they stop once the request's deadline would be passed
+RETRIES = int(config.get("recognition_retries") or 3)
+BACKOFF = float(config.get("recognition_backoff") or 0.3)
+BACKOFF_JITTER = float(config.get("recognition_backoff_jitter") or 0.2)
 
-def test_api(image_path):
-    print(f"[DEBUG] recognition_api.test_api called with image_path: {image_path}")
+HEADERS = {"Content-Type": "application/json"}
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the shared, pooled session used for every recognition call (see `post` for retries)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(HEADERS)
+                _session = session
+    return _session
+
+
+def read_image(image):
+    """Return the bytes of an image given as a path or an in-memory buffer."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    with open(image, "rb") as image_file:
+        return image_file.read()
+
+class RecognitionFailed(Exception):
+    """Raised when no image could be matched because every recognition call failed."""
+
+def request_timeout(deadline):
+    """(connect, read) timeouts for one call, both capped by `deadline`."""
+    read = deadline.timeout(READ_TIMEOUT, before="calling the recognition API")
+    return min(CONNECT_TIMEOUT, read), read
+
+def backoff(retry, response=None):
+    """Seconds to wait before retry number `retry` (1, 2, ...), honouring a numeric Retry-After."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return BACKOFF * 2 ** (retry - 1) + random.uniform(0, BACKOFF_JITTER)
+
+def post(url, payload, deadline):
+    """POST `payload`, retrying connection errors and 5xx answers within `deadline`.
+
+    Each attempt's read timeout is capped by the time left, and no retry
+    is made when its backoff would end past the deadline; the last 5xx
+    response is then returned as it is. A read timeout is not retried: the
+    backend is slow, and asking again would pile on.
+    """
+    session = get_session()
+    for retry in range(RETRIES + 1):
+        try:
+            response = session.post(url, data=payload, timeout=request_timeout(deadline))
+        except requests.ConnectionError:
+            if retry == RETRIES:
+                raise
+            response = None
+        else:
+            if response.status_code not in RETRY_STATUSES or retry == RETRIES:
+                return response
+        wait = backoff(retry + 1, response)
+        if wait >= deadline.remaining():
+            if response is None:
+                raise DeadlineExceeded("Not enough time left to retry the recognition API")
+            return response
+        log.debug("Retrying the recognition API in %.2fs (%s)", wait,
+                  "connection failed" if response is None else response.status_code)
+        if response is not None:
+            response.close()
+        time.sleep(wait)
+
+def test_api(image, deadline=None):
+    """Match the face in an image (path or encoded bytes) against the database.
+
+    `deadline` caps the read timeout and the retries (default: a fresh
+    request budget).
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        log.debug("recognition_api.test_api called with <%s byte buffer>", len(image))
+    else:
+        log.debug("recognition_api.test_api called with image_path: %s", image)
+    deadline = deadline or Deadline()
     try:
-        print("[DEBUG] Loading API URL from config")
+        log.debug("Loading API URL from config")
         API_URL = config["test_api_url"]
-        print(f"[DEBUG] API URL: {API_URL}")
+        log.debug("API URL: %s", API_URL)
 
         # Read and encode the image to base64
-        print(f"[DEBUG] Reading and encoding image file: {image_path}")
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        print(f"[DEBUG] Image encoded, length: {len(encoded_string)}")
+        log.debug("Encoding image")
+        encoded_string = base64.b64encode(read_image(image)).decode('utf-8')
+        log.debug("Image encoded, length: %s", len(encoded_string))
         
         # Create payload
-        print("[DEBUG] Creating payload")
+        log.debug("Creating payload")
         payload = json.dumps({"image": encoded_string})
-        headers = {"Content-Type": "application/json"}
         
         # Send POST request
-        print("[DEBUG] Sending POST request to API")
-        response = requests.post(API_URL, headers=headers, data=payload)
-        print(f"[DEBUG] Response received, status code: {response.status_code}")
+        log.debug("Sending POST request to API")
+        # A spent or cancelled budget stops here, before the breaker sees a call
+        deadline.check("calling the recognition API")
+        with timed("recognition"), get_backend("recognition").guard(), tracked("recognition", deadline):
+            response = post(API_URL, payload, deadline)
+            if response.status_code >= 500:
+                raise requests.HTTPError(f"Recognition API returned {response.status_code}", response=response)
+        log.debug("Response received, status code: %s", response.status_code)
         
         res = response.json()
-        print(f"[DEBUG] Response JSON: {res}")
-        try:
-            result = response.status_code, res["UserMatches"][0]["Similarity"], res["UserMatches"][0]["User"]["UserId"]
-            print(f"[DEBUG] Extracted result: {result}")
-        except IndexError:
-            print("[DEBUG] IndexError: No user matches found")
-            result = 404, 0, "unidentified"
-        return result
+        log.debug("Response JSON: %s", res)
+        return parse_match(response.status_code, res)
     except Exception as e:
-        print(f"[DEBUG] Exception in recognition_api.test_api: {str(e)}")
-        import traceback
-        print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+        log.debug("Exception in recognition_api.test_api: %s", e, exc_info=True)
         raise  # Re-raise the exception after logging
 
+def parse_match(status_code, res):
+    """Turn one recognition response into (resp_code, accuracy, name)."""
+    try:
+        result = status_code, res["UserMatches"][0]["Similarity"], res["UserMatches"][0]["User"]["UserId"]
+        log.debug("Extracted result: %s", result)
+    except IndexError:
+        log.debug("IndexError: No user matches found")
+        result = 404, 0, "unidentified"
+    return result
+
+def test_api_batch(images, deadline=None):
+    """Match several images, returning one (resp_code, accuracy, name) per image.
+
+    When `test_api_batch_url` is configured all images go in one request,
+    as {"images": [base64, ...]} answered by {"results": [response, ...]}.
+    Otherwise, or if the batch call fails, each image is sent on its own.
+    A per-image failure is returned as the exception instead of a tuple;
+    resilience.BackendUnavailable is raised when the backend is shedding load.
+    """
+    deadline = deadline or Deadline()
+    images = list(images)
+    batch_url = config.get("test_api_batch_url")
+    if batch_url and len(images) > 1:
+        log.debug("Sending batch of %s images to %s", len(images), batch_url)
+        try:
+            payload = json.dumps({"images": [base64.b64encode(read_image(image)).decode('utf-8') for image in images]})
+            deadline.check("calling the recognition API")  # before the breaker sees a call
+            with timed("recognition"), get_backend("recognition").guard(), tracked("recognition", deadline):
+                response = post(batch_url, payload, deadline)
+                response.raise_for_status()
+            results = response.json()["results"]
+            if len(results) != len(images):
+                raise ValueError(f"Expected {len(images)} results, got {len(results)}")
+            return [parse_match(response.status_code, res) for res in results]
+        except BackendUnavailable:
+            raise
+        except Exception as e:
+            log.debug("Batch recognition failed, falling back to single calls: %s", e)
+
+    results = []
+    for image in images:
+        try:
+            results.append(test_api(image, deadline))
+        except BackendUnavailable:
+            raise
+        except Exception as e:
+            results.append(e)
+    return results
+
 if __name__ == "__main__":
     if len(sys.argv) != 2:
         print("Usage: python recognition-api.py <image_path>")
@@ -0,0 +1,263 @@
+import dotenv
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from deadline import DeadlineExceeded
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+# Breakers judge the last BREAKER_WINDOW calls once at least BREAKER_MIN_CALLS
+# have been made, and open when either rate reaches its threshold
+BREAKER_WINDOW = int(config.get("breaker_window") or 20)
+BREAKER_MIN_CALLS = int(config.get("breaker_min_calls") or 5)
+BREAKER_FAILURE_RATE = float(config.get("breaker_failure_rate") or 0.5)
+BREAKER_SLOW_RATE = float(config.get("breaker_slow_rate") or 0.8)
+# An open breaker rejects calls for this many seconds, then lets a few
+# trial calls through to decide whether to close again
+BREAKER_COOLDOWN = float(config.get("breaker_cooldown") or 30)
+BREAKER_TRIAL_CALLS = int(config.get("breaker_trial_calls") or 2)
+# Seconds a call may wait for a bulkhead slot before failing fast
+BULKHEAD_WAIT = float(config.get("bulkhead_wait") or 0)
+
+# Per backend: calls slower than this (seconds) count as slow, at most
+# this many calls may be in flight at once, and calls are started at no
+# more than `rate_limit` per second (0: unlimited)
+BACKENDS = {
+    "hf_detection": {
+        "slow_call": float(config.get("hf_detection_slow_call") or 20),
+        "max_concurrency": int(config.get("hf_detection_max_concurrency") or 16),
+        "rate_limit": float(config.get("hf_detection_rate_limit") or 0),
+    },
+    "recognition": {
+        "slow_call": float(config.get("recognition_slow_call") or 5),
+        "max_concurrency": int(config.get("recognition_max_concurrency") or 16),
+        "rate_limit": float(config.get("recognition_rate_limit") or 0),
+    },
+    "gemini": {
+        "slow_call": float(config.get("gemini_slow_call") or 60),
+        "max_concurrency": int(config.get("gemini_max_concurrency") or 8),
+        "rate_limit": float(config.get("gemini_rate_limit") or 0),
+    },
+}
+
+class BackendUnavailable(Exception):
+    """Raised without calling a backend whose breaker is open or bulkhead is full."""
+
+    def __init__(self, backend, reason):
+        super().__init__(f"{backend} is unavailable: {reason}")
+        self.backend = backend
+        self.reason = reason
+
+class CircuitBreaker:
+    """Failure- and latency-rate circuit breaker over a window of recent calls.
+
+    Closed: calls pass and their outcomes are recorded. Open: calls are
+    rejected until `cooldown` has passed. Half-open: up to `trial_calls`
+    calls pass; the breaker closes if they all succeed, or opens again on
+    the first failure.
+    """
+
+    def __init__(self, name, slow_call, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, slow_rate=BREAKER_SLOW_RATE,
+                 cooldown=BREAKER_COOLDOWN, trial_calls=BREAKER_TRIAL_CALLS):
+        self.name = name
+        self.slow_call = slow_call
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.trial_calls = trial_calls
+        self.state = "closed"
+        self.opened_at = None
+        self._outcomes = deque(maxlen=window)  # (failed, slow)
+        self._trials = 0
+        self._trial_successes = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        log.warning("Circuit breaker for %s opened", self.name)
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def allow(self):
+        """Whether a call may go ahead now; counts it as a trial when half-open."""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = "half_open"
+                self._trials = 0
+                self._trial_successes = 0
+            if self.state == "half_open":
+                if self._trials >= self.trial_calls:
+                    return False
+                self._trials += 1
+            return True
+
+    def record(self, failed, duration):
+        slow = duration >= self.slow_call
+        with self._lock:
+            if self.state == "half_open":
+                if failed or slow:
+                    self._open()
+                else:
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.trial_calls:
+                        log.debug("Circuit breaker for %s closed", self.name)
+                        self.state = "closed"
+                return
+            if self.state == "open":
+                return
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            slow_calls = sum(1 for _, slow in self._outcomes if slow)
+            if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_rate:
+                self._open()
+
+    def skip(self):
+        """Leave a call that was let through unrecorded, giving back its trial when half-open."""
+        with self._lock:
+            if self.state == "half_open" and self._trials > 0:
+                self._trials -= 1
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'failure_rate': sum(1 for failed, _ in self._outcomes if failed) / calls if calls else 0,
+                'slow_rate': sum(1 for _, slow in self._outcomes if slow) / calls if calls else 0,
+            }
+
+class RateLimiter:
+    """Token bucket letting calls start at `rate` per second, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.waited = 0.0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until it is due; returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class Backend:
+    """A remote dependency guarded by a circuit breaker, a bulkhead and an optional rate limit."""
+
+    def __init__(self, name, slow_call, max_concurrency, rate_limit=0, wait=BULKHEAD_WAIT):
+        self.name = name
+        self.breaker = CircuitBreaker(name, slow_call)
+        self.max_concurrency = max_concurrency
+        self.limiter = None
+        if rate_limit:
+            self.limit(rate_limit)
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        """False while the breaker is open; a cheap check before optional work."""
+        return self.breaker.state != "open" or time.monotonic() - self.breaker.opened_at >= self.breaker.cooldown
+
+    def check(self):
+        """Raise BackendUnavailable now if the breaker is open, e.g. before queueing for a client."""
+        if not self.available:
+            self._reject("circuit breaker is open")
+
+    def limit(self, rate, burst=None):
+        """Start at most `rate` calls per second from now on (0 or None: unlimited)."""
+        self.limiter = RateLimiter(rate, burst) if rate else None
+
+    def _reject(self, reason):
+        with self._lock:
+            self._rejected += 1
+        raise BackendUnavailable(self.name, reason)
+
+    @contextmanager
+    def guard(self):
+        """Run the block as one call to this backend.
+
+        Raises BackendUnavailable straight away if the breaker is open or
+        no bulkhead slot frees up within `wait` seconds; otherwise the
+        block's outcome and duration are recorded. A rate-limited call
+        waits for its turn first, without holding a bulkhead slot.
+
+        DeadlineExceeded (the request's budget ran out or was cancelled)
+        is not held against the backend: such a call only counts, as a
+        slow one, if it had already taken `slow_call` seconds.
+        """
+        limiter = self.limiter
+        if limiter is not None and self.available:
+            limiter.acquire()
+        acquired = self._slots.acquire(timeout=self.wait) if self.wait > 0 else self._slots.acquire(blocking=False)
+        if not acquired:
+            self._reject(f"{self.max_concurrency} calls already in flight")
+        try:
+            if not self.breaker.allow():
+                self._reject("circuit breaker is open")
+            with self._lock:
+                self._in_flight += 1
+            start = time.monotonic()
+            failed = True
+            try:
+                yield
+                failed = False
+            except DeadlineExceeded:
+                failed = None
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                duration = time.monotonic() - start
+                if failed is not None:
+                    self.breaker.record(failed, duration)
+                elif duration >= self.breaker.slow_call:
+                    self.breaker.record(False, duration)
+                else:
+                    self.breaker.skip()
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            in_flight, rejected = self._in_flight, self._rejected
+        limiter = self.limiter
+        return {**self.breaker.stats(), 'in_flight': in_flight,
+                'max_concurrency': self.max_concurrency, 'rejected': rejected,
+                'rate_limit': limiter.rate if limiter else None,
+                'rate_limited_seconds': limiter.waited if limiter else 0.0}
+
+_backends = {name: Backend(name, **settings) for name, settings in BACKENDS.items()}
+
+def get_backend(name):
+    return _backends[name]
+
+def stats():
+    return {name: backend.stats() for name, backend in _backends.items()}
+
+def degraded():
+    """Names of backends whose breaker is not closed."""
+    return [name for name, backend in _backends.items() if backend.breaker.state != "closed"]
@@ -0,0 +1,80 @@
+import dotenv
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+# Threads shared by the speculative stages of all in-flight requests
+STAGE_WORKERS = int(config.get("stage_workers") or 16)
+
+_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+
+class StageScheduler:
+    """Runs the independent stages of one request alongside detection.
+
+    Stages are started by name as soon as their inputs exist, joined when
+    their result is needed and cancelled when the verdict makes them moot.
+    A running stage cannot be interrupted, so cancelling one registers a
+    `discard` callback that releases its result once it finishes.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._joined = set()
+        self._lock = threading.Lock()
+
+    def start(self, name, fn, *args, **kwargs):
+        log.debug("Starting stage: %s", name)
+        # Run in a copy of the caller's context so stages keep its metric labels
+        future = _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        with self._lock:
+            self._futures[name] = future
+        return future
+
+    def started(self, name):
+        return name in self._futures and name not in self._joined
+
+    def join(self, name, timeout=None):
+        """Wait for a stage and return its result (re-raising its exception).
+
+        A joined stage belongs to the caller and is no longer cancelled.
+        """
+        log.debug("Joining stage: %s", name)
+        with self._lock:
+            self._joined.add(name)
+            future = self._futures[name]
+        return future.result(timeout=timeout)
+
+    def cancel(self, name, discard=None):
+        with self._lock:
+            future = None if name in self._joined else self._futures.get(name)
+        if future is None or future.cancel():
+            return
+        log.debug("Stage %s already running; its result will be discarded", name)
+        if discard is not None:
+            def release(done):
+                if not done.cancelled() and done.exception() is None:
+                    discard(done.result())
+            future.add_done_callback(release)
+
+    def when_idle(self, callback):
+        """Run `callback` once every started stage has finished."""
+        with self._lock:
+            pending = [future for future in self._futures.values() if not future.done()]
+        if not pending:
+            callback()
+            return
+
+        remaining = [len(pending)]
+        lock = threading.Lock()
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                callback()
+        for future in pending:
+            future.add_done_callback(on_done)
@@ -0,0 +1,215 @@
+import dotenv
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+config = dotenv.dotenv_values("env")
+log = logging.getLogger(__name__)
+
+# Directory of the lock and result files that coalesce identical work
+# across processes (e.g. gunicorn workers); "off" coalesces within a
+# process only
+SINGLEFLIGHT_DIR = config.get("singleflight_dir") or os.path.join(tempfile.gettempdir(), "dlweek-singleflight")
+# Seconds a finished result stays available to other processes that were
+# waiting for it
+SINGLEFLIGHT_RESULT_TTL = float(config.get("singleflight_result_ttl") or 60)
+# Seconds between attempts to take a lock held by another process
+LOCK_POLL = 0.1
+# Old result files are swept after this many calls have written one
+SWEEP_EVERY = 100
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.remote = False  # waiting for another process to finish the same key
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its result.
+
+    Threads asking for a key that is already running wait for that call and
+    get its result (or exception) instead of running it again. Across
+    processes, the call holds an fcntl lock on a per-key file in `lock_dir`;
+    a process that had to wait for the lock reads the result the holder
+    left behind instead of running the call itself. Results must be JSON
+    serialisable to be shared across processes.
+    """
+
+    def __init__(self, lock_dir=SINGLEFLIGHT_DIR, result_ttl=SINGLEFLIGHT_RESULT_TTL):
+        self.lock_dir = None if lock_dir == "off" else lock_dir
+        self.result_ttl = result_ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'shared': 0, 'shared_across_processes': 0}
+        self._writes = 0
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key, fn, timeout=None, on_join=None):
+        """Return (fn(), shared) for `key`, sharing any call already in flight.
+
+        `shared` is True when the result came from another caller's call.
+        `on_join()` is called as soon as this call joins one in flight in
+        this process, before waiting for it. Waiting gives up with
+        TimeoutError after `timeout` seconds.
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            try:
+                if on_join is not None:
+                    on_join()
+                if not call.done.wait(timeout):
+                    raise TimeoutError(f"Gave up waiting for the call in flight for {key[:12]}")
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+            with self._lock:
+                self._stats['shared'] += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_exclusive(key, fn, call, timeout)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _paths(self, key):
+        return os.path.join(self.lock_dir, f"{key}.lock"), os.path.join(self.lock_dir, f"{key}.json")
+
+    def _run_exclusive(self, key, fn, call, timeout):
+        if not self.lock_dir:
+            return fn(), False
+        lock_path, result_path = self._paths(key)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            give_up = None if timeout is None else time.monotonic() + timeout
+            waited = False
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if not waited:
+                        log.debug("Waiting for another process analysing %s", key[:12])
+                        waited = call.remote = True
+                    if give_up is not None and time.monotonic() >= give_up:
+                        raise TimeoutError(f"Gave up waiting for another process working on {key[:12]}")
+                    time.sleep(LOCK_POLL)
+            try:
+                if waited:
+                    found, result = self._read_result(result_path)
+                    if found:
+                        with self._lock:
+                            self._stats['shared_across_processes'] += 1
+                        return result, True
+                result = fn()
+                self._write_result(result_path, result)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % SWEEP_EVERY == 0
+        if sweep:
+            self.sweep()
+        return result, False
+
+    def _read_result(self, result_path):
+        try:
+            with open(result_path) as result_file:
+                entry = json.load(result_file)
+        except (OSError, ValueError):
+            return False, None
+        if time.time() - entry['created'] > self.result_ttl:
+            return False, None
+        return True, entry['result']
+
+    def _write_result(self, result_path, result):
+        try:
+            data = json.dumps({'created': time.time(), 'result': result})
+        except (TypeError, ValueError):
+            return  # not shareable across processes; waiters run the call themselves
+        tmp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w") as result_file:
+            result_file.write(data)
+        os.replace(tmp_path, result_path)
+
+    def sweep(self):
+        """Delete result files (and their idle lock files) older than the result TTL."""
+        if not self.lock_dir:
+            return 0
+        removed = 0
+        cutoff = time.time() - self.result_ttl
+        for name in os.listdir(self.lock_dir):
+            if not name.endswith(".json"):
+                continue
+            result_path = os.path.join(self.lock_dir, name)
+            lock_path = result_path[:-len(".json")] + ".lock"
+            try:
+                if os.path.getmtime(result_path) >= cutoff:
+                    continue
+                fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(result_path)
+                    os.remove(lock_path)
+                    removed += 1
+                except BlockingIOError:
+                    continue  # in use again
+                finally:
+                    os.close(fd)
+            except OSError:
+                continue
+        return removed
+
+    def in_flight(self, key):
+        """Whether a call for `key` is running in this process."""
+        with self._lock:
+            return key in self._calls
+
+    def waiters(self):
+        """Callers waiting on each key in flight in this process."""
+        with self._lock:
+            return {key: call.waiters for key, call in self._calls.items()}
+
+    def stats(self):
+        with self._lock:
+            in_flight = {
+                key[:12]: {'waiters': call.waiters, 'waiting_on_other_process': call.remote}
+                for key, call in self._calls.items()
+            }
+            return {**self._stats, 'in_flight': in_flight}
+
+_group = None
+_group_lock = threading.Lock()
+
+def get_group():
+    """Return the process-wide SingleFlight, creating it on first use."""
+    global _group
+    if _group is None:
+        with _group_lock:
+            if _group is None:
+                _group = SingleFlight()
+    return _group
@@ -0,0 +1,84 @@
+import io
+import threading
+import time
+import pytest
+import admission
+import app
+import blobstore
+from admission import Lane, Overloaded
+from deadline import Deadline, DeadlineExceeded
+
+JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01" + b"\x00" * 64
+
+def occupied(lane):
+    """Enter a slot on one of `lane`'s workers; returns the context to exit."""
+    running = lane.slot(lane.reserve())
+    running.__enter__()
+    return running
+
+def test_full_queue_is_turned_away():
+    lane = Lane("video", workers=1, queue_size=1, service_time=10)
+    running = occupied(lane)
+    waiting = lane.reserve()
+    with pytest.raises(Overloaded) as rejected:
+        lane.reserve()
+    assert rejected.value.queued == 1
+    assert rejected.value.retry_after == 15  # one and a half analyses ahead
+    assert lane.stats()['rejected'] == 1
+
+    waiting.release()
+    lane.reserve().release()
+    running.__exit__(None, None, None)
+    assert lane.stats()['running'] == lane.stats()['waiting'] == 0
+
+def test_request_that_would_miss_its_deadline_is_turned_away():
+    lane = Lane("video", workers=1, queue_size=4, service_time=60)
+    running = occupied(lane)
+    with pytest.raises(Overloaded):
+        lane.reserve(Deadline(30))
+    lane.reserve(Deadline(120)).release()
+    running.__exit__(None, None, None)
+
+def test_waiting_for_a_worker_stops_at_the_deadline():
+    lane = Lane("image", workers=1, queue_size=1, service_time=0.1)
+    running = occupied(lane)
+    ticket = lane.reserve()
+    with pytest.raises(DeadlineExceeded):
+        with lane.slot(ticket, Deadline(0.05)):
+            pass
+    assert lane.stats()['timed_out'] == 1 and lane.stats()['waiting'] == 0
+    running.__exit__(None, None, None)
+
+def test_queued_request_runs_when_a_worker_frees_up():
+    lane = Lane("image", workers=1, queue_size=1, service_time=0.1)
+    running = occupied(lane)
+    ticket = lane.reserve()
+    ran = threading.Event()
+
+    def queued():
+        with lane.slot(ticket, Deadline(1)):
+            ran.set()
+
+    waiter = threading.Thread(target=queued)
+    waiter.start()
+    time.sleep(0.05)
+    assert not ran.is_set()
+    running.__exit__(None, None, None)
+    waiter.join(1)
+    assert ran.is_set()
+    assert lane.stats()['admitted'] == 2
+
+def test_full_lane_answers_429(tmp_path, monkeypatch):
+    blobstore.set_store(blobstore.BlobStore(str(tmp_path)))
+    lane = Lane("image", workers=1, queue_size=1, service_time=2)
+    monkeypatch.setitem(admission._lanes, "image", lane)
+    running = occupied(lane)
+    waiting = lane.reserve()
+    try:
+        response = app.app.test_client().post("/api/analyze", data={"file": (io.BytesIO(JPEG), "photo.jpg")})
+    finally:
+        waiting.release()
+        running.__exit__(None, None, None)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == "3"
+    assert response.get_json()['lane'] == "image"
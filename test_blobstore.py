@@ -0,0 +1,72 @@
+import io
+import os
+import time
+import admission
+import app
+import blobstore
+from admission import Lane
+from blobstore import BlobStore
+
+JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01" + b"\x00" * 64
+
+def stored(store, name, size):
+    """Add `size` bytes to `store` as digest `name`, returning its referenced path."""
+    temp_path = os.path.join(store.directory, f".ingest-{name}")
+    with open(temp_path, "wb") as temp:
+        temp.write(b"x" * size)
+    return store.add(temp_path, name, ".mp4")
+
+def test_same_content_is_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path), quota=1000, grace=0)
+    first, second = stored(store, "a" * 64, 100), stored(store, "a" * 64, 100)
+    assert first == second
+    stats = store.stats()
+    assert (stats['files'], stats['bytes'], stats['deduplicated']) == (1, 100, 1)
+    assert stats['referenced_files'] == 1
+    store.release(first)
+    assert store.stats()['referenced_files'] == 1  # still held by the second add
+    store.release(second)
+    assert store.stats()['referenced_files'] == 0
+
+def test_least_recently_used_unreferenced_blobs_are_evicted(tmp_path):
+    store = BlobStore(str(tmp_path), quota=250, grace=0)
+    old, held = stored(store, "a" * 64, 100), stored(store, "b" * 64, 100)
+    store.release(old)
+    newest = stored(store, "c" * 64, 100)
+    assert not os.path.exists(old)
+    assert os.path.exists(held) and os.path.exists(newest)
+    assert store.stats()['evicted'] == 1
+
+def test_recently_used_blobs_survive_the_quota(tmp_path):
+    store = BlobStore(str(tmp_path), quota=150, grace=60)
+    first = stored(store, "a" * 64, 100)
+    store.release(first)
+    stored(store, "b" * 64, 100)
+    assert os.path.exists(first)
+    assert store.sweep() == 0
+
+def test_sweep_removes_abandoned_partial_uploads(tmp_path):
+    store = BlobStore(str(tmp_path))
+    partial = tmp_path / ".ingest-abandoned"
+    partial.write_bytes(b"x")
+    stale = time.time() - blobstore.PARTIAL_UPLOAD_TTL - 1
+    os.utime(partial, (stale, stale))
+    store.sweep()
+    assert not partial.exists()
+    assert store.stats()['partials_removed'] == 1
+
+def test_upload_turned_away_is_not_kept_referenced(tmp_path, monkeypatch):
+    blobstore.set_store(BlobStore(str(tmp_path)))
+    lane = Lane("image", workers=1, queue_size=1, service_time=2)
+    monkeypatch.setitem(admission._lanes, "image", lane)
+    running = lane.slot(lane.reserve())
+    running.__enter__()
+    waiting = lane.reserve()
+    try:
+        response = app.app.test_client().post("/api/analyze", data={"file": (io.BytesIO(JPEG), "photo.jpg")})
+    finally:
+        waiting.release()
+        running.__exit__(None, None, None)
+    assert response.status_code == 429
+    stats = blobstore.get_store().stats()
+    assert stats['files'] == 1 and stats['referenced_files'] == 0
@@ -0,0 +1,47 @@
+import app
+import cache
+import mlmodel
+from resilience import BackendUnavailable
+
+def frame(label, confidence=0.9):
+    other = "Fake" if label == "Real" else "Real"
+    return ({'label': label, 'confidences': [{'label': label, 'confidence': confidence},
+                                             {'label': other, 'confidence': 1 - confidence}]}, None)
+
+def detect_with(results, tmp_path, monkeypatch):
+    """Run app.detect on a video whose frames came back as `results`; return (result, cached)."""
+    cache.set_cache(cache.ResultCache(path=str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(mlmodel, "video_by_frames",
+                        lambda *args, **kwargs: mlmodel.combine_frame_results(results))
+    digest = "0" * 64
+    result = app.detect("video.mp4", digest, frames=object())
+    return result, cache.get_cache().contains(digest, "detection")
+
+def test_complete_video_verdict_is_cached(tmp_path, monkeypatch):
+    result, cached = detect_with([frame("Real")] * 3, tmp_path, monkeypatch)
+    assert result['label'] == "Real"
+    assert cached
+
+def test_verdict_with_failed_frames_is_not_cached(tmp_path, monkeypatch):
+    results = [frame("Real"), ConnectionError("Space timed out"), ConnectionError("Space timed out")]
+    result, cached = detect_with(results, tmp_path, monkeypatch)
+    assert result['label'] == "Real"
+    assert result['frame_analysis']['failed_frames'] == 2
+    assert not cached
+
+def test_verdict_with_refused_frames_is_not_cached(tmp_path, monkeypatch):
+    results = [frame("Fake"), frame("Fake"), BackendUnavailable("hf_detection", "circuit open")]
+    result, cached = detect_with(results, tmp_path, monkeypatch)
+    assert result['label'] == "Fake"
+    assert result['frame_analysis']['refused_frames'] == 1
+    assert not cached
+
+def test_no_face_verdict_with_failed_frames_is_not_cached(tmp_path, monkeypatch):
+    no_face = ({'label': 'No face detected!', 'confidences': []}, None)
+    result, cached = detect_with([no_face, TimeoutError("deadline")], tmp_path, monkeypatch)
+    assert result['label'] == "No face detected!"
+    assert not cached
+
+def test_image_verdict_is_cached():
+    assert app.is_verdict(frame("Fake")[0])
+    assert not app.is_verdict({'label': 'Error: All 3 frames failed: boom', 'confidences': []})
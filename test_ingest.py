@@ -0,0 +1,22 @@
+import pytest
+from ingest import sniff
+
+@pytest.mark.parametrize("head, expected", [
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01", ("image", ".jpg")),
+    (b"\x89PNG\r\n\x1a\n\x00\x00\x00\x0d", ("image", ".png")),
+    (b"RIFF\x00\x10\x00\x00AVI ", ("video", ".avi")),
+    (b"\x00\x00\x00\x14ftypqt  ", ("video", ".mov")),
+    # MP4 and 3GP major brands
+    *((b"\x00\x00\x00\x20ftyp" + brand, ("video", ".mp4")) for brand in (
+        b"isom", b"iso2", b"iso4", b"iso5", b"iso6", b"mp41", b"mp42", b"mp71", b"avc1", b"M4V ", b"M4VH",
+        b"MSNV", b"XAVC", b"f4v ", b"3gp4", b"3gp5", b"3gp6", b"3g2a", b"dash")),
+    # QuickTime movies that start without an ftyp atom
+    *((b"\x00\x00\x00\x08" + atom + b"\x00\x00\x00\x00", ("video", ".mov")) for atom in (b"wide", b"mdat", b"moov")),
+    # ISO base media files that are not video
+    *((b"\x00\x00\x00\x18ftyp" + brand, (None, None)) for brand in (
+        b"heic", b"heix", b"mif1", b"msf1", b"avif", b"M4A ", b"M4B ", b"M4P ")),
+    (b"RIFF\x00\x10\x00\x00WAVE", (None, None)),
+    (b"hello world!", (None, None)),
+])
+def test_sniff(head, expected):
+    assert sniff(head) == expected
@@ -0,0 +1,105 @@
+import threading
+import time
+import pytest
+from deadline import DeadlineExceeded
+from resilience import Backend, BackendUnavailable, CircuitBreaker
+
+def backend(max_concurrency=4, **breaker):
+    guarded = Backend("test", slow_call=10, max_concurrency=max_concurrency, wait=0)
+    settings = dict(min_calls=2, failure_rate=0.5, cooldown=0.05, trial_calls=2)
+    guarded.breaker = CircuitBreaker("test", 10, **{**settings, **breaker})
+    return guarded
+
+def fail(guarded, error=ConnectionError):
+    with pytest.raises(error):
+        with guarded.guard():
+            raise error("backend failed")
+
+def succeed(guarded):
+    with guarded.guard():
+        pass
+
+def test_breaker_opens_and_rejects_without_calling():
+    guarded = backend()
+    fail(guarded)
+    fail(guarded)
+    assert guarded.breaker.state == "open"
+    assert not guarded.available
+
+    called = []
+    with pytest.raises(BackendUnavailable, match="circuit breaker is open"):
+        with guarded.guard():
+            called.append(True)
+    assert not called
+    assert guarded.stats()['rejected'] == 1
+    with pytest.raises(BackendUnavailable):
+        guarded.check()
+
+def test_half_open_trials_close_the_breaker():
+    guarded = backend()
+    fail(guarded)
+    fail(guarded)
+    time.sleep(0.06)
+    assert guarded.available
+    succeed(guarded)
+    assert guarded.breaker.state == "half_open"
+    succeed(guarded)
+    assert guarded.breaker.state == "closed"
+
+def test_failed_trial_reopens_the_breaker():
+    guarded = backend()
+    fail(guarded)
+    fail(guarded)
+    time.sleep(0.06)
+    fail(guarded)
+    assert guarded.breaker.state == "open"
+    with pytest.raises(BackendUnavailable):
+        succeed(guarded)
+
+def test_half_open_lets_only_the_trial_calls_through():
+    guarded = backend(trial_calls=1)
+    fail(guarded)
+    fail(guarded)
+    time.sleep(0.06)
+    with guarded.guard():
+        with pytest.raises(BackendUnavailable):
+            succeed(guarded)  # the one trial is still running
+    assert guarded.breaker.state == "closed"
+
+def test_deadline_is_not_held_against_the_backend():
+    guarded = backend()
+    for _ in range(3):
+        fail(guarded, DeadlineExceeded)
+    assert guarded.breaker.state == "closed"
+    assert guarded.stats()['calls'] == 0
+
+def test_deadline_gives_back_a_half_open_trial():
+    guarded = backend(trial_calls=1)
+    fail(guarded)
+    fail(guarded)
+    time.sleep(0.06)
+    fail(guarded, DeadlineExceeded)
+    succeed(guarded)
+    assert guarded.breaker.state == "closed"
+
+def test_full_bulkhead_fails_fast():
+    guarded = backend(max_concurrency=1)
+    inside, release = threading.Event(), threading.Event()
+
+    def hold():
+        with guarded.guard():
+            inside.set()
+            release.wait(1)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    inside.wait(1)
+    start = time.monotonic()
+    with pytest.raises(BackendUnavailable, match="1 calls already in flight"):
+        succeed(guarded)
+    assert time.monotonic() - start < 0.05
+    release.set()
+    holder.join()
+    succeed(guarded)
+    assert guarded.stats()['rejected'] == 1
+    assert guarded.breaker.state == "closed"
@@ -0,0 +1,110 @@
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from singleflight import SingleFlight
+
+KEY = "ab" * 32
+
+def followers_of(group, fn, count=4):
+    """Run `fn` as a leader with `count` callers joining it; returns their futures and the leader's."""
+    started, release = threading.Event(), threading.Event()
+    joined = []
+
+    def leader():
+        started.set()
+        release.wait(2)
+        return fn()
+
+    executor = ThreadPoolExecutor(count + 1)
+    first = executor.submit(group.do, KEY, leader)
+    started.wait(1)
+    followers = [executor.submit(group.do, KEY, lambda: pytest.fail("a follower ran the call"),
+                                 on_join=lambda: joined.append(True))
+                 for _ in range(count)]
+    while sum(group.waiters().values()) < count:
+        time.sleep(0.01)
+    release.set()
+    executor.shutdown(wait=True)
+    assert len(joined) == count
+    return first, followers
+
+@pytest.mark.parametrize("lock_dir", ["off", "dir"])
+def test_followers_get_the_leaders_result(tmp_path, lock_dir):
+    group = SingleFlight(lock_dir=str(tmp_path) if lock_dir == "dir" else "off")
+    calls = []
+    first, followers = followers_of(group, lambda: calls.append(True) or {"label": "Fake"})
+    assert first.result() == ({"label": "Fake"}, False)
+    assert [follower.result() for follower in followers] == [({"label": "Fake"}, True)] * 4
+    assert len(calls) == 1
+    assert not group.in_flight(KEY)
+
+def test_followers_get_the_leaders_error():
+    group = SingleFlight(lock_dir="off")
+
+    def broken():
+        raise ValueError("analysis failed")
+
+    first, followers = followers_of(group, broken)
+    for caller in [first, *followers]:
+        with pytest.raises(ValueError, match="analysis failed"):
+            caller.result()
+    assert not group.in_flight(KEY)
+
+def test_follower_gives_up_at_its_timeout():
+    group = SingleFlight(lock_dir="off")
+    release = threading.Event()
+    with ThreadPoolExecutor(1) as executor:
+        leader = executor.submit(group.do, KEY, lambda: release.wait(2))
+        while not group.in_flight(KEY):
+            time.sleep(0.01)
+        with pytest.raises(TimeoutError):
+            group.do(KEY, lambda: None, timeout=0.05)
+        release.set()
+        assert leader.result() == (True, False)
+
+def other_process(tmp_path, fn):
+    """Run `fn` under the file lock as another process would, returning (started, release, future)."""
+    started, release = threading.Event(), threading.Event()
+
+    def leader():
+        started.set()
+        release.wait(2)
+        return fn()
+
+    executor = ThreadPoolExecutor(1)
+    future = executor.submit(SingleFlight(lock_dir=str(tmp_path)).do, KEY, leader)
+    started.wait(1)
+    executor.shutdown(wait=False)
+    return release, future
+
+def waiting_for_lock(group):
+    while not group.stats()['in_flight'].get(KEY[:12], {}).get('waiting_on_other_process'):
+        time.sleep(0.01)
+
+def test_process_waiting_on_the_lock_reads_the_holders_result(tmp_path):
+    # Each SingleFlight opens its own lock file descriptor, so two of them
+    # contend for the flock like two processes would
+    release, holder = other_process(tmp_path, lambda: "verdict")
+    group = SingleFlight(lock_dir=str(tmp_path))
+    with ThreadPoolExecutor(1) as executor:
+        waiter = executor.submit(group.do, KEY, lambda: pytest.fail("ran the call again"))
+        waiting_for_lock(group)
+        release.set()
+        assert waiter.result(2) == ("verdict", True)
+    assert holder.result() == ("verdict", False)
+    assert group.stats()['shared_across_processes'] == 1
+
+def test_process_waiting_on_a_failed_holder_runs_the_call_itself(tmp_path):
+    def broken():
+        raise ValueError("analysis failed")
+
+    release, holder = other_process(tmp_path, broken)
+    group = SingleFlight(lock_dir=str(tmp_path))
+    with ThreadPoolExecutor(1) as executor:
+        waiter = executor.submit(group.do, KEY, lambda: "verdict")
+        waiting_for_lock(group)
+        release.set()
+        assert waiter.result(2) == ("verdict", False)
+    with pytest.raises(ValueError):
+        holder.result()
@@ -1,31 +1,39 @@
+import argparse
 import os
+import random
 import sys
+import tempfile
+import time
 import mlmodel
+import observability
+from bench import percentile, stage_summaries
+from bench_frames import make_synthetic_video
+from fakes import FakeDetectionClient, Latency
 
 def test_video_frames(video_path):
     """Test the video_by_frames function with a specific video file."""
     print(f"Testing video_by_frames with: {video_path}")
     print(f"File exists: {os.path.exists(video_path)}")
-    
+
     try:
         # Process the video using our new function
         result = mlmodel.video_by_frames(video_path, max_frames=5)
-        
+
         # Print the results
         print("\nResults:")
         print(f"Label: {result.get('label', 'N/A')}")
-        
+
         # Print confidences
         confidences = result.get('confidences', [])
         for conf in confidences:
             print(f"  {conf.get('label', 'N/A')}: {conf.get('confidence', 0)}")
-        
+
         # Print frame analysis
         frame_analysis = result.get('frame_analysis', {})
         print("\nFrame Analysis:")
         for key, value in frame_analysis.items():
             print(f"  {key}: {value}")
-            
+
         return result
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -33,13 +41,48 @@ def test_video_frames(video_path):
         print(f"Traceback: {traceback.format_exc()}")
         return None
 
+def time_video_frames(video_path, repeats):
+    """Run video_by_frames `repeats` times, returning wall times and stage timings."""
+    timings = []
+    observability.media_type.set("video")
+    with observability.capture() as samples:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            mlmodel.video_by_frames(video_path, max_frames=5)
+            timings.append(time.perf_counter() - start)
+    return timings, samples
+
 if __name__ == "__main__":
-    # Check if a video path was provided
-    if len(sys.argv) > 1:
-        video_path = sys.argv[1]
-    else:
-        # Use a default video path
-        video_path = os.path.join("pics", "world.mp4")
-    
-    # Run the test
-    test_video_frames(video_path) 
\ No newline at end of file
+    # Usage: python test_video_frames.py [video_path] [--live] [--repeats N] [--max-p95 SECONDS]
+    # Without --live the detection Space is replaced by a seeded fake, and
+    # without a video path a synthetic one is used, so runs are comparable
+    parser = argparse.ArgumentParser(description="Time video_by_frames on one video.")
+    parser.add_argument("video_path", nargs="?")
+    parser.add_argument("--live", action="store_true", help="call the real detection Space")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--hf-latency", default="0.3:1", help="fake Space latency, median[:p99] seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-p95", type=float, help="fail if the p95 wall time exceeds this many seconds")
+    args = parser.parse_args()
+
+    video_path = args.video_path
+    if video_path is None:
+        video_path = os.path.join(tempfile.mkdtemp(prefix="test_video_frames_"), "synthetic.mp4")
+        make_synthetic_video(video_path, 300, seed=args.seed)
+        # Synthetic frames contain no faces; analyse them as if they did
+        mlmodel.LOCAL_FACE_FILTER = False
+    if not args.live:
+        random.seed(args.seed)
+        fake = FakeDetectionClient(Latency.parse(args.hf_latency, args.seed))
+        mlmodel.set_client_pool(mlmodel.ClientPool(None, None, factory=lambda: fake))
+
+    test_video_frames(video_path)
+    timings, samples = time_video_frames(video_path, args.repeats)
+
+    p50, p95 = percentile(timings, 50), percentile(timings, 95)
+    print(f"\nWall time over {args.repeats} runs: p50 {p50:.3f}s, p95 {p95:.3f}s")
+    for stage, summary in stage_summaries(samples).items():
+        print(f"  {stage}: {summary['count']} calls, p50 {summary['p50']:.3f}s, p95 {summary['p95']:.3f}s")
+    if args.max_p95 is not None and p95 > args.max_p95:
+        print(f"FAIL: p95 {p95:.3f}s is over the {args.max_p95:g}s budget")
+        sys.exit(1)
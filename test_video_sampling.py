@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+import mlmodel
+from bench_frames import make_synthetic_video
+
+def open_counter(monkeypatch):
+    opened = []
+    capture = cv2.VideoCapture
+
+    def counting(*args, **kwargs):
+        opened.append(args[0])
+        return capture(*args, **kwargs)
+
+    monkeypatch.setattr(cv2, "VideoCapture", counting)
+    return opened
+
+def sampled(tmp_path, monkeypatch, mode, frame_count=120):
+    path = str(tmp_path / "synthetic.mp4")
+    make_synthetic_video(path, frame_count, width=160, height=120)
+    monkeypatch.setattr(mlmodel, "FRAME_SAMPLER", mode)
+    opened = open_counter(monkeypatch)
+    frames = mlmodel.VideoFrames(path, face_filter=False, adaptive=True, dedup="off", encoder=lambda frame: b"")
+    duration = frames.duration
+    frames.buffers
+    while frames.extend(3):
+        pass
+    indices, decoded = frames.indices, frames.frames
+    frames.cleanup()
+    return path, duration, opened, indices, decoded
+
+def test_adaptive_sampling_opens_the_video_once(tmp_path, monkeypatch):
+    path, duration, opened, indices, _ = sampled(tmp_path, monkeypatch, "sequential")
+    assert opened == [path]
+    assert duration == 4.0
+    assert len(indices) == mlmodel.ADAPTIVE_MAX_FRAMES
+
+def test_batches_read_the_frames_a_fresh_seek_would(tmp_path, monkeypatch):
+    for mode in ("seek", "sequential"):
+        path, _, _, indices, decoded = sampled(tmp_path, monkeypatch, mode)
+        monkeypatch.undo()
+        expected = dict(mlmodel.extract_frames(path, indices=indices, mode="seek", with_indices=True))
+        assert sorted(indices) == sorted(expected)
+        for index, frame in zip(indices, decoded):
+            assert np.array_equal(frame, expected[index]), (mode, index)
+
+def test_settle_closes_the_video(tmp_path, monkeypatch):
+    path = str(tmp_path / "synthetic.mp4")
+    make_synthetic_video(path, 60, width=160, height=120)
+    frames = mlmodel.VideoFrames(path, face_filter=False, adaptive=True, dedup="off", encoder=lambda frame: b"")
+    assert frames.buffers and not frames.exhausted
+    frames.settle()
+    assert frames._reader is None and frames.exhausted
+    assert frames.extend(3) == []